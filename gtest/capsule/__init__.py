@@ -12,8 +12,10 @@ if capsule_module_dir not in sys.path:
 
 # load modules
 import gtest.capsule.metric
+import gtest.capsule.memory_timeline
 try:
     import torch
+    import gtest.capsule.flop_counter
     import gtest.capsule.torch_adaptor
 except ImportError:
     pass
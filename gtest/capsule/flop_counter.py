@@ -0,0 +1,174 @@
+import math
+from typing import Any, Callable, Dict, Literal
+
+import torch
+
+# analytical FLOP formulas follow the PyTorch FLOP counter:
+# https://dev-discuss.pytorch.org/t/the-ideal-pytorch-flop-counter-with-torch-dispatch/505
+
+aten = torch.ops.aten
+
+
+def _numel(shape) -> int:
+    return math.prod(shape)
+
+
+def _mm_flops(args, kwargs, out) -> int:
+    # [m, k] x [k, n]
+    m, k = args[0].shape
+    n = args[1].shape[-1]
+    return 2 * m * k * n
+
+
+def _addmm_flops(args, kwargs, out) -> int:
+    m, k = args[1].shape
+    n = args[2].shape[-1]
+    return 2 * m * k * n + m * n
+
+
+def _bmm_flops(args, kwargs, out) -> int:
+    # [b, m, k] x [b, k, n]
+    b, m, k = args[0].shape
+    n = args[1].shape[-1]
+    return 2 * b * m * k * n
+
+
+def _baddbmm_flops(args, kwargs, out) -> int:
+    b, m, k = args[1].shape
+    n = args[2].shape[-1]
+    return 2 * b * m * k * n + b * m * n
+
+
+def _convolution_flops(args, kwargs, out) -> int:
+    # (input, weight, bias, stride, padding, dilation, transposed, output_padding, groups)
+    x, w = args[0], args[1]
+    transposed = args[6] if len(args) > 6 else False
+    # every output (or input, for transposed conv) element is a dot product over Cin/groups * kernel
+    per_element = w.shape[1] * _numel(w.shape[2:])
+    spatial = x if transposed else _first_tensor(out)
+    return 2 * spatial.numel() * per_element
+
+
+def _sdpa_flops(args, kwargs, out) -> int:
+    # q [b, h, s, d], k [b, h, t, d], v [b, h, t, dv]: q @ k^T and attn @ v
+    q, k, v = args[0], args[1], args[2]
+    b, h, s, d = q.shape
+    t, dv = k.shape[-2], v.shape[-1]
+    return 2 * b * h * s * t * d + 2 * b * h * s * t * dv
+
+
+def _pointwise_flops(args, kwargs, out) -> int:
+    return _first_tensor(out).numel()
+
+
+def _reduction_flops(args, kwargs, out) -> int:
+    return _first_tensor(args).numel()
+
+
+def _normalization_flops(args, kwargs, out) -> int:
+    # mean, variance, normalize, scale and shift
+    return 5 * _first_tensor(args).numel()
+
+
+def _softmax_flops(args, kwargs, out) -> int:
+    # max, subtract, exp, sum, divide
+    return 5 * _first_tensor(args).numel()
+
+
+def _first_tensor(elem : Any) -> torch.Tensor:
+    if isinstance(elem, torch.Tensor):
+        return elem
+    if isinstance(elem, (list, tuple)):
+        for e in elem:
+            t = _first_tensor(e)
+            if t is not None:
+                return t
+    return None
+
+
+# {aten overload packet, flop formula}
+_flop_formulas : Dict[Any, Callable[[tuple, dict, Any], int]] = {}
+
+
+def _register(packet_names, formula):
+    for packet_name in packet_names:
+        if hasattr(aten, packet_name):
+            _flop_formulas[getattr(aten, packet_name)] = formula
+
+
+_register(["mm"], _mm_flops)
+_register(["addmm"], _addmm_flops)
+_register(["bmm"], _bmm_flops)
+_register(["baddbmm"], _baddbmm_flops)
+_register(["convolution", "_convolution"], _convolution_flops)
+_register([
+    "_scaled_dot_product_efficient_attention",
+    "_scaled_dot_product_flash_attention",
+    "_scaled_dot_product_cudnn_attention",
+], _sdpa_flops)
+_register([
+    "add", "sub", "mul", "div", "neg", "abs", "pow", "sqrt", "rsqrt", "exp", "log",
+    "relu", "gelu", "silu", "sigmoid", "tanh", "threshold_backward", "where", "clamp",
+    "addcmul", "addcdiv", "lerp",
+], _pointwise_flops)
+_register(["sum", "mean", "amax", "amin", "max", "min", "prod", "var", "std", "norm", "linalg_vector_norm"], _reduction_flops)
+_register(["native_layer_norm", "native_group_norm", "native_batch_norm", "_native_batch_norm_legit"], _normalization_flops)
+_register(["_softmax", "_log_softmax"], _softmax_flops)
+
+
+def count_flops(func : Any, args : tuple, kwargs : dict, out : Any) -> int:
+    """
+    Analytical FLOP count of an ATen op from its input / output shapes,
+    ops without a known formula (e.g., views and copies) count as 0
+    """
+    formula = _flop_formulas.get(getattr(func, "overloadpacket", func), None)
+    if formula is None:
+        return 0
+    try:
+        return formula(args, kwargs, out)
+    except (AttributeError, IndexError, TypeError, ValueError):
+        # unexpected overload signature
+        return 0
+
+
+class GWRoofline:
+    """
+    Roofline model of a device, classify an op or module as compute- or memory-bound
+    by comparing its arithmetic intensity (FLOP / byte) to the ridge point of the device
+    """
+
+    def __init__(self, peak_flops : float, peak_bandwidth : float):
+        """
+        Parameters:
+            peak_flops (float): peak compute throughput of the device, in FLOP/s
+            peak_bandwidth (float): peak memory bandwidth of the device, in bytes/s
+        """
+        assert(peak_flops > 0 and peak_bandwidth > 0)
+        self.peak_flops : float = peak_flops
+        self.peak_bandwidth : float = peak_bandwidth
+
+
+    @property
+    def ridge_point(self) -> float:
+        """
+        Arithmetic intensity (FLOP / byte) where the device turns from memory- to compute-bound
+        """
+        return self.peak_flops / self.peak_bandwidth
+
+
+    def classify(self, flops : int, nbytes : int) -> Literal["compute", "memory"]:
+        if nbytes == 0:
+            return "compute"
+        return "compute" if flops / nbytes >= self.ridge_point else "memory"
+
+
+    def attainable_flops(self, flops : int, nbytes : int) -> float:
+        """
+        Attainable throughput (FLOP/s) given the arithmetic intensity
+        """
+        if nbytes == 0:
+            return self.peak_flops
+        return min(self.peak_flops, self.peak_bandwidth * flops / nbytes)
+
+
+__all__ = [ "GWRoofline", "count_flops" ]
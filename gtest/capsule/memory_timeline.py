@@ -0,0 +1,168 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# ops that materialize a copy of their input (overload name stripped)
+_COPY_OPS = frozenset([ "clone", "_to_copy", "copy", "copy_", "contiguous", "to" ])
+
+
+class GWTensorLifetime:
+    """
+    Lifetime of the storage of a tensor (shared by all its views), from the op producing it
+    to the last op consuming it; shape / dtype are of the tensor first seen using the storage
+    """
+    __slots__ = ("device", "ptr", "nbytes", "shape", "dtype", "begin", "end", "last_use", "producer_op", "producer_module")
+
+    def __init__(
+        self,
+        device : str,
+        ptr : int,
+        nbytes : int,
+        shape : str,
+        dtype : str,
+        begin : int,
+        producer_op : Optional[str],
+        producer_module : Optional[str]
+    ):
+        self.device : str = device
+        self.ptr : int = ptr
+        self.nbytes : int = nbytes
+        self.shape : str = shape
+        self.dtype : str = dtype
+
+        # index of the producing op and of the last op the tensor is alive at, begin is -1 for
+        # tensors never produced within the trace (e.g., parameters and model inputs), which stay
+        # alive until the end of the trace unless their address gets reused
+        self.begin : int = begin
+        self.end : int = begin
+        self.last_use : int = begin
+        self.producer_op : Optional[str] = producer_op
+        self.producer_module : Optional[str] = producer_module
+
+
+    def to_dict(self) -> Dict[str, Any]:
+        return { name: getattr(self, name) for name in self.__slots__ }
+
+
+class GWMemoryTimeline:
+    """
+    Reconstruct tensor lifetimes from the recorded op trace, and compute the live bytes
+    after every op per device, with the peak attributed to ops / modules.
+
+    Each op record is (op name, module path, inputs, outputs), where each tensor is
+    (device, ptr, nbytes, shape, dtype) with ptr / nbytes of its storage, so that views of
+    a tensor (slices, splits, unbinds, ...) are not counted as allocations of their own.
+    """
+
+    def __init__(self, records : List[Tuple[str, str, List[Tuple], List[Tuple]]]):
+        self._records : List[Tuple[str, str, List[Tuple], List[Tuple]]] = records
+        self.lifetimes : List[GWTensorLifetime] = []
+        self.redundant_copies : List[Dict[str, Any]] = []
+        self._build()
+
+
+    def _build(self):
+        # {(device, storage ptr), lifetime of the storage currently living at the address}
+        live : Dict[Tuple[str, int], GWTensorLifetime] = {}
+
+        for index, (op, module, inputs, outputs) in enumerate(self._records):
+            input_keys = set()
+            for device, ptr, nbytes, shape, dtype in inputs:
+                key = (device, ptr)
+                input_keys.add(key)
+                lifetime = live.get(key, None)
+                if lifetime is None:
+                    lifetime = GWTensorLifetime(device, ptr, nbytes, shape, dtype, -1, None, None)
+                    live[key] = lifetime
+                    self.lifetimes.append(lifetime)
+                lifetime.end = lifetime.last_use = index
+
+            for device, ptr, nbytes, shape, dtype in outputs:
+                key = (device, ptr)
+                lifetime = live.get(key, None)
+                if lifetime is not None and key in input_keys:
+                    # in-place op or view of an input, same memory keeps living
+                    lifetime.nbytes = max(lifetime.nbytes, nbytes)
+                    lifetime.end = lifetime.last_use = index
+                    continue
+                # new tensor, an older tensor at the same address must have been freed
+                lifetime = GWTensorLifetime(device, ptr, nbytes, shape, dtype, index, op, module)
+                live[key] = lifetime
+                self.lifetimes.append(lifetime)
+
+            # copy op whose output is identical in shape / dtype / device to its input
+            if op.split(".")[0] in _COPY_OPS and len(inputs) > 0 and len(outputs) > 0:
+                src, dst = inputs[0], outputs[0]
+                if src[0] == dst[0] and src[3] == dst[3] and src[4] == dst[4] and src[1] != dst[1]:
+                    self.redundant_copies.append({
+                        "index": index, "op": op, "module": module,
+                        "device": dst[0], "shape": dst[3], "dtype": dst[4], "nbytes": dst[2]
+                    })
+
+        # external tensors are held outside of the trace (parameters, inputs kept by the caller),
+        # the ones whose address is never reused are alive until the end of the trace
+        for lifetime in live.values():
+            if lifetime.begin < 0:
+                lifetime.end = len(self._records) - 1
+
+
+    def live_bytes(self) -> Dict[str, List[int]]:
+        """
+        Live bytes after each op, per device; tensors never produced within the trace
+        count as live from the beginning to the end
+        """
+        nb_ops = len(self._records)
+        deltas : Dict[str, List[int]] = {}
+        for lifetime in self.lifetimes:
+            delta = deltas.setdefault(lifetime.device, [0] * (nb_ops + 1))
+            delta[max(lifetime.begin, 0)] += lifetime.nbytes
+            delta[lifetime.end + 1] -= lifetime.nbytes
+
+        timelines : Dict[str, List[int]] = {}
+        for device, delta in deltas.items():
+            timeline, current = [], 0
+            for i in range(nb_ops):
+                current += delta[i]
+                timeline.append(current)
+            timelines[device] = timeline
+        return timelines
+
+
+    def peaks(self, top_k : int = 10) -> Dict[str, Dict[str, Any]]:
+        """
+        Peak live bytes per device, attributed to the op / module executing at the peak,
+        together with the largest tensors alive at that moment
+        """
+        results : Dict[str, Dict[str, Any]] = {}
+        for device, timeline in self.live_bytes().items():
+            if len(timeline) == 0:
+                continue
+            index = max(range(len(timeline)), key=timeline.__getitem__)
+            op, module, _, _ = self._records[index]
+            alive = [
+                lifetime for lifetime in self.lifetimes
+                if lifetime.device == device and max(lifetime.begin, 0) <= index <= lifetime.end
+            ]
+            alive.sort(key=lambda lifetime: -lifetime.nbytes)
+            results[device] = {
+                "index": index,
+                "peak_bytes": timeline[index],
+                "op": op,
+                "module": module,
+                "top_tensors": [ lifetime.to_dict() for lifetime in alive[:top_k] ],
+            }
+        return results
+
+
+    def bytes_by_module(self, device : str, index : int) -> Dict[str, int]:
+        """
+        Attribute the bytes alive at the given op index to the modules producing them
+        """
+        attribution : Dict[str, int] = {}
+        for lifetime in self.lifetimes:
+            if lifetime.device == device and max(lifetime.begin, 0) <= index <= lifetime.end:
+                module = lifetime.producer_module if lifetime.producer_module is not None else "<external>"
+                attribution[module] = attribution.get(module, 0) + lifetime.nbytes
+        return attribution
+
+
+__all__ = [ "GWMemoryTimeline", "GWTensorLifetime" ]
@@ -1,39 +1,360 @@
 import sys
+import dis
 from abc import ABC
-import inspect
+import queue
+import atexit
 import hashlib
+import weakref
+import itertools
+import functools
+import threading
+from types import CodeType
+from typing import Callable, Dict, Tuple, Optional
+
+from loguru import logger
 
 import gtest.libgtest_capsule as _C_capsule
 
 
+# call-site registry: {(code object, line number), (hash, "file:line")}
+_call_site_registry : Dict[Tuple[CodeType, int], Tuple[int, str]] = {}
+
+
+def _resolve_call_site(depth : int) -> Tuple[int, str]:
+    """
+    Obtain the hash and position of the caller frame at given depth,
+    the hash is computed once per call site and memoized afterwards
+    """
+    frame = sys._getframe(depth + 1)
+    key = (frame.f_code, frame.f_lineno)
+    site = _call_site_registry.get(key, None)
+    if site is None:
+        position = f"{frame.f_code.co_filename}:{frame.f_lineno}"
+        site = (GWAppMetric._compute_hash(position), position)
+        _call_site_registry[key] = site
+    return site
+
+
+# instruction returned by report_event_trace_and_wait_instruction when the scheduler asks
+# the application to stop synchronously (i.e., the next closed metric waits for its own instruction)
+GW_INSTRUCTION_SYNC_STOP = "sync_stop"
+
+
+# objects notified around each report, e.g., the event arena of GWModelAnlyser which has to keep
+# app range events alive until the native side consumed them (the native side doesn't own them):
+#   on_report_begin(epoch): on the application thread, right before the metric is handed over
+#   on_report_end(epoch): once the native side has consumed the metric
+# listeners are replaced copy-on-write, so that notifying (on every report) is a plain iteration,
+# which is free when nobody listens
+_report_listeners : Tuple[weakref.ref, ...] = ()
+_report_listeners_lock : threading.Lock = threading.Lock()
+_report_epochs : itertools.count = itertools.count()
+
+
+def _remove_report_listener(listener_ref : weakref.ref):
+    global _report_listeners
+    with _report_listeners_lock:
+        _report_listeners = tuple(ref for ref in _report_listeners if ref is not listener_ref)
+
+
+def _add_report_listener(listener : object):
+    global _report_listeners
+    with _report_listeners_lock:
+        _report_listeners = _report_listeners + (weakref.ref(listener, _remove_report_listener),)
+
+
+def _notify_report_listeners(method_name : str, epoch : int):
+    for listener_ref in _report_listeners:
+        listener = listener_ref()
+        if listener is None:
+            continue
+        try:
+            getattr(listener, method_name)(epoch)
+        except Exception as e:
+            logger.error(f"report listener {listener} failed on {method_name}: {e}")
+
+
+def _report_sync(begin_hash : int, epoch : int):
+    # filter out all event happen within current metric, send to scheduler and block until scheduler let us go
+    instruction = _C_capsule.report_event_trace_and_wait_instruction(begin_hash)
+    _notify_report_listeners("on_report_end", epoch)
+    return instruction
+
+
+class _GWAppMetricReporter:
+    """
+    Background reporter of closed metrics, so that the application thread doesn't block on the
+    scheduler round trip. The application only blocks when the queue is full, or when a synchronous
+    stop is requested (by the application or by the scheduler's instruction), in which case the next
+    closed metric waits for all pending reports and its own instruction.
+    """
+
+    _STOP = object()
+
+    # seconds between liveness checks of the reporter thread while blocked on the queue
+    _POLL_INTERVAL = 0.1
+
+    def __init__(self, max_queue_size : int, max_batch_size : int):
+        self._max_batch_size : int = max_batch_size
+        self._queue : queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._sync_requested : threading.Event = threading.Event()
+
+        # guards submission against stop, so that no metric is queued after the reporter closed;
+        # closed is set without the lock, so that submissions blocked on a full queue give up
+        self._lock : threading.Lock = threading.Lock()
+        self._closed : bool = False
+
+        # number of metrics whose report failed, and number of metrics reported synchronously
+        # because the reporter thread was gone
+        self.nb_failed : int = 0
+        self.nb_fallbacks : int = 0
+
+        self._thread : threading.Thread = threading.Thread(
+            target=self._run, name="gw_app_metric_reporter", daemon=True
+        )
+        self._thread.start()
+
+
+    def submit(self, begin_hash : int, epoch : int) -> bool:
+        """
+        Queue the closed metric, returns False if it must be reported synchronously by the caller
+        (reporter closed or its thread is gone)
+        """
+        with self._lock:
+            if self._closed or not self._thread.is_alive():
+                self.nb_fallbacks += 1
+                return False
+            do_sync = self._sync_requested.is_set()
+            if do_sync:
+                self._sync_requested.clear()
+            else:
+                # block only if the queue is full, and never on a dead or closed reporter
+                while True:
+                    try:
+                        self._queue.put((begin_hash, epoch), timeout=_GWAppMetricReporter._POLL_INTERVAL)
+                        return True
+                    except queue.Full:
+                        if self._closed or not self._thread.is_alive():
+                            self.nb_fallbacks += 1
+                            return False
+
+        self.flush()
+        self._handle_instruction(_report_sync(begin_hash, epoch))
+        return True
+
+
+    def request_sync_stop(self):
+        self._sync_requested.set()
+
+
+    def _handle_instruction(self, instruction):
+        if instruction == GW_INSTRUCTION_SYNC_STOP:
+            self._sync_requested.set()
+
+
+    def flush(self, timeout : Optional[float] = None) -> bool:
+        """
+        Block until all queued metrics are reported, returns False on timeout
+        or if the reporter thread is gone with metrics still pending
+        """
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(
+                lambda: self._queue.unfinished_tasks == 0 or not self._thread.is_alive(),
+                timeout
+            ) and self._queue.unfinished_tasks == 0
+
+
+    def stop(self, timeout : Optional[float] = None) -> bool:
+        """
+        Report all pending metrics and stop the reporter thread, returns False on timeout
+        """
+        self._closed = True
+
+        # wait for submissions in flight, which stop blocking on a full queue once closed
+        if not self._lock.acquire(timeout=-1 if timeout is None else timeout):
+            logger.warning("timeout on stopping the app metric reporter, pending metrics are dropped")
+            return False
+        self._lock.release()
+
+        if self._thread.is_alive():
+            try:
+                self._queue.put(_GWAppMetricReporter._STOP, timeout=timeout)
+            except queue.Full:
+                logger.warning("timeout on stopping the app metric reporter, pending metrics are dropped")
+                return False
+            self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("timeout on stopping the app metric reporter, pending metrics are dropped")
+            return False
+
+        # the reporter thread is gone before draining the queue, report the rest synchronously
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return True
+            if item is not _GWAppMetricReporter._STOP:
+                self.nb_fallbacks += 1
+                self._report_one(*item)
+            self._queue.task_done()
+
+
+    def _report_one(self, begin_hash : int, epoch : int):
+        try:
+            self._handle_instruction(_report_sync(begin_hash, epoch))
+        except Exception as e:
+            self.nb_failed += 1
+            logger.error(f"failed to report app metric {begin_hash}, dropped: {e}")
+
+
+    def _run(self):
+        while True:
+            # wait for the first metric, then drain whatever else is queued into the same batch
+            batch = [ self._queue.get() ]
+            while len(batch) < self._max_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            do_stop = False
+            for item in batch:
+                try:
+                    if item is _GWAppMetricReporter._STOP:
+                        do_stop = True
+                    else:
+                        self._report_one(*item)
+                finally:
+                    self._queue.task_done()
+            if do_stop:
+                return
+
+
+# active background reporter, None when reporting synchronously
+_reporter : Optional[_GWAppMetricReporter] = None
+
+# guards switching between synchronous and asynchronous reporting
+_reporter_lock : threading.Lock = threading.Lock()
+
+
+def _report(begin_hash : int):
+    # send to scheduler and block until scheduler let us go
+    # (or hand over to the background reporter in asynchronous mode)
+    epoch = next(_report_epochs)
+    _notify_report_listeners("on_report_begin", epoch)
+    reporter = _reporter
+    if reporter is None or not reporter.submit(begin_hash, epoch):
+        _report_sync(begin_hash, epoch)
+
+
 class GWAppMetric(ABC):
+    # global switch, markers only cost this attribute check when disabled
+    enabled : bool = True
+
+    # defaults of metrics created while disabled, so that nothing is assigned on that path
+    _name : str = None
+    _begin_hash : int = None
+    _end_hash : int = None
+    _start_line_position : str = None
+    _end_line_position : str = None
+
     def __init__(self, name : str):
+        if not GWAppMetric.enabled:
+            return
         self._name : str = name
-        self._begin_hash : int = None
-        self._end_hash : int = None
-        self._start_line_position : str = None
-        self._end_line_position : str = None
-    
+
         # calculate unique hash for the metric based on its code position
-        frame = inspect.currentframe().f_back
-        self._start_line_position = f"{frame.f_code.co_filename}:{frame.f_lineno}"
-        self._begin_hash = self._compute_hash(self._start_line_position)
+        self._begin_hash, self._start_line_position = _resolve_call_site(1)
 
         # start capturing of the current metric
         _C_capsule.start_app_metric_trace_capture(self._name, self._begin_hash, self._start_line_position)
 
 
     def eclipse(self):
+        # metric is created while disabled
+        if self._begin_hash is None:
+            return
+
         # calculate unique hash for the metric based on its code position
-        frame = inspect.currentframe().f_back
-        self._end_line_position = f"{frame.f_code.co_filename}:{frame.f_lineno}"
-        self._end_hash = self._compute_hash(self._end_line_position)
+        self._end_hash, self._end_line_position = _resolve_call_site(1)
 
         # stop capturing of the current metric
         _C_capsule.stop_app_metric_trace_capture(self._begin_hash, self._end_hash, self._end_line_position)
 
-        # filter out all event happen within current metric, send to scheduler and block until scheduler let us go
-        _C_capsule.report_event_trace_and_wait_instruction(self._begin_hash)
+        # report to the scheduler
+        _report(self._begin_hash)
+
+
+    @staticmethod
+    def enable():
+        GWAppMetric.enabled = True
+
+
+    @staticmethod
+    def disable():
+        GWAppMetric.enabled = False
+
+
+    @staticmethod
+    def enable_async_reporting(max_queue_size : int = 1024, max_batch_size : int = 64):
+        """
+        Report closed metrics from a background thread instead of blocking the application
+
+        Parameters:
+            max_queue_size (int): maximum number of pending metrics before eclipse() blocks
+            max_batch_size (int): maximum number of metrics reported per wake-up of the reporter
+        """
+        global _reporter
+        assert(max_queue_size > 0 and max_batch_size > 0)
+        with _reporter_lock:
+            if _reporter is not None:
+                return
+            _reporter = _GWAppMetricReporter(max_queue_size, max_batch_size)
+
+
+    @staticmethod
+    def disable_async_reporting(timeout : Optional[float] = None) -> bool:
+        """
+        Report all pending metrics and switch back to synchronous reporting
+
+        Parameters:
+            timeout (float): seconds to wait for pending metrics, default to be unlimited
+
+        Returns:
+            bool: False if pending metrics were dropped due to timeout
+        """
+        global _reporter
+        with _reporter_lock:
+            reporter, _reporter = _reporter, None
+        if reporter is None:
+            return True
+        return reporter.stop(timeout)
+
+
+    @staticmethod
+    def flush(timeout : Optional[float] = None) -> bool:
+        """
+        Block until all pending metrics are reported
+
+        Parameters:
+            timeout (float): seconds to wait, default to be unlimited
+
+        Returns:
+            bool: False on timeout
+        """
+        reporter = _reporter
+        if reporter is None:
+            return True
+        return reporter.flush(timeout)
+
+
+    @staticmethod
+    def request_sync_stop():
+        """
+        Make the next closed metric wait for all pending reports and its own scheduler instruction
+        """
+        if _reporter is not None:
+            _reporter.request_sync_stop()
 
 
     @staticmethod
@@ -42,8 +363,83 @@ class GWAppMetric(ABC):
         return int.from_bytes(hash_bytes[:8], byteorder='big', signed=False)
 
 
+    def __hash__(self):
+        return self._begin_hash if self._begin_hash is not None else id(self)
+
+
+class GWAppMetricSite:
+    """
+    Metric whose call site is resolved once at definition time, to be used as
+    a context manager or a decorator, e.g.,
+
+        fwd_metric = GWAppMetricSite("forward")
+
+        with fwd_metric:
+            ...
+
+        @GWAppMetricSite("train_step")
+        def train_step(...):
+            ...
+    """
+
+    def __init__(self, name : str):
+        self._name : str = name
+
+        # the begin position is where the site is defined
+        self._begin_hash, self._start_line_position = _resolve_call_site(1)
+
+        # whether each (possibly nested) with block entered on the thread started a capture, so that
+        # toggling GWAppMetric.enabled within a block never leaves a capture unpaired
+        self._local : threading.local = threading.local()
+
+
+    def __enter__(self) -> 'GWAppMetricSite':
+        captured = GWAppMetric.enabled
+        if captured:
+            _C_capsule.start_app_metric_trace_capture(self._name, self._begin_hash, self._start_line_position)
+        try:
+            self._local.captured.append(captured)
+        except AttributeError:
+            self._local.captured = [ captured ]
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._local.captured.pop():
+            # the end position is where the with block exits, memoized as any call site
+            end_hash, end_line_position = _resolve_call_site(1)
+            _C_capsule.stop_app_metric_trace_capture(self._begin_hash, end_hash, end_line_position)
+            _report(self._begin_hash)
+        return False
+
+
+    def __call__(self, func : Callable) -> Callable:
+        # the region of a decorated function ends at its last line
+        code = func.__code__
+        last_line = max((line for _, line in dis.findlinestarts(code) if line is not None), default=code.co_firstlineno)
+        end_line_position = f"{code.co_filename}:{last_line}"
+        end_hash = GWAppMetric._compute_hash(end_line_position)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not GWAppMetric.enabled:
+                return func(*args, **kwargs)
+            _C_capsule.start_app_metric_trace_capture(self._name, self._begin_hash, self._start_line_position)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _C_capsule.stop_app_metric_trace_capture(self._begin_hash, end_hash, end_line_position)
+                _report(self._begin_hash)
+        return wrapper
+
+
     def __hash__(self):
         return self._begin_hash
 
 
-__all__ = [ "GWAppMetric" ]
+# make sure pending metrics are reported before exit, without hanging the exit forever
+_EXIT_FLUSH_TIMEOUT = 30.0
+atexit.register(GWAppMetric.disable_async_reporting, _EXIT_FLUSH_TIMEOUT)
+
+
+__all__ = [ "GWAppMetric", "GWAppMetricSite" ]
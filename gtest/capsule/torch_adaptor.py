@@ -1,10 +1,22 @@
-from typing import Any, List
+import math
+import time
+import fnmatch
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Iterable, Union
 
 import torch
 import torch.nn as nn
 from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_map
+from loguru import logger
 
 import gtest.libgtest_capsule as _C_capsule
+from gtest.capsule.metric import _add_report_listener
+from gtest.common.stats import GWQuantileSketch
+from gtest.common.event_timer import GWDeferredEventTimer
+from gtest.capsule.flop_counter import *
+from gtest.capsule.memory_timeline import *
 
 # take these refs:
 # https://dev-discuss.pytorch.org/t/what-and-why-is-torch-dispatch/557
@@ -14,10 +26,299 @@ import gtest.libgtest_capsule as _C_capsule
 # https://dev-discuss.pytorch.org/t/torchdispatchmode-for-debugging-testing-and-more/717
 
 
+class _GWTensorMetaTable:
+    """
+    Intern table of tensor shape / dtype / device, so that the dispatch hot path only
+    records small integer ids, and the string form of each distinct value is formatted once.
+
+    Ids are held by plans, memory traces and pending events, so they are never evicted; instead
+    the number of interned shapes (the only unbounded kind, e.g., with dynamic sequence lengths)
+    is capped, beyond which records carry the torch.Size itself in place of its id
+    """
+
+    def __init__(self, max_shapes : int = 1 << 16):
+        """
+        Parameters:
+            max_shapes (int): maximum number of interned shapes
+        """
+        assert(max_shapes > 0)
+        self._max_shapes : int = max_shapes
+        self.nb_shapes_overflowed : int = 0
+
+        # {value, id}, and the string form of each id
+        self._shape_ids : Dict[Any, int] = {}
+        self._shape_strs : List[str] = []
+        self._dtype_ids : Dict[Any, int] = {}
+        self._dtype_strs : List[str] = []
+        self._device_ids : Dict[Any, int] = {}
+        self._device_strs : List[str] = []
+
+        # number of elements of each shape, element size of each dtype, and whether each device is a GPU
+        self._shape_numels : List[int] = []
+        self._dtype_itemsizes : List[int] = []
+        self._device_is_cuda : List[bool] = []
+
+        # only taken when interning new values, lookups are lock-free
+        self._lock : threading.Lock = threading.Lock()
+
+
+    def record(self, tensor : torch.Tensor, with_ptr : bool = True) -> Tuple[Union[int, torch.Size], int, int, int]:
+        """
+        Obtain the compact record (shape_id, dtype_id, ptr, device_id) of the tensor,
+        ptr is 0 if not with_ptr (e.g., for meta / fake tensors which have no storage);
+        shape_id is the torch.Size itself once the shape table is full
+        """
+        shape = tensor.shape
+        shape_id = self._shape_ids.get(shape, None)
+        if shape_id is None:
+            with self._lock:
+                shape_id = self._shape_ids.get(shape, None)
+                if shape_id is None:
+                    if len(self._shape_strs) >= self._max_shapes:
+                        if self.nb_shapes_overflowed == 0:
+                            logger.warning(
+                                f"more than {self._max_shapes} distinct tensor shapes, "
+                                f"further shapes are recorded without interning"
+                            )
+                        self.nb_shapes_overflowed += 1
+                        shape_id = shape
+                    else:
+                        self._shape_strs.append(str(list(shape)))
+                        self._shape_numels.append(shape.numel())
+                        shape_id = self._shape_ids[shape] = len(self._shape_strs) - 1
+
+        dtype = tensor.dtype
+        dtype_id = self._dtype_ids.get(dtype, None)
+        if dtype_id is None:
+            with self._lock:
+                dtype_id = self._dtype_ids.get(dtype, None)
+                if dtype_id is None:
+                    self._dtype_strs.append(str(dtype).split(".")[-1])
+                    self._dtype_itemsizes.append(tensor.element_size())
+                    dtype_id = self._dtype_ids[dtype] = len(self._dtype_strs) - 1
+
+        device = tensor.device
+        device_id = self._device_ids.get(device, None)
+        if device_id is None:
+            with self._lock:
+                device_id = self._device_ids.get(device, None)
+                if device_id is None:
+                    self._device_strs.append(str(device))
+                    self._device_is_cuda.append(device.type == "cuda")
+                    device_id = self._device_ids[device] = len(self._device_strs) - 1
+
+        return (shape_id, dtype_id, tensor.data_ptr() if with_ptr else 0, device_id)
+
+
+    def nbytes(self, records : List[Tuple[int, int, int, int]]) -> int:
+        """
+        Total number of bytes of the recorded tensors
+        """
+        return sum(
+            self.shape_numel(shape_id) * self._dtype_itemsizes[dtype_id]
+            for shape_id, dtype_id, _, _ in records
+        )
+
+
+    def on_cuda(self, records : List[Tuple[int, int, int, int]]) -> bool:
+        """
+        Whether any of the recorded tensors lives on a GPU
+        """
+        return any(self._device_is_cuda[device_id] for _, _, _, device_id in records)
+
+
+    def shape_numel(self, shape_id : Union[int, torch.Size]) -> int:
+        return self._shape_numels[shape_id] if shape_id.__class__ is int else shape_id.numel()
+
+
+    def shape_str(self, shape_id : Union[int, torch.Size]) -> str:
+        return self._shape_strs[shape_id] if shape_id.__class__ is int else str(list(shape_id))
+
+
+    def dtype_str(self, dtype_id : int) -> str:
+        return self._dtype_strs[dtype_id]
+
+
+    def record_storage(self, tensor : torch.Tensor) -> Tuple[Union[int, torch.Size], int, int, int, int]:
+        """
+        Obtain the record (shape_id, dtype_id, storage ptr, device_id, storage nbytes) of the memory
+        the tensor lives in, which is shared by all views of it
+        """
+        shape_id, dtype_id, _, device_id = self.record(tensor, with_ptr=False)
+        try:
+            storage = tensor.untyped_storage()
+            return (shape_id, dtype_id, storage.data_ptr(), device_id, storage.nbytes())
+        except (RuntimeError, NotImplementedError):
+            # e.g., sparse tensors, which have no single storage
+            return (shape_id, dtype_id, tensor.data_ptr(), device_id, self.nbytes([ (shape_id, dtype_id, 0, device_id) ]))
+
+
+    def storages(self, records : List[Tuple[int, int, int, int, int]]) -> List[Tuple[str, int, int, str, str]]:
+        """
+        Expand storage records into (device, storage ptr, storage nbytes, shape, dtype), as consumed by GWMemoryTimeline
+        """
+        return [
+            (self._device_strs[device_id], ptr, nbytes, self.shape_str(shape_id), self._dtype_strs[dtype_id])
+            for shape_id, dtype_id, ptr, device_id, nbytes in records
+        ]
+
+
+    def export(self, records : List[Tuple[int, int, int, int]]) -> List[Dict[str, str]]:
+        """
+        Stringify compact records into the format accepted by the native side
+        """
+        return [
+            {
+                "shape": self.shape_str(shape_id),
+                "dtype": self._dtype_strs[dtype_id],
+                "ptr": str(ptr),
+                "device": self._device_strs[device_id]
+            }
+            for shape_id, dtype_id, ptr, device_id in records
+        ]
+
+
+# shared by all analysers, the set of distinct dtypes / devices is small and shapes are capped
+_tensor_meta_table : _GWTensorMetaTable = _GWTensorMetaTable()
+
+
+class _GWOpStats:
+    __slots__ = ("count", "total_ns", "min_ns", "max_ns", "nbytes", "flops", "latency_sketch")
+
+    def __init__(self):
+        self.count : int = 0
+        self.total_ns : int = 0
+        self.min_ns : int = None
+        self.max_ns : int = None
+        self.nbytes : int = 0
+        self.flops : int = 0
+        self.latency_sketch : GWQuantileSketch = GWQuantileSketch()
+
+
+    def add(self, elapsed_ns : int, nbytes : int, flops : int):
+        self.count += 1
+        self.total_ns += elapsed_ns
+        self.min_ns = elapsed_ns if self.min_ns is None else min(self.min_ns, elapsed_ns)
+        self.max_ns = elapsed_ns if self.max_ns is None else max(self.max_ns, elapsed_ns)
+        self.nbytes += nbytes
+        self.flops += flops
+        self.latency_sketch.add(elapsed_ns)
+
+
+class _GWOpStatsTable:
+    """
+    Running statistics of ops, keyed by op signature (op name, input shapes and dtypes);
+    also used for modules, whose signature is empty
+    """
+
+    def __init__(self, key_name : str = "op"):
+        self._key_name : str = key_name
+
+        # {(op name, ((shape_id, dtype_id), ...)), statistics}
+        self._stats : Dict[Tuple[str, Tuple[Tuple[int, int], ...]], _GWOpStats] = {}
+        self._lock : threading.Lock = threading.Lock()
+
+
+    def add(
+        self,
+        name : str,
+        input_tensor_info : List[Tuple[int, int, int, int]],
+        elapsed_ns : int,
+        nbytes : int,
+        flops : int = 0
+    ):
+        key = (name, tuple((shape_id, dtype_id) for shape_id, dtype_id, _, _ in input_tensor_info))
+        with self._lock:
+            stats = self._stats.get(key, None)
+            if stats is None:
+                stats = self._stats[key] = _GWOpStats()
+            stats.add(elapsed_ns, nbytes, flops)
+
+
+    def export(self, roofline : Optional[GWRoofline] = None) -> List[Dict[str, Any]]:
+        """
+        Export the aggregated table, one row per op signature
+
+        Parameters:
+            roofline (GWRoofline): if given, FLOP counts and roofline classification are included
+        """
+        rows : List[Dict[str, Any]] = []
+        with self._lock:
+            items = list(self._stats.items())
+        for (name, signature), stats in items:
+            row = {
+                self._key_name: name,
+                "input_shapes": [ _tensor_meta_table.shape_str(shape_id) for shape_id, _ in signature ],
+                "input_dtypes": [ _tensor_meta_table.dtype_str(dtype_id) for _, dtype_id in signature ],
+                "count": stats.count,
+                "total_ns": stats.total_ns,
+                "mean_ns": stats.total_ns / stats.count,
+                "min_ns": stats.min_ns,
+                "max_ns": stats.max_ns,
+                "p50_ns": stats.latency_sketch.quantile(0.5),
+                "p99_ns": stats.latency_sketch.quantile(0.99),
+                "bytes": stats.nbytes,
+            }
+            if roofline is not None:
+                row["flops"] = stats.flops
+                row["arithmetic_intensity"] = stats.flops / stats.nbytes if stats.nbytes > 0 else math.inf
+                row["achieved_flops_per_s"] = stats.flops / (stats.total_ns * 1e-9) if stats.total_ns > 0 else 0.0
+                row["bound"] = roofline.classify(stats.flops, stats.nbytes)
+            rows.append(row)
+        return rows
+
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+# whether the native app range event carries the thread / stream, older native builds don't
+_NATIVE_HAS_THREAD_ID : bool = hasattr(_C_capsule.GWEvent_App_Range, "set_thread_id")
+_NATIVE_HAS_STREAM_ID : bool = hasattr(_C_capsule.GWEvent_App_Range, "set_stream_id")
+
+
 class _GWEvent_App_Range:
-    def __init__(self, name : str):
+    __slots__ = ("_C_instance", "_slot", "_thread_id", "_stream_id", "_input_tensor_info", "_output_tensor_info")
+
+    def __init__(self, name : str, slot : int = -1):
+        self._slot : int = slot
+        self.reset(name)
+
+
+    def reset(self, name : str):
+        """
+        Start over as a new event, the native instance can't be reset so a new one is created
+        """
         self._C_instance = _C_capsule.GWEvent_App_Range(name)
 
+        # thread which creates the event, and the CUDA stream current at its beginning (if recorded)
+        self._thread_id : int = threading.get_ident()
+        self._stream_id : Optional[int] = None
+
+        # compact tensor records, only stringified when exported to the native side
+        self._input_tensor_info : List[Tuple[int, int, int, int]] = []
+        self._output_tensor_info : List[Tuple[int, int, int, int]] = []
+
+
+    def release(self):
+        """
+        Drop the native instance and the tensor records once the native side consumed the event
+        """
+        self._C_instance = None
+        self._input_tensor_info = []
+        self._output_tensor_info = []
+
+
+    @property
+    def thread_id(self) -> int:
+        return self._thread_id
+
+
+    @property
+    def stream_id(self) -> Optional[int]:
+        return self._stream_id
+
 
     def record_begin_tick(self):
         self._C_instance.record_begin_tick()
@@ -28,25 +329,660 @@ class _GWEvent_App_Range:
 
 
     def set_input_tensor_info(self, input_tensor_info : List):
-        self._C_instance.set_input_tensor_info(input_tensor_info)
+        self._input_tensor_info = input_tensor_info
 
 
     def set_output_tensor_info(self, output_tensor_info : List):
-        self._C_instance.set_output_tensor_info(output_tensor_info)
+        self._output_tensor_info = output_tensor_info
+
+
+    def export(self):
+        """
+        Hand over the tensor info (and the thread / stream, if supported by the native side) to the native instance
+        """
+        self._C_instance.set_input_tensor_info(_tensor_meta_table.export(self._input_tensor_info))
+        self._C_instance.set_output_tensor_info(_tensor_meta_table.export(self._output_tensor_info))
+        if _NATIVE_HAS_THREAD_ID:
+            self._C_instance.set_thread_id(self._thread_id)
+        if _NATIVE_HAS_STREAM_ID and self._stream_id is not None:
+            self._C_instance.set_stream_id(self._stream_id)
+
+
+class _GWModuleFrame:
+    """
+    Entry of the module range stack
+    """
+    __slots__ = ("token", "event", "begin_ns", "module", "flops", "nbytes", "timing_pair")
+
+    def __init__(self, token : int, event : Optional[_GWEvent_App_Range], begin_ns : int, module : Optional[str] = None):
+        # identity of the module instance, which pairs the post-hook with its frame
+        self.token : int = token
+        self.event : Optional[_GWEvent_App_Range] = event
+        self.begin_ns : int = begin_ns
+
+        # qualified name of the module
+        self.module : Optional[str] = module
+
+        # FLOPs and bytes of all ops executed within the module
+        self.flops : int = 0
+        self.nbytes : int = 0
+
+        # event pair timing the module on the device, None if timed on the host
+        self.timing_pair : Optional[Tuple[Any, Any]] = None
+
+
+class _GWPlannedOp:
+    """
+    Op recorded ahead of time by running the model on fake tensors
+    """
+    __slots__ = ("func", "name", "module", "input_tensor_info", "output_tensor_info", "signature")
+
+    def __init__(self, func : Any, module : str, input_tensor_info : List, output_tensor_info : List, signature : Tuple):
+        self.func : Any = func
+        self.name : str = func.__name__
+        self.module : str = module
+        self.input_tensor_info : List[Tuple[int, int, int, int]] = input_tensor_info
+        self.output_tensor_info : List[Tuple[int, int, int, int]] = output_tensor_info
+
+        # shapes / dtypes of the inputs, see _raw_signature, matched against the op at runtime
+        self.signature : Tuple = signature
+
+
+class _GWPlanState:
+    """
+    Per-thread progress of the current forward pass against the precomputed plan
+    """
+    __slots__ = ("cursor", "diverged", "ticks")
+
+    def __init__(self, nb_ops : int):
+        self.cursor : int = 0
+        self.diverged : bool = False
+
+        # [begin_ns, end_ns] of each planned op, preallocated
+        self.ticks : List[int] = [0] * (2 * nb_ops)
+
+
+class _GWPlanRecorder(TorchDispatchMode):
+    """
+    Record the op sequence of the model while it runs on fake tensors
+    """
+
+    def __init__(self, analyser : 'GWModelAnlyser'):
+        super().__init__()
+        self._analyser : 'GWModelAnlyser' = analyser
+
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs if kwargs else {}
+        input_tensor_info = _collect_tensor_info(args, with_ptr=False)
+        input_tensor_info += _collect_tensor_info(kwargs.values(), with_ptr=False)
+        out = func(*args, **kwargs)
+        self._analyser._plan.append(_GWPlannedOp(
+            func,
+            ".".join(self._analyser._plan_module_path),
+            input_tensor_info,
+            _collect_tensor_info(out, with_ptr=False),
+            _raw_signature(args, kwargs)
+        ))
+        return out
+
+
+def _raw_signature(args : Tuple, kwargs : Dict[str, Any]) -> Tuple:
+    """
+    (shape, dtype) of the tensors given directly as arguments (or within a list of arguments),
+    read without interning, so that it's cheap enough to be checked on the planned hot path
+    """
+    signature : List[Tuple[torch.Size, torch.dtype]] = []
+    for arg in (*args, *kwargs.values()):
+        if isinstance(arg, torch.Tensor):
+            signature.append((arg.shape, arg.dtype))
+        elif isinstance(arg, (list, tuple)):
+            for elem in arg:
+                if isinstance(elem, torch.Tensor):
+                    signature.append((elem.shape, elem.dtype))
+    return tuple(signature)
+
+
+def _collect_tensor_info(tensors : Any, with_ptr : bool = True, storage : bool = False) -> List[Tuple]:
+    """
+    Records of all tensors within (nested) tensors, storage records (see _GWTensorMetaTable.record_storage) if storage
+    """
+    info : List[Tuple] = []
+    def _recursive_collect(elem):
+        if isinstance(elem, torch.Tensor):
+            info.append(_tensor_meta_table.record_storage(elem) if storage else _tensor_meta_table.record(elem, with_ptr))
+        elif isinstance(elem, (list, tuple)):
+            for e in elem:
+                _recursive_collect(e)
+        elif isinstance(elem, dict):
+            for v in elem.values():
+                _recursive_collect(v)
+    _recursive_collect(tensors)
+    return info
+
+
+class _GWEventArena:
+    """
+    Arena of app range event slots, bounding the number of events alive. Events are registered to
+    the native side when they begin (so that a module precedes its ops in native order), and their
+    tensor info is exported in chunks once completed. Since the native side doesn't own the events,
+    a slot is only recycled once the report of the app metric closed after the event completed has
+    finished, i.e., the native side consumed the event; the event object of a slot is then reused,
+    with a new native instance as the native side offers no way to reset one.
+
+    Without app metric reports nothing is ever consumed: past the high-water mark new events are
+    then dropped (counted by nb_dropped), unless drop_on_overflow is disabled, in which case the
+    arena keeps growing as the native side requires.
+    """
+
+    def __init__(
+        self,
+        capacity : int,
+        high_water_mark : int,
+        flush_chunk_size : int,
+        drop_on_overflow : bool
+    ):
+        assert(capacity > 0 and 0 < high_water_mark <= capacity and flush_chunk_size > 0)
+        self._high_water_mark : int = high_water_mark
+        self._flush_chunk_size : int = flush_chunk_size
+        self._drop_on_overflow : bool = drop_on_overflow
+
+        # event of each slot (created on first use, and reused once recycled), and the indices of free slots
+        self._slots : List[Optional[_GWEvent_App_Range]] = [None] * capacity
+        self._free_slots : List[int] = list(range(capacity - 1, -1, -1))
+
+        # completed slots whose tensor info isn't exported yet, exported slots waiting for the
+        # next report, and slots waiting for the end of their report, {report epoch, slots}
+        self._committed_slots : List[int] = []
+        self._exported_slots : List[int] = []
+        self._reported_slots : Dict[int, List[int]] = {}
+
+        # number of events dropped due to overflow, and number of slots grown beyond capacity
+        self.nb_dropped : int = 0
+        self.nb_grown : int = 0
+
+        # the arena is shared by all threads running the model, and the reporter thread
+        self._lock : threading.RLock = threading.RLock()
+
+        _add_report_listener(self)
+
+
+    def acquire(self, name : str) -> Optional[_GWEvent_App_Range]:
+        """
+        Obtain a new event registered to the native side, returns None if the event is dropped due to overflow
+        """
+        with self._lock:
+            if len(self._slots) - len(self._free_slots) >= self._high_water_mark:
+                self.__export()
+                if self._drop_on_overflow:
+                    if self.nb_dropped == 0:
+                        logger.warning(
+                            "app range event arena reached its high-water mark and no app metric report "
+                            "consumed its events, dropping new events (see nb_dropped_events)"
+                        )
+                    self.nb_dropped += 1
+                    return None
+            if len(self._free_slots) > 0:
+                slot = self._free_slots.pop()
+            else:
+                if self.nb_grown == 0:
+                    logger.warning(
+                        "app range event arena is full and no app metric report consumed its events, "
+                        "growing beyond capacity as drop_on_overflow is disabled"
+                    )
+                self._slots.append(None)
+                slot = len(self._slots) - 1
+                self.nb_grown += 1
+            event = self._slots[slot]
+            if event is None:
+                event = self._slots[slot] = _GWEvent_App_Range(name, slot)
+            else:
+                event.reset(name)
+
+        _C_capsule.add_app_range_event(event._C_instance)
+        return event
+
+
+    def commit(self, event : _GWEvent_App_Range):
+        """
+        Mark the event as completed, its tensor info is exported in chunks
+        """
+        with self._lock:
+            self._committed_slots.append(event._slot)
+            if len(self._committed_slots) >= self._flush_chunk_size:
+                self.__export()
+
+
+    def flush(self):
+        """
+        Export the tensor info of all completed events to their native instances
+        """
+        with self._lock:
+            self.__export()
+
+
+    def __export(self):
+        for slot in self._committed_slots:
+            self._slots[slot].export()
+        self._exported_slots += self._committed_slots
+        self._committed_slots = []
+
+
+    def on_report_begin(self, epoch : int):
+        # events completed so far are consumed by this report
+        with self._lock:
+            self.__export()
+            if len(self._exported_slots) > 0:
+                self._reported_slots[epoch] = self._exported_slots
+                self._exported_slots = []
+
+
+    def on_report_end(self, epoch : int):
+        # the native side consumed the events, recycle their slots
+        with self._lock:
+            for slot in self._reported_slots.pop(epoch, []):
+                self._slots[slot].release()
+                self._free_slots.append(slot)
 
 
 class GWModelAnlyser(TorchDispatchMode):
-    def __init__(self, module : nn.Module):
+    def __init__(
+        self,
+        module : nn.Module,
+        arena_capacity : int = 65536,
+        high_water_mark : Optional[int] = None,
+        flush_chunk_size : int = 1024,
+        drop_on_overflow : bool = True,
+        aggregate : bool = False,
+        trace_allowlist : Optional[Iterable[str]] = None,
+        trace_denylist : Optional[Iterable[str]] = None,
+        max_hook_depth : Optional[int] = None,
+        hook_module_types : Optional[Iterable[Union[type, str]]] = None,
+        hook_module_names : Optional[Iterable[str]] = None,
+        record_cuda_stream : bool = False,
+        roofline : Optional[GWRoofline] = None,
+        record_memory_trace : bool = False,
+        memory_trace_capacity : int = 1 << 20,
+        aggregate_sink : Optional[Callable[[Dict[str, List[Dict[str, Any]]]], None]] = None,
+        device_timing : bool = True,
+        plan_verify_interval : int = 16
+    ):
+        """
+        Parameters:
+            module (nn.Module): the model to be analysed
+            arena_capacity (int): number of app range event slots, a slot is recycled once the
+                                  app metric report consuming its event finishes
+            high_water_mark (int): number of occupied event slots which triggers a flush (or a drop), default to be arena_capacity
+            flush_chunk_size (int): number of completed events whose tensor info is exported to the native side at once
+            drop_on_overflow (bool): drop new events when reaching the high-water mark (see nb_dropped_events),
+                                     disable to grow the arena without bound instead
+            aggregate (bool): keep running statistics per op signature (and per module) instead of one event
+                              per op / module, the aggregated tables are emitted at flush
+            trace_allowlist (iterable[str]): ops to be traced individually, default to be all ops (none in aggregate mode)
+            trace_denylist (iterable[str]): ops never to be traced individually
+            max_hook_depth (int): only hook modules up to this depth (the given module is at depth 0), default to be unlimited
+            hook_module_types (iterable): only hook modules of these classes (or class names), default to be all
+            hook_module_names (iterable[str]): only hook modules whose qualified name matches one of these glob patterns, default to be all
+            record_cuda_stream (bool): record the CUDA stream current at the beginning of each event
+            roofline (GWRoofline): if given, count FLOPs and bytes of each op and module analytically, and
+                                   classify them as compute- or memory-bound against the device peaks
+            record_memory_trace (bool): keep the tensor pointers of every op, to reconstruct the live-memory
+                                        timeline afterwards, see export_memory_timeline
+            memory_trace_capacity (int): number of ops kept in the memory trace of each thread, the oldest
+                                         ones are dropped beyond
+            aggregate_sink (callable): receives {"ops": rows, "modules": rows} emitted at flush in aggregate mode
+            device_timing (bool): time ops / modules running on the GPU with CUDA events (resolved lazily) in
+                                  aggregate and roofline mode, instead of the host time of the launch
+            plan_verify_interval (int): in planned mode every op is checked against the plan, but the shapes /
+                                        dtypes of its inputs only on every n-th op (starting from the first),
+                                        see precompute_plan
+        """
         super().__init__()
         self._module = module
-        self._module_app_range_event : List[_GWEvent_App_Range] = []
 
-        # we maintain this list to prevent the app range event from being garbage collected
-        self._event_keepalive : List[_GWEvent_App_Range] = []
-        
+        # module range stacks, one per thread so that concurrent forward passes don't break each
+        # other's pairing; frames are paired by module rather than by the current stream, which
+        # may change within a forward pass
+        self._record_cuda_stream : bool = record_cuda_stream and torch.cuda.is_available()
+        self._range_stacks : threading.local = threading.local()
+
+        # the arena keeps app range events alive until the native side consumed them
+        self._event_arena : _GWEventArena = _GWEventArena(
+            capacity = arena_capacity,
+            high_water_mark = high_water_mark if high_water_mark is not None else arena_capacity,
+            flush_chunk_size = flush_chunk_size,
+            drop_on_overflow = drop_on_overflow
+        )
+
+        # aggregation mode
+        self._aggregate : bool = aggregate
+        self._aggregate_sink : Optional[Callable[[Dict[str, List[Dict[str, Any]]]], None]] = aggregate_sink
+        self._op_stats_table : _GWOpStatsTable = _GWOpStatsTable()
+        if trace_allowlist is None and aggregate:
+            trace_allowlist = []
+        self._trace_allowlist : Optional[frozenset] = frozenset(trace_allowlist) if trace_allowlist is not None else None
+        self._trace_denylist : frozenset = frozenset(trace_denylist) if trace_denylist is not None else frozenset()
+
+        # {op name, whether to trace individually}
+        self._op_trace_decisions : Dict[str, bool] = {}
+
+        # roofline analysis
+        self._roofline : Optional[GWRoofline] = roofline
+        self._module_stats_table : _GWOpStatsTable = _GWOpStatsTable(key_name="module")
+
+        # device-side timing of aggregated ops / modules, resolved before the statistics are exported
+        self._device_timer : Optional[GWDeferredEventTimer] = None
+        if (aggregate or roofline is not None) and device_timing and torch.cuda.is_available():
+            self._device_timer = GWDeferredEventTimer()
+
+        # {thread id, (op name, module name, input records, output records) of the latest ops}, one trace
+        # per thread so that ops of concurrent forward passes don't interleave, see export_memory_timeline
+        assert(memory_trace_capacity > 0 and plan_verify_interval > 0)
+        self._record_memory_trace : bool = record_memory_trace
+        self._memory_trace_capacity : int = memory_trace_capacity
+        self._memory_traces : Dict[int, Deque[Tuple[str, Optional[str], List, List]]] = {}
+        self._memory_trace_local : threading.local = threading.local()
+        self._memory_trace_lock : threading.Lock = threading.Lock()
+        self.nb_memory_trace_dropped : int = 0
+
+        # {id(module), qualified name of the module}
+        self._module_names : Dict[int, str] = {}
+
+        # ahead-of-time op plan, see precompute_plan
+        self._plan : Optional[List[_GWPlannedOp]] = None
+        self._recording_plan : bool = False
+        self._plan_module_path : List[str] = []
+        self._last_plan_ticks : Optional[List[int]] = None
+        self._last_plan_thread_id : Optional[int] = None
+        self.nb_plan_divergences : int = 0
+        self._plan_verify_interval : int = plan_verify_interval
+
+        # module hook filters, and handles of the registered hooks so that they can be removed
+        self._max_hook_depth : Optional[int] = max_hook_depth
+        self._hook_module_types : Optional[Tuple[type, ...]] = None
+        self._hook_module_type_names : Optional[frozenset] = None
+        if hook_module_types is not None:
+            hook_module_types = list(hook_module_types)
+            self._hook_module_types = tuple(t for t in hook_module_types if isinstance(t, type))
+            self._hook_module_type_names = frozenset(t for t in hook_module_types if isinstance(t, str))
+        self._hook_module_names : Optional[List[str]] = list(hook_module_names) if hook_module_names is not None else None
+        self._hook_handles : List[torch.utils.hooks.RemovableHandle] = []
+
+        # hooks are shared by all threads entering the analyser, they're only removed when the last one exits
+        self._hook_users : int = 0
+        self._hook_lock : threading.Lock = threading.Lock()
+
         self.__parse_module(module)
 
 
+    @property
+    def nb_dropped_events(self) -> int:
+        return self._event_arena.nb_dropped
+
+
+    def flush(self) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+        """
+        Export the tensor info of all completed app range events to the native side; in aggregate
+        mode, also emit the aggregated tables of ops and modules to aggregate_sink and reset them
+
+        Returns:
+            dict: {"ops": rows, "modules": rows} in aggregate mode, otherwise None
+        """
+        self._event_arena.flush()
+        if not self._aggregate:
+            return None
+        tables = {
+            "ops": self.export_aggregated_table(reset=True),
+            "modules": self._module_stats_table.export(self._roofline),
+        }
+        self._module_stats_table.clear()
+        if self._aggregate_sink is not None:
+            self._aggregate_sink(tables)
+        return tables
+
+
+    def __resolve_device_timings(self):
+        if self._device_timer is not None:
+            self._device_timer.resolve_all()
+
+
+    def export_aggregated_table(self, reset : bool = False) -> List[Dict[str, Any]]:
+        """
+        Export running statistics (count, total/mean/min/max/p50/p99 time in ns, bytes touched)
+        per op signature collected in aggregate mode
+
+        Parameters:
+            reset (bool): whether to clear the statistics after exported
+        """
+        self.__resolve_device_timings()
+        rows = self._op_stats_table.export(self._roofline)
+        if reset:
+            self._op_stats_table.clear()
+        return rows
+
+
+    def export_roofline_table(self, reset : bool = False) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Export FLOPs, bytes, arithmetic intensity, achieved throughput and compute-/memory-bound
+        classification per op signature and per module, requires roofline to be given
+
+        Parameters:
+            reset (bool): whether to clear the statistics after exported
+
+        Returns:
+            tuple: rows of ops, rows of modules
+        """
+        if self._roofline is None:
+            raise RuntimeError("roofline analysis is not enabled, pass roofline to GWModelAnlyser")
+        self.__resolve_device_timings()
+        op_rows = self._op_stats_table.export(self._roofline)
+        module_rows = self._module_stats_table.export(self._roofline)
+        if reset:
+            self._op_stats_table.clear()
+            self._module_stats_table.clear()
+        return op_rows, module_rows
+
+
+    def export_memory_timeline(self, reset : bool = False) -> Dict[int, GWMemoryTimeline]:
+        """
+        Reconstruct tensor lifetimes from the recorded tensor storages, for the live-bytes timeline
+        per device, the peak attributed to ops / modules, and redundant copies; requires
+        record_memory_trace to be enabled. Ops executed following a precomputed plan are not recorded.
+        Once the trace of a thread exceeded memory_trace_capacity, its timeline starts at the oldest
+        op kept, see nb_memory_trace_dropped.
+
+        Parameters:
+            reset (bool): whether to clear the recorded traces after exported
+
+        Returns:
+            dict: {thread id, memory timeline of the ops executed by the thread}
+        """
+        if not self._record_memory_trace:
+            raise RuntimeError("memory trace is not recorded, pass record_memory_trace to GWModelAnlyser")
+        with self._memory_trace_lock:
+            traces = { thread_id: list(trace) for thread_id, trace in self._memory_traces.items() }
+            if reset:
+                for trace in self._memory_traces.values():
+                    trace.clear()
+                self.nb_memory_trace_dropped = 0
+        return {
+            thread_id: GWMemoryTimeline([
+                (op, module, _tensor_meta_table.storages(inputs), _tensor_meta_table.storages(outputs))
+                for op, module, inputs, outputs in trace
+            ])
+            for thread_id, trace in traces.items()
+        }
+
+
+    def __do_trace_op(self, name : str) -> bool:
+        decision = self._op_trace_decisions.get(name, None)
+        if decision is None:
+            decision = (
+                (self._trace_allowlist is None or name in self._trace_allowlist)
+                and name not in self._trace_denylist
+            )
+            self._op_trace_decisions[name] = decision
+        return decision
+
+
+    def precompute_plan(self, *example_args, **example_kwargs):
+        """
+        Run the model once on fake tensors (no real computation nor memory) to record the full
+        op sequence, module nesting and shapes. Afterwards each op within the outermost module only
+        costs an identity check of the op and clock reads against the plan at runtime, the shapes /
+        dtypes of its inputs are checked on every plan_verify_interval-th op; a forward pass falls
+        back to full capture from the first op detected to diverge from the plan, so that a change
+        of shapes alone is detected up to plan_verify_interval - 1 ops late. Ops outside
+        the outermost module (e.g., loss, backward, optimizer) are captured as without a plan.
+
+        Note: while a forward pass follows the plan, its ops and modules only record timestamps, see
+        export_planned_timeline; no native app range event is created, and aggregate statistics,
+        roofline and memory trace are not updated for them.
+
+        Parameters:
+            example_args / example_kwargs: example inputs of the model, only shapes and dtypes matter
+        """
+        from torch._subclasses.fake_tensor import FakeTensorMode
+
+        # forward passes are delimited by the hooks of the outermost module
+        if not self.__do_hook_module(self._module, ""):
+            raise RuntimeError("planned mode requires the outermost module to be hooked")
+
+        if self._aggregate or self._roofline is not None or self._record_memory_trace:
+            logger.warning(
+                "forward passes following the precomputed plan don't update aggregate statistics, "
+                "roofline nor memory trace"
+            )
+
+        self._plan = []
+        self._plan_module_path = []
+        self._recording_plan = True
+        try:
+            with FakeTensorMode(allow_non_fake_inputs=True) as fake_mode:
+                to_fake = lambda e: fake_mode.from_tensor(e) if isinstance(e, torch.Tensor) else e
+                fake_args = tree_map(to_fake, example_args)
+                fake_kwargs = tree_map(to_fake, example_kwargs)
+                with _GWPlanRecorder(self):
+                    self._module(*fake_args, **fake_kwargs)
+        finally:
+            self._recording_plan = False
+        logger.info(f"precomputed plan of {len(self._plan)} ops")
+
+
+    def clear_plan(self):
+        """
+        Drop the precomputed plan and go back to full capture
+        """
+        self._plan = None
+        self._last_plan_ticks = None
+
+
+    def export_planned_timeline(self) -> List[Dict[str, Any]]:
+        """
+        Export the timeline of the last forward pass which fully followed the precomputed plan
+        """
+        if self._plan is None or self._last_plan_ticks is None:
+            return []
+        ticks = self._last_plan_ticks
+        return [
+            {
+                "op": planned_op.name,
+                "module": planned_op.module,
+                "input_tensor_info": _tensor_meta_table.export(planned_op.input_tensor_info),
+                "output_tensor_info": _tensor_meta_table.export(planned_op.output_tensor_info),
+                "begin_ns": ticks[2 * index],
+                "end_ns": ticks[2 * index + 1],
+                "thread_id": self._last_plan_thread_id,
+            }
+            for index, planned_op in enumerate(self._plan)
+        ]
+
+
+    def __get_plan_state(self) -> _GWPlanState:
+        state : _GWPlanState = getattr(self._range_stacks, "plan_state", None)
+        if state is None or len(state.ticks) != 2 * len(self._plan):
+            state = self._range_stacks.plan_state = _GWPlanState(len(self._plan))
+        return state
+
+
+    def __get_range_stack(self) -> List[_GWModuleFrame]:
+        stack : List[_GWModuleFrame] = getattr(self._range_stacks, "stack", None)
+        if stack is None:
+            stack = self._range_stacks.stack = []
+        return stack
+
+
+    def __get_memory_trace(self) -> Deque[Tuple[str, Optional[str], List, List]]:
+        trace = getattr(self._memory_trace_local, "trace", None)
+        if trace is None:
+            trace = self._memory_trace_local.trace = deque(maxlen=self._memory_trace_capacity)
+            with self._memory_trace_lock:
+                self._memory_traces[threading.get_ident()] = trace
+        return trace
+
+
+    def __acquire_event(self, name : str) -> Optional[_GWEvent_App_Range]:
+        event = self._event_arena.acquire(name)
+        if event is not None and self._record_cuda_stream:
+            event._stream_id = torch.cuda.current_stream().cuda_stream
+        return event
+
+
+    def __pop_frame(self, range_stack : List[_GWModuleFrame], token : Optional[int]) -> Optional[_GWModuleFrame]:
+        """
+        Pop the innermost frame of the given module (all frames if token is None); frames above it
+        belong to modules whose forward raised before their post-hook ran, their events are closed
+        """
+        index = len(range_stack) - 1
+        if token is not None:
+            while index >= 0 and range_stack[index].token != token:
+                index -= 1
+            if index < 0:
+                return None
+        for stale_frame in range_stack[index + 1:] if token is not None else range_stack:
+            if stale_frame.event is not None:
+                stale_frame.event.record_end_tick()
+                self._event_arena.commit(stale_frame.event)
+            if stale_frame.timing_pair is not None:
+                self._device_timer.cancel(stale_frame.timing_pair)
+        if token is None:
+            range_stack.clear()
+            return None
+        del range_stack[index + 1:]
+        return range_stack.pop()
+
+
+    def remove_hooks(self):
+        """
+        Remove all module hooks, so that the model returns to zero overhead;
+        must not be called while other threads are running within the analyser
+        """
+        with self._hook_lock:
+            for handle in self._hook_handles:
+                handle.remove()
+            self._hook_handles.clear()
+
+
+    def __enter__(self):
+        # hooks are removed when the last thread exits, re-register them if the analyser is entered again
+        with self._hook_lock:
+            if self._hook_users == 0 and len(self._hook_handles) == 0:
+                self.__parse_module(self._module)
+            self._hook_users += 1
+        return super().__enter__()
+
+
+    def __exit__(self, *args):
+        with self._hook_lock:
+            self._hook_users -= 1
+            if self._hook_users == 0:
+                for handle in self._hook_handles:
+                    handle.remove()
+                self._hook_handles.clear()
+        self.flush()
+        return super().__exit__(*args)
+
+
     def __torch_dispatch__(self, func, types, args=(), kwargs=None):
         """
         op-level hijack
@@ -54,54 +990,179 @@ class GWModelAnlyser(TorchDispatchMode):
         input_tensor_info : List = []
         output_tensor_info : List = []
         kwargs = kwargs if kwargs else {}
+        app_range_event : _GWEvent_App_Range = None
 
-        # create new app range event
-        app_range_event : _GWEvent_App_Range = _GWEvent_App_Range(func.__name__)
-        _C_capsule.add_app_range_event(app_range_event._C_instance)
-        self._event_keepalive.append(app_range_event)
+        # planned mode: only check the op against the plan and record timestamps,
+        # the plan only covers ops within the outermost module
+        if self._plan is not None and len(self.__get_range_stack()) > 0:
+            plan_state = self.__get_plan_state()
+            if not plan_state.diverged:
+                cursor = plan_state.cursor
+                if (
+                    cursor < len(self._plan) and self._plan[cursor].func is func
+                    and (
+                        cursor % self._plan_verify_interval != 0
+                        or self._plan[cursor].signature == _raw_signature(args, kwargs)
+                    )
+                ):
+                    plan_state.cursor = cursor + 1
+                    plan_state.ticks[2 * cursor] = time.perf_counter_ns()
+                    out = func(*args, **kwargs)
+                    plan_state.ticks[2 * cursor + 1] = time.perf_counter_ns()
+                    return out
+                plan_state.diverged = True
+                self.nb_plan_divergences += 1
+                message = (
+                    f"op stream diverged from the precomputed plan at op #{cursor} ({func.__name__}), "
+                    f"fall back to full capture for the rest of the forward pass"
+                )
+                if self.nb_plan_divergences == 1:
+                    logger.warning(f"{message}, further divergences are logged at debug level")
+                else:
+                    logger.debug(message)
+
+        # create new app range event if the op is traced individually
+        if self.__do_trace_op(func.__name__):
+            app_range_event = self.__acquire_event(func.__name__)
+        if (
+            app_range_event is None and not self._aggregate
+            and self._roofline is None and not self._record_memory_trace
+        ):
+            return func(*args, **kwargs)
 
         # record input tensor info
         input_tensor_info = GWModelAnlyser.__collect_tensor_info(args)
         input_tensor_info += GWModelAnlyser.__collect_tensor_info(kwargs.values())
-        app_range_event.set_input_tensor_info(input_tensor_info)
+        if self._record_memory_trace:
+            # lifetimes are tracked per storage, so that views don't count as allocations
+            input_storage_info = _collect_tensor_info((args, kwargs), storage=True)
 
         # execute the operator
-        app_range_event.record_begin_tick()
+        if app_range_event is not None:
+            app_range_event.set_input_tensor_info(input_tensor_info)
+            app_range_event.record_begin_tick()
+        timing_pair = None
+        if (
+            self._device_timer is not None and (self._aggregate or self._roofline is not None)
+            and _tensor_meta_table.on_cuda(input_tensor_info)
+        ):
+            timing_pair = self._device_timer.start()
+        begin_ns = time.perf_counter_ns()
         out = func(*args, **kwargs)
-        app_range_event.record_end_tick()
+        elapsed_ns = time.perf_counter_ns() - begin_ns
+        if app_range_event is not None:
+            app_range_event.record_end_tick()
 
         # record output tensor info
         output_tensor_info = GWModelAnlyser.__collect_tensor_info(out)
-        app_range_event.set_output_tensor_info(output_tensor_info)
+        if app_range_event is not None:
+            app_range_event.set_output_tensor_info(output_tensor_info)
+            self._event_arena.commit(app_range_event)
+        if self._record_memory_trace:
+            range_stack = self.__get_range_stack()
+            memory_trace = self.__get_memory_trace()
+            with self._memory_trace_lock:
+                if len(memory_trace) == memory_trace.maxlen:
+                    self.nb_memory_trace_dropped += 1
+                memory_trace.append((
+                    func.__name__, range_stack[-1].module if len(range_stack) > 0 else None,
+                    input_storage_info, _collect_tensor_info(out, storage=True)
+                ))
+        if self._aggregate or self._roofline is not None:
+            nbytes = _tensor_meta_table.nbytes(input_tensor_info) + _tensor_meta_table.nbytes(output_tensor_info)
+            flops = count_flops(func, args, kwargs, out) if self._roofline is not None else 0
+            if timing_pair is not None:
+                # kernels run asynchronously, the statistics are updated once the end event completes
+                self._device_timer.stop(timing_pair, lambda elapsed_ms, name=func.__name__: self._op_stats_table.add(
+                    name, input_tensor_info, int(elapsed_ms * 1e6), nbytes, flops
+                ))
+            else:
+                self._op_stats_table.add(func.__name__, input_tensor_info, elapsed_ns, nbytes, flops)
+
+            # attribute to the innermost module
+            range_stack = self.__get_range_stack()
+            if len(range_stack) > 0:
+                range_stack[-1].flops += flops
+                range_stack[-1].nbytes += nbytes
 
         return out
 
 
-    def __parse_module(self, module : nn.Module):
+    def __parse_module(self, module : nn.Module, name : str = "", depth : int = 0):
         """
         module-level hijack
         """
-        module.register_forward_pre_hook(GWModelAnlyser.__pre_nn_module_forward(self))
-        module.register_forward_hook(GWModelAnlyser.__post_nn_module_forward(self))
-        for child in module.children():
-            self.__parse_module(child)
+        self._module_names[id(module)] = name if name else module.__class__.__name__
+        if self.__do_hook_module(module, name):
+            self._hook_handles.append(module.register_forward_pre_hook(GWModelAnlyser.__pre_nn_module_forward(self)))
+            self._hook_handles.append(module.register_forward_hook(GWModelAnlyser.__post_nn_module_forward(self)))
+        if self._max_hook_depth is not None and depth >= self._max_hook_depth:
+            return
+        for child_name, child in module.named_children():
+            self.__parse_module(child, f"{name}.{child_name}" if name else child_name, depth + 1)
+
+
+    def __do_hook_module(self, module : nn.Module, name : str) -> bool:
+        if self._hook_module_types is not None:
+            if not (
+                isinstance(module, self._hook_module_types)
+                or module.__class__.__name__ in self._hook_module_type_names
+            ):
+                return False
+        if self._hook_module_names is not None:
+            if not any(fnmatch.fnmatchcase(name, pattern) for pattern in self._hook_module_names):
+                return False
+        return True
 
 
     @staticmethod
     def __pre_nn_module_forward(self : 'GWModelAnlyser'):
         def _func(module : nn.Module, input : Any):
-            # create new app range event
-            app_range_event : _GWEvent_App_Range = _GWEvent_App_Range(module.__class__.__name__)
-            _C_capsule.add_app_range_event(app_range_event._C_instance)
-            self._event_keepalive.append(app_range_event)
-    
+            # running on fake tensors to record the plan
+            if self._recording_plan:
+                self._plan_module_path.append(self._module_names.get(id(module), module.__class__.__name__))
+                return
+
+            # frames left by a forward pass which raised
+            range_stack = self.__get_range_stack()
+            if module is self._module and len(range_stack) > 0:
+                self.__pop_frame(range_stack, None)
+
+            # planned mode: a new forward pass starts at the outermost module
+            if self._plan is not None:
+                plan_state = self.__get_plan_state()
+                if len(range_stack) == 0:
+                    plan_state.cursor = 0
+                    plan_state.diverged = False
+                if not plan_state.diverged:
+                    # negative begin tick marks the frame as planned
+                    range_stack.append(_GWModuleFrame(id(module), None, -1))
+                    return
+
+            # create new app range event, modules are aggregated instead in aggregate mode
+            app_range_event : Optional[_GWEvent_App_Range] = None
+            if not self._aggregate:
+                app_range_event = self.__acquire_event(module.__class__.__name__)
+
+            # save the app range event to stack for later used,
+            # dropped event is also pushed to keep the stack balanced
+            frame = _GWModuleFrame(
+                id(module), app_range_event, time.perf_counter_ns(),
+                self._module_names.get(id(module), module.__class__.__name__)
+            )
+            range_stack.append(frame)
+            if (
+                self._device_timer is not None and (self._aggregate or self._roofline is not None)
+                and any(isinstance(tensor, torch.Tensor) and tensor.is_cuda for tensor in input)
+            ):
+                frame.timing_pair = self._device_timer.start()
+            if app_range_event is None:
+                return
+
             # record input tensor info
             input_tensor_info = GWModelAnlyser.__collect_tensor_info(input)
             app_range_event.set_input_tensor_info(input_tensor_info)
 
-            # save the app range event to stack for later used
-            self._module_app_range_event.append(app_range_event)
-
             # start ticking
             app_range_event.record_begin_tick()
             
@@ -111,41 +1172,67 @@ class GWModelAnlyser(TorchDispatchMode):
     @staticmethod
     def __post_nn_module_forward(self : 'GWModelAnlyser'):
         def _func(module : nn.Module, input : Any, output : Any):
+            if self._recording_plan:
+                self._plan_module_path.pop()
+                return
+
             # obtain the app range event from stack
-            try:
-                app_range_event = self._module_app_range_event.pop()
-            except:
+            range_stack = self.__get_range_stack()
+            frame = self.__pop_frame(range_stack, id(module))
+            if frame is None:
                 raise RuntimeError("no app range event found")
 
+            # planned mode: keep the timeline of a forward pass which fully follows the plan
+            if self._plan is not None and len(range_stack) == 0:
+                plan_state = self.__get_plan_state()
+                if not plan_state.diverged and plan_state.cursor == len(self._plan):
+                    self._last_plan_ticks = list(plan_state.ticks)
+                    self._last_plan_thread_id = threading.get_ident()
+            if frame.begin_ns < 0:
+                # events captured after the plan diverged are exported at the end of the pass
+                if len(range_stack) == 0:
+                    self._event_arena.flush()
+                return
+
+            # statistics / roofline of the module, ops within the module are also accounted to its parent
+            if self._aggregate or self._roofline is not None:
+                module_name = self._module_names.get(id(module), module.__class__.__name__)
+                if frame.timing_pair is not None:
+                    self._device_timer.stop(frame.timing_pair, lambda elapsed_ms, nbytes=frame.nbytes, flops=frame.flops: (
+                        self._module_stats_table.add(module_name, [], int(elapsed_ms * 1e6), nbytes, flops)
+                    ))
+                else:
+                    self._module_stats_table.add(
+                        module_name, [], time.perf_counter_ns() - frame.begin_ns, frame.nbytes, frame.flops
+                    )
+                if len(range_stack) > 0:
+                    range_stack[-1].flops += frame.flops
+                    range_stack[-1].nbytes += frame.nbytes
+
+            app_range_event = frame.event
+            if app_range_event is None:
+                if len(range_stack) == 0:
+                    self._event_arena.flush()
+                return
+
             # end ticking
             app_range_event.record_end_tick()
 
             # record output tensor info
             output_tensor_info = GWModelAnlyser.__collect_tensor_info(output)
             app_range_event.set_output_tensor_info(output_tensor_info)
+            self._event_arena.commit(app_range_event)
+
+            # flush at the end of the outermost module, so that a forward pass is exported as a whole
+            if len(range_stack) == 0:
+                self._event_arena.flush()
 
         return _func
 
 
     @staticmethod
     def __collect_tensor_info(tensors : Any):
-        info : List = []
-        def _recursive_collect(elem):
-            if isinstance(elem, torch.Tensor):
-                info.append({
-                    "shape": str(list(elem.shape)),
-                    "dtype": str(elem.dtype).split(".")[-1],
-                    "ptr": str(elem.data_ptr()),
-                    "device": str(elem.device)
-                })
-            elif isinstance(elem, (list, tuple)):
-                for e in elem:
-                    _recursive_collect(e)
-            elif isinstance(elem, dict):
-                for v in elem.values():
-                    _recursive_collect(v)
-        _recursive_collect(tensors)
-        return info
+        return _collect_tensor_info(tensors)
 
 
 __all__ = [ "GWModelAnlyser" ]
@@ -0,0 +1,2 @@
+from gtest.common.stats import *
+from gtest.common.event_timer import *
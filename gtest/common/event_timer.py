@@ -0,0 +1,209 @@
+import time
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, List, Optional, Tuple
+
+
+class GWFakeEvent:
+    """
+    CPU-only stand-in of torch.cuda.Event(enable_timing=True), the event "completes"
+    at the host time it's recorded, so that the deferred timer works without a GPU
+    """
+
+    def __init__(self):
+        self._timestamp : Optional[float] = None
+
+
+    def record(self, stream : Any = None):
+        self._timestamp = time.perf_counter()
+
+
+    def query(self) -> bool:
+        return self._timestamp is not None
+
+
+    def synchronize(self):
+        pass
+
+
+    def elapsed_time(self, end_event : 'GWFakeEvent') -> float:
+        # milliseconds, same as torch.cuda.Event
+        return (end_event._timestamp - self._timestamp) * 1000.0
+
+
+def _create_cuda_event() -> Any:
+    import torch
+    return torch.cuda.Event(enable_timing=True)
+
+
+class GWEventPairPool:
+    """
+    Pool of reusable (start, end) event pairs, avoid creating new events for every range
+    """
+
+    def __init__(self, event_factory : Callable[[], Any] = _create_cuda_event, max_pool_size : int = 1024):
+        self._event_factory : Callable[[], Any] = event_factory
+        self._max_pool_size : int = max_pool_size
+        self._free_pairs : List[Tuple[Any, Any]] = []
+        self._lock : threading.Lock = threading.Lock()
+
+
+    def acquire(self) -> Tuple[Any, Any]:
+        with self._lock:
+            if len(self._free_pairs) > 0:
+                return self._free_pairs.pop()
+        return (self._event_factory(), self._event_factory())
+
+
+    def release(self, pair : Tuple[Any, Any]):
+        with self._lock:
+            if len(self._free_pairs) < self._max_pool_size:
+                self._free_pairs.append(pair)
+
+
+class GWDeferredEventTimer:
+    """
+    Measure device-side latencies with recorded event pairs without stalling the stream:
+    pairs are queued after recording, and their elapsed time is resolved lazily, either by
+    poll (non-blocking query), by resolve_all (e.g., at flush_data), or by a background poller.
+    Callbacks are invoked with the lock of the timer held, so they never run concurrently
+    """
+
+    def __init__(
+        self,
+        event_factory : Callable[[], Any] = _create_cuda_event,
+        max_pending : int = 4096,
+        max_pool_size : int = 1024
+    ):
+        """
+        Parameters:
+            event_factory (callable): creates a timing event, default to be torch.cuda.Event(enable_timing=True),
+                                      use GWFakeEvent for CPU-only testing
+            max_pending (int): maximum number of unresolved pairs, the oldest ones are resolved
+                               (synchronously if needed) beyond this
+            max_pool_size (int): maximum number of idle event pairs kept for reuse
+        """
+        assert(max_pending > 0)
+        self._pool : GWEventPairPool = GWEventPairPool(event_factory, max_pool_size)
+        self._max_pending : int = max_pending
+
+        # recorded pairs waiting for resolution, with the callback receiving the elapsed ms
+        self._pending : Deque[Tuple[Tuple[Any, Any], Callable[[float], None]]] = deque()
+        self._lock : threading.RLock = threading.RLock()
+
+        # background poller
+        self._poller : Optional[threading.Thread] = None
+        self._poller_stop_event : threading.Event = threading.Event()
+
+
+    @property
+    def nb_pending(self) -> int:
+        return len(self._pending)
+
+
+    def start(self) -> Tuple[Any, Any]:
+        """
+        Acquire an event pair and record the start event
+        """
+        pair = self._pool.acquire()
+        pair[0].record()
+        return pair
+
+
+    def stop(self, pair : Tuple[Any, Any], callback : Callable[[float], None]):
+        """
+        Record the end event and queue the pair, callback is invoked with the elapsed
+        time in milliseconds once it's resolved
+        """
+        pair[1].record()
+        with self._lock:
+            self._pending.append((pair, callback))
+            if len(self._pending) > self._max_pending:
+                self.poll()
+                while len(self._pending) > self._max_pending:
+                    self.__resolve(*self._pending.popleft(), blocking=True)
+
+
+    def cancel(self, pair : Tuple[Any, Any]):
+        """
+        Give back a started pair which is not going to be stopped (e.g., the range raised)
+        """
+        self._pool.release(pair)
+
+
+    def discard_pending(self) -> int:
+        """
+        Drop all pending pairs without invoking their callbacks, e.g., when the statistics they
+        feed are reset; callbacks never run concurrently with nor after this call
+
+        Returns:
+            int: number of dropped pairs
+        """
+        with self._lock:
+            nb_dropped = len(self._pending)
+            while len(self._pending) > 0:
+                pair, _ = self._pending.popleft()
+                self._pool.release(pair)
+        return nb_dropped
+
+
+    def poll(self) -> int:
+        """
+        Resolve all pairs whose end event has completed, without blocking
+
+        Returns:
+            int: number of resolved pairs
+        """
+        nb_resolved = 0
+        with self._lock:
+            nb_pending = len(self._pending)
+            for _ in range(nb_pending):
+                pair, callback = self._pending.popleft()
+                if pair[1].query():
+                    self.__resolve(pair, callback, blocking=False)
+                    nb_resolved += 1
+                else:
+                    self._pending.append((pair, callback))
+        return nb_resolved
+
+
+    def resolve_all(self):
+        """
+        Resolve all pending pairs, block until their events complete
+        """
+        with self._lock:
+            while len(self._pending) > 0:
+                self.__resolve(*self._pending.popleft(), blocking=True)
+
+
+    def __resolve(self, pair : Tuple[Any, Any], callback : Callable[[float], None], blocking : bool):
+        start_event, end_event = pair
+        if blocking:
+            end_event.synchronize()
+        callback(start_event.elapsed_time(end_event))
+        self._pool.release(pair)
+
+
+    def start_poller(self, poll_interval : float = 0.01):
+        """
+        Start a background thread which polls completed pairs periodically
+        """
+        if self._poller is not None:
+            return
+        self._poller_stop_event.clear()
+        def _poll_loop():
+            while not self._poller_stop_event.wait(poll_interval):
+                self.poll()
+        self._poller = threading.Thread(target=_poll_loop, name="gw-event-poller", daemon=True)
+        self._poller.start()
+
+
+    def stop_poller(self):
+        if self._poller is None:
+            return
+        self._poller_stop_event.set()
+        self._poller.join()
+        self._poller = None
+
+
+__all__ = [ "GWFakeEvent", "GWEventPairPool", "GWDeferredEventTimer" ]
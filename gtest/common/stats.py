@@ -0,0 +1,219 @@
+import math
+import numpy as np
+from typing import Any, Dict, Iterable
+
+
+class GWQuantileSketch:
+    """
+    Mergeable quantile sketch with bounded relative error (DDSketch-style log-bucketed histogram).
+    Positive values are mapped to logarithmic buckets, so any quantile estimate is within
+    relative_accuracy of the true value, while memory is bounded by max_buckets.
+    """
+
+    def __init__(self, relative_accuracy : float = 0.01, max_buckets : int = 2048):
+        assert(0 < relative_accuracy < 1 and max_buckets > 0)
+        self._relative_accuracy : float = relative_accuracy
+        self._max_buckets : int = max_buckets
+        self._gamma : float = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma : float = math.log(self._gamma)
+
+        # {bucket index, count}, values <= 0 are counted separately
+        self._buckets : Dict[int, int] = {}
+        self._zero_count : int = 0
+        self._count : int = 0
+
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+
+    def add(self, value : float, count : int = 1):
+        self._count += count
+        if value <= 0:
+            self._zero_count += count
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self._buckets[index] = self._buckets.get(index, 0) + count
+        if len(self._buckets) > self._max_buckets:
+            self._collapse()
+
+
+    def merge(self, other : 'GWQuantileSketch'):
+        """
+        Merge another sketch (with the same relative accuracy) into this one
+        """
+        if other._gamma != self._gamma:
+            raise ValueError("can't merge quantile sketches with different relative accuracy")
+        for index, count in other._buckets.items():
+            self._buckets[index] = self._buckets.get(index, 0) + count
+        self._zero_count += other._zero_count
+        self._count += other._count
+        while len(self._buckets) > self._max_buckets:
+            self._collapse()
+
+
+    def quantile(self, q : float) -> float:
+        """
+        Estimate the q-quantile (0 <= q <= 1), returns NaN if the sketch is empty
+        """
+        assert(0 <= q <= 1)
+        if self._count == 0:
+            return math.nan
+        rank = q * (self._count - 1)
+        if rank < self._zero_count:
+            return 0.0
+        accumulated = self._zero_count
+        for index in sorted(self._buckets.keys()):
+            accumulated += self._buckets[index]
+            if accumulated > rank:
+                return 2 * self._gamma ** index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self._buckets.keys()) / (self._gamma + 1)
+
+
+    def _collapse(self):
+        # fold the two lowest buckets, so that only accuracy of the smallest values is sacrificed
+        lowest, second = sorted(self._buckets.keys())[:2]
+        self._buckets[second] += self._buckets.pop(lowest)
+
+
+class GWStreamingStats:
+    """
+    Fixed-memory running statistics of a stream of samples: count, mean and variance (Welford),
+    min / max, and a quantile sketch for tail latencies. Statistics from different ranks
+    (or threads) are combined by merge, e.g., after gathering their to_state().
+    """
+
+    # quantiles included in the numpy export
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    # fields of the numpy export
+    FIELDS = ("count", "mean", "std", "min", "max", "p50", "p95", "p99")
+
+    def __init__(self, relative_accuracy : float = 0.01, max_buckets : int = 2048):
+        self._count : int = 0
+        self._mean : float = 0.0
+        self._m2 : float = 0.0
+        self._min : float = math.inf
+        self._max : float = -math.inf
+        self._sketch : GWQuantileSketch = GWQuantileSketch(relative_accuracy, max_buckets)
+
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+
+    @property
+    def mean(self) -> float:
+        return self._mean if self._count > 0 else math.nan
+
+
+    @property
+    def variance(self) -> float:
+        """
+        Sample variance, NaN if less than two samples
+        """
+        return self._m2 / (self._count - 1) if self._count > 1 else math.nan
+
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+
+    @property
+    def min(self) -> float:
+        return self._min if self._count > 0 else math.nan
+
+
+    @property
+    def max(self) -> float:
+        return self._max if self._count > 0 else math.nan
+
+
+    def add(self, value : float):
+        self._count += 1
+        delta = value - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (value - self._mean)
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+        self._sketch.add(value)
+
+
+    def merge(self, other : 'GWStreamingStats'):
+        """
+        Merge another statistics into this one (Chan et al. parallel variance)
+        """
+        if other._count == 0:
+            return
+        count = self._count + other._count
+        delta = other._mean - self._mean
+        self._mean += delta * other._count / count
+        self._m2 += other._m2 + delta * delta * self._count * other._count / count
+        self._count = count
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+        self._sketch.merge(other._sketch)
+
+
+    def quantile(self, q : float) -> float:
+        """
+        Estimate the q-quantile (0 <= q <= 1), clamped to the observed range
+        """
+        if self._count == 0:
+            return math.nan
+        return min(max(self._sketch.quantile(q), self._min), self._max)
+
+
+    def to_numpy(self) -> np.ndarray:
+        """
+        Export as a float64 array ordered as FIELDS
+        """
+        return np.array(
+            [ self._count, self.mean, self.std, self.min, self.max ] + [ self.quantile(q) for q in self.QUANTILES ],
+            dtype=np.float64
+        )
+
+
+    def to_state(self) -> Dict[str, Any]:
+        """
+        Picklable state, to be sent across ranks and rebuilt by from_state
+        """
+        return {
+            "count": self._count, "mean": self._mean, "m2": self._m2, "min": self._min, "max": self._max,
+            "relative_accuracy": self._sketch._relative_accuracy, "max_buckets": self._sketch._max_buckets,
+            "buckets": dict(self._sketch._buckets), "zero_count": self._sketch._zero_count,
+        }
+
+
+    @staticmethod
+    def from_state(state : Dict[str, Any]) -> 'GWStreamingStats':
+        stats = GWStreamingStats(state["relative_accuracy"], state["max_buckets"])
+        stats._count = state["count"]
+        stats._mean = state["mean"]
+        stats._m2 = state["m2"]
+        stats._min = state["min"]
+        stats._max = state["max"]
+        stats._sketch._buckets = dict(state["buckets"])
+        stats._sketch._zero_count = state["zero_count"]
+        stats._sketch._count = state["count"]
+        return stats
+
+
+def streaming_stats_to_numpy(dict_stats : Dict[str, GWStreamingStats]) -> np.ndarray:
+    """
+    Export named statistics into a structured array, one row per name
+    """
+    names = list(dict_stats.keys())
+    dtype = [ ("name", f"U{max([ len(name) for name in names ] + [1])}") ] + [ (field, np.float64) for field in GWStreamingStats.FIELDS ]
+    table = np.empty(len(names), dtype=dtype)
+    for i, name in enumerate(names):
+        table[i] = (name, *dict_stats[name].to_numpy())
+    return table
+
+
+__all__ = [ "GWQuantileSketch", "GWStreamingStats", "streaming_stats_to_numpy" ]
@@ -11,3 +11,5 @@ except OSError as e:
     raise RuntimeError(f"failed to load '{lib_path}': {e}")
 
 from .scheduler import *
+from .zoom_search import *
+from .event_store import *
@@ -1,4 +1,5 @@
 import os
+import asyncio
 import argparse
 
 from .scheduler import *
@@ -21,11 +22,18 @@ parser.add_argument(
 )
 parser.add_argument(
     '-w', '--world-size',
-    type=str,
+    type=int,
     default=1,
     help='world size (#processes) of the program to be profiled',
     required=False
 )
+parser.add_argument(
+    '-t', '--rendezvous-timeout',
+    type=float,
+    default=None,
+    help='maximum seconds to wait for all processes to connect, wait forever if not given',
+    required=False
+)
 parser.add_argument(
     '-vi', '--visual',
     action='store_true',
@@ -49,8 +57,7 @@ scheduler : GWScheduler = GWScheduler(
     command = args.command
 )
 
-scheduler.serve()
-scheduler.start_capsule()
-
-while True:
+try:
+    asyncio.run(scheduler.run(rendezvous_timeout = args.rendezvous_timeout))
+except KeyboardInterrupt:
     pass
@@ -0,0 +1,438 @@
+import os
+import json
+import numpy as np
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+
+# columns every event has
+_BASE_FIELDS : Dict[str, str] = {
+    "rank":     "int32",
+    "kernel":   "int32",    # interned kernel name
+    "start_ts": "int64",
+    "end_ts":   "int64",
+}
+
+_META_FILE_NAME : str = "meta.json"
+
+
+class _GWSortedRun:
+    """
+    Rows in (kernel, rank, start_ts) order, given by their sorted keys together with their row
+    indices within the segment (None if the segment itself is stored in that order)
+    """
+
+    def __init__(
+        self,
+        kernels : np.ndarray,
+        ranks : np.ndarray,
+        start_ts : np.ndarray,
+        order : Optional[np.ndarray] = None
+    ):
+        self.kernels : np.ndarray = kernels
+        self.ranks : np.ndarray = ranks
+        self.start_ts : np.ndarray = start_ts
+        self.order : Optional[np.ndarray] = order
+
+        # row offsets where each (kernel, rank) group begins, with the number of rows appended
+        boundaries = np.flatnonzero((kernels[1:] != kernels[:-1]) | (ranks[1:] != ranks[:-1])) + 1
+        self.group_offsets : np.ndarray = np.concatenate(([0], boundaries, [len(kernels)])).astype(np.int64)
+
+
+    @classmethod
+    def from_rows(cls, kernels : np.ndarray, ranks : np.ndarray, start_ts : np.ndarray, rows : np.ndarray) -> '_GWSortedRun':
+        """
+        Index the given rows of an unsorted segment
+        """
+        order = rows[np.lexsort((start_ts[rows], ranks[rows], kernels[rows]))]
+        return cls(kernels[order], ranks[order], start_ts[order], order)
+
+
+    def __len__(self) -> int:
+        return len(self.kernels)
+
+
+    def find_rows(
+        self,
+        start_ts : Optional[int] = None,
+        end_ts : Optional[int] = None,
+        kernel : Optional[int] = None,
+        rank : Optional[int] = None
+    ) -> List[Tuple[int, int]]:
+        """
+        Ranges [begin, end) within the run, one per (kernel, rank) group, of the matching events
+        started within [start_ts, end_ts)
+        """
+        groups = self.group_offsets
+        if kernel is not None:
+            begin = int(np.searchsorted(self.kernels, kernel, side="left"))
+            end = int(np.searchsorted(self.kernels, kernel, side="right"))
+            if rank is not None:
+                ranks = self.ranks[begin:end]
+                groups = np.array([
+                    begin + int(np.searchsorted(ranks, rank, side="left")),
+                    begin + int(np.searchsorted(ranks, rank, side="right"))
+                ])
+            else:
+                groups = groups[(groups >= begin) & (groups <= end)]
+        ranges = list(zip(groups[:-1].tolist(), groups[1:].tolist()))
+        if kernel is None and rank is not None:
+            ranges = [ (begin, end) for begin, end in ranges if begin < end and self.ranks[begin] == rank ]
+
+        results : List[Tuple[int, int]] = []
+        for begin, end in ranges:
+            if start_ts is not None or end_ts is not None:
+                ts = self.start_ts[begin:end]
+                offset = begin
+                if start_ts is not None:
+                    begin = offset + int(np.searchsorted(ts, start_ts, side="left"))
+                if end_ts is not None:
+                    end = offset + int(np.searchsorted(ts, end_ts, side="left"))
+            if begin < end:
+                results.append((begin, end))
+        return results
+
+
+class _GWEventSegment:
+    """
+    Fixed-capacity segment of the event store, each column is backed by its own memory-mapped file.
+
+    Rows of the segment being appended to are never moved, since the ones beyond the last flushed
+    size would get mixed into flushed ones; instead they are indexed in memory by sorted runs (the
+    rows appended between two queries each, runs of similar sizes are merged). Once full, the rows
+    are written sorted by (kernel, rank, start_ts) into separate files, whose queries are binary
+    searches returning slices of the memory-mapped columns.
+    """
+
+    def __init__(
+        self,
+        dir_path : str,
+        segment_id : int,
+        fields : Dict[str, str],
+        capacity : int,
+        size : int = 0,
+        sealed : bool = False,
+        sorted : bool = False
+    ):
+        self._dir_path : str = dir_path
+        self.segment_id : int = segment_id
+        self.capacity : int = capacity
+        self.size : int = size
+        self.sealed : bool = sealed
+
+        # whether the rows are stored in (kernel, rank, start_ts) order, i.e., in the sorted files
+        self.sorted : bool = sorted
+        self.columns : Dict[str, np.memmap] = {}
+        for name, dtype in fields.items():
+            path = self.__column_path(name, sorted)
+            mode = "r+" if os.path.exists(path) else "w+"
+            self.columns[name] = np.memmap(path, dtype=dtype, mode=mode, shape=(capacity,))
+
+        # sorted runs indexing the rows [0, indexed_size)
+        self._runs : List[_GWSortedRun] = []
+        self._indexed_size : int = 0
+
+
+    def __column_path(self, name : str, sorted : bool) -> str:
+        return os.path.join(self._dir_path, f"seg_{self.segment_id:06d}.{name}{'.sorted' if sorted else ''}.bin")
+
+
+    def append(self, batch : Dict[str, np.ndarray], begin : int, end : int) -> int:
+        """
+        Append rows [begin, end) of the batch, returns number of appended rows
+        """
+        assert(not self.sorted)
+        nb_rows = min(end - begin, self.capacity - self.size)
+        for name, column in self.columns.items():
+            column[self.size : self.size + nb_rows] = batch[name][begin : begin + nb_rows]
+        self.size += nb_rows
+        return nb_rows
+
+
+    def get_runs(self) -> List[_GWSortedRun]:
+        """
+        Sorted runs covering all rows, indexing the rows appended since the last call
+        """
+        if self._indexed_size == self.size:
+            return self._runs
+        kernels = self.columns["kernel"][:self.size]
+        ranks = self.columns["rank"][:self.size]
+        start_ts = self.columns["start_ts"][:self.size]
+        if self.sorted:
+            self._runs = [ _GWSortedRun(kernels, ranks, start_ts) ]
+        else:
+            self._runs.append(_GWSortedRun.from_rows(
+                kernels, ranks, start_ts, np.arange(self._indexed_size, self.size, dtype=np.int64)
+            ))
+            # merge runs of similar sizes, so that there are O(log n) runs and each row is re-sorted O(log n) times
+            while len(self._runs) >= 2 and len(self._runs[-2]) <= 2 * len(self._runs[-1]):
+                last = self._runs.pop()
+                self._runs[-1] = _GWSortedRun.from_rows(
+                    kernels, ranks, start_ts, np.concatenate((self._runs[-1].order, last.order))
+                )
+        self._indexed_size = self.size
+        return self._runs
+
+
+    def seal(self):
+        """
+        Write the rows sorted into the sorted files, the unsorted ones are kept until
+        remove_unsorted_files is called once the metadata marks the segment as sorted
+        """
+        self.flush()
+        order = np.lexsort((
+            self.columns["start_ts"][:self.size], self.columns["rank"][:self.size], self.columns["kernel"][:self.size]
+        ))
+        sorted_columns : Dict[str, np.memmap] = {}
+        for name, column in self.columns.items():
+            sorted_column = np.memmap(self.__column_path(name, True), dtype=column.dtype, mode="w+", shape=(self.capacity,))
+            sorted_column[:self.size] = column[:self.size][order]
+            sorted_column.flush()
+            sorted_columns[name] = sorted_column
+        self.columns = sorted_columns
+        self.sorted = True
+        self.sealed = True
+        self._runs = []
+        self._indexed_size = 0
+
+
+    def remove_unsorted_files(self):
+        for name in self.columns.keys():
+            try:
+                os.remove(self.__column_path(name, False))
+            except OSError:
+                pass
+
+
+    def view(self, begin : int = 0, end : Optional[int] = None) -> Dict[str, np.ndarray]:
+        end = self.size if end is None else end
+        return { name: column[begin:end] for name, column in self.columns.items() }
+
+
+    def query(
+        self,
+        start_ts : Optional[int] = None,
+        end_ts : Optional[int] = None,
+        kernel : Optional[int] = None,
+        rank : Optional[int] = None
+    ) -> List[Dict[str, np.ndarray]]:
+        """
+        Columns of the matching events started within [start_ts, end_ts), one chunk per run and
+        (kernel, rank) group; chunks of sorted segments are slices, others are gathered copies
+        """
+        results : List[Dict[str, np.ndarray]] = []
+        for run in self.get_runs():
+            for begin, end in run.find_rows(start_ts, end_ts, kernel, rank):
+                if run.order is None:
+                    results.append(self.view(begin, end))
+                else:
+                    rows = run.order[begin:end]
+                    results.append({ name: np.asarray(column[rows]) for name, column in self.columns.items() })
+        return results
+
+
+    def flush(self):
+        for column in self.columns.values():
+            column.flush()
+
+
+class GWEventStore:
+    """
+    Append-only columnar store of trace / counter results collected by the scheduler.
+    Events are kept in fixed-width numpy columns backed by memory-mapped segment files,
+    kernel names are interned into int32 ids.
+
+    Queries return chunks of columns, each of a single (kernel, rank) and sorted by start timestamp:
+    zero-copy slices of the memory-mapped columns for full segments, which are stored sorted, and
+    copies for the segment still being appended to, which is only indexed in memory.
+    """
+
+    def __init__(
+        self,
+        dir_path : str,
+        extra_fields : Dict[str, str] = {},
+        segment_capacity : int = 1 << 20
+    ):
+        """
+        Parameters:
+            dir_path (str): directory to store the segment files, existing store within it would be reopened
+            extra_fields (dict): {field name, numpy dtype} of extra numeric columns besides rank/kernel/start_ts/end_ts
+            segment_capacity (int): number of events per segment
+        """
+        self._dir_path : str = dir_path
+        self._fields : Dict[str, str] = { **_BASE_FIELDS, **extra_fields }
+        self._segment_capacity : int = segment_capacity
+        self._segments : List[_GWEventSegment] = []
+
+        # interned kernel names
+        self._names : List[str] = []
+        self._name_ids : Dict[str, int] = {}
+
+        os.makedirs(dir_path, exist_ok=True)
+        self._load_meta()
+
+
+    def __len__(self) -> int:
+        return sum(segment.size for segment in self._segments)
+
+
+    def intern(self, name : str) -> int:
+        """
+        Obtain the id of the kernel name, assign a new one if not seen before
+        """
+        name_id = self._name_ids.get(name, None)
+        if name_id is None:
+            name_id = len(self._names)
+            self._names.append(name)
+            self._name_ids[name] = name_id
+        return name_id
+
+
+    def get_name(self, name_id : int) -> str:
+        return self._names[name_id]
+
+
+    def append(self, rank : int, kernel_name : str, start_ts : int, end_ts : int, **extra_fields):
+        """
+        Append a single event, prefer append_batch for bulk ingestion
+        """
+        batch = { "rank": [rank], "kernel_name": [kernel_name], "start_ts": [start_ts], "end_ts": [end_ts] }
+        for name, value in extra_fields.items():
+            batch[name] = [value]
+        self.append_batch(batch)
+
+
+    def append_batch(self, batch : Dict[str, Any]):
+        """
+        Append a batch of events
+
+        Parameters:
+            batch (dict): {field name, sequence of values}, kernel names can be given either as
+                          interned ids under 'kernel' or as strings under 'kernel_name'
+        """
+        columns : Dict[str, np.ndarray] = {}
+        if "kernel" not in batch:
+            batch = dict(batch)
+            batch["kernel"] = [ self.intern(name) for name in batch.pop("kernel_name") ]
+        for name, dtype in self._fields.items():
+            if name not in batch:
+                raise ValueError(f"field '{name}' is missing in the appended batch")
+            columns[name] = np.asarray(batch[name], dtype=dtype)
+
+        nb_rows = len(columns["start_ts"])
+        begin = 0
+        while begin < nb_rows:
+            segment = self._get_active_segment()
+            begin += segment.append(columns, begin, nb_rows)
+            if segment.size == segment.capacity:
+                # the unsorted files are only dropped once the metadata points to the sorted ones
+                segment.seal()
+                self.flush()
+                segment.remove_unsorted_files()
+
+
+    def query_time_range(
+        self,
+        start_ts : int,
+        end_ts : int,
+        kernel_name : Optional[str] = None,
+        rank : Optional[int] = None
+    ) -> List[Dict[str, np.ndarray]]:
+        """
+        Query events started within [start_ts, end_ts), optionally of the given kernel / rank
+
+        Returns:
+            list: {field name, column} per segment and (kernel, rank) group, see GWEventStore
+        """
+        kernel = None
+        if kernel_name is not None:
+            kernel = self._name_ids.get(kernel_name, None)
+            if kernel is None:
+                return []
+        results : List[Dict[str, np.ndarray]] = []
+        for segment in self._segments:
+            if segment.size > 0:
+                results += segment.query(start_ts, end_ts, kernel, rank)
+        return results
+
+
+    def query_kernel(self, kernel_name : str, rank : Optional[int] = None) -> List[Dict[str, np.ndarray]]:
+        """
+        Query events of the given kernel (and rank)
+
+        Returns:
+            list: {field name, column} per segment and (kernel, rank) group, see GWEventStore
+        """
+        results : List[Dict[str, np.ndarray]] = []
+        name_id = self._name_ids.get(kernel_name, None)
+        if name_id is None:
+            return results
+        for segment in self._segments:
+            if segment.size > 0:
+                results += segment.query(kernel=name_id, rank=rank)
+        return results
+
+
+    def iter_segments(self) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Iterate over zero-copy views of all segments
+        """
+        for segment in self._segments:
+            if segment.size > 0:
+                yield segment.view()
+
+
+    def flush(self):
+        """
+        Flush all columns and the metadata to disk
+        """
+        for segment in self._segments:
+            segment.flush()
+
+        # replace the metadata atomically, so that a crash never leaves a truncated one behind
+        meta_path = os.path.join(self._dir_path, _META_FILE_NAME)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({
+                "fields": self._fields,
+                "segment_capacity": self._segment_capacity,
+                "segments": [
+                    { "size": s.size, "sealed": s.sealed, "sorted": s.sorted } for s in self._segments
+                ],
+                "names": self._names,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(meta_path + ".tmp", meta_path)
+
+
+    def _get_active_segment(self) -> _GWEventSegment:
+        if len(self._segments) == 0 or self._segments[-1].sealed:
+            self._segments.append(_GWEventSegment(
+                self._dir_path, len(self._segments), self._fields, self._segment_capacity
+            ))
+        return self._segments[-1]
+
+
+    def _load_meta(self):
+        meta_path = os.path.join(self._dir_path, _META_FILE_NAME)
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if meta["fields"] != self._fields:
+            raise ValueError(
+                f"fields of the existing event store in {self._dir_path} mismatch: "
+                f"expected {self._fields}, got {meta['fields']}"
+            )
+        self._segment_capacity = meta["segment_capacity"]
+        for segment_id, segment_meta in enumerate(meta["segments"]):
+            self._segments.append(_GWEventSegment(
+                self._dir_path, segment_id, self._fields, self._segment_capacity,
+                size=segment_meta["size"], sealed=segment_meta["sealed"],
+                # segments of stores written before sealing sorted them are indexed in memory
+                sorted=segment_meta.get("sorted", False)
+            ))
+        for name in meta["names"]:
+            self.intern(name)
+
+
+__all__ = [ "GWEventStore" ]
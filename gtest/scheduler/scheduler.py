@@ -1,12 +1,17 @@
 import os
 import sys
-import ast
 import abc
+import time
+import signal
+import threading
+import asyncio
 import subprocess
-import importlib.util
-from typing import Literal, Callable, List, Any
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Literal, Callable, List, Any, Optional, Dict, Tuple
 from loguru import logger
 from gtest.watchscript import *
+from gtest.scheduler.zoom_search import *
+from gtest.scheduler.event_store import *
 import gtest.config as config
 
 
@@ -27,7 +32,9 @@ class GWScheduler:
         watchscript_path : str = "",
         world_size : int = 1,
         visual : bool = False,
-        command : List[str] = ""
+        command : List[str] = "",
+        max_workers : Optional[int] = None,
+        concurrent_backend : bool = False
     ):
         # create single instance if not created
         if config.SI_gw_scheduler == None:
@@ -52,78 +59,513 @@ class GWScheduler:
         watchscript_path : str = "",
         world_size : int = 1,
         visual : bool = False,
-        command : List[str] = ""
+        command : List[str] = "",
+        max_workers : Optional[int] = None,
+        concurrent_backend : bool = False
     ):
         self._backend : str = backend
         self._watchscript_path : str = watchscript_path
-        self._world_size : int = world_size
+        self._world_size : int = int(world_size)
         self._visual : bool = visual
         self._command : str = command
         self._watchscript : Callable = None
 
+        # executor for running blocking calls to the scheduler backend, sized independently of the
+        # world size, and the event to signal the main loop to shutdown
+        self._max_workers : int = max_workers if max_workers is not None else min(32, (os.cpu_count() or 1) + 4)
+        self._executor : ThreadPoolExecutor = None
+        self._executor_lock : threading.Lock = threading.Lock()
+        self._loop : asyncio.AbstractEventLoop = None
+
+        # the thread-safety of the scheduler backend is unknown, so unless it's declared thread-safe, calls
+        # of the same kind (control calls, record_range steps, profile_range steps) are serialized by one
+        # lock per kind: steps of different kinds (trace and counter collection) still overlap
+        self._backend_locks : Optional[Dict[str, threading.Lock]] = None if concurrent_backend else {
+            call_kind: threading.Lock() for call_kind in ("control", "record_range", "profile_range")
+        }
+        self._shutdown_event : asyncio.Event = None
+
+        # planner to group metrics of profile_range steps into replay passes (GWPassPlanner)
+        self._pass_planner : Any = None
+
+        # store to persist step results, and the converter from step results to column batches
+        self._event_store : GWEventStore = None
+        self._event_converter : Callable[[str, Any], Optional[Dict[str, Any]]] = None
+        self._event_store_lock : threading.Lock = threading.Lock()
+        self._event_store_flush_interval : Optional[float] = None
+        self._event_store_flushed_at : float = 0.0
+
         # should be created in __new__
         assert(self._gtest_scheduler != None)
 
         # import watchscript
         if self._watchscript_path == "":
             self._watchscript_path = f"{os.getcwd()}/WatchScript.py"
-        if os.path.exists(self._watchscript_path):
-            abs_path = os.path.abspath(self._watchscript_path)
-            spec = importlib.util.spec_from_file_location("watchscript_module", abs_path)
-            module = importlib.util.module_from_spec(spec)
-            sys.modules["watchscript_module"] = module
-            spec.loader.exec_module(module)
-            if hasattr(module, "WatchScript"):
-                self._watchscript = module.WatchScript
-                logger.info(
-                    f"WatchScript found in {self._watchscript_path}"
-                )
-            else:
-                self._watchscript = WatchScriptDefault
-                logger.warning(
-                    f"Callable 'WatchScript' not defined in {self._watchscript_path}, "
-                    f"using default watchscript"
-                )
-                
-        else:
-            self._watchscript = WatchScriptDefault
-            logger.warning(
-                f"no WatchScript given, using default watchscript"
-            )
+        self._watchscript_loader : GWWatchScriptLoader = GWWatchScriptLoader(self._watchscript_path)
+        self._watchscript = self._watchscript_loader.watchscript
 
 
     def serve(self):
         # start gtest scheduler
-        self._gtest_scheduler.serve()
+        self._call_backend("control", self._gtest_scheduler.serve)
         if self._visual:
             # TODO: start gTrace
             pass
 
 
-    def start_capsule(self):
-        self._gtest_scheduler.start_capsule(self._command)
+    def start_capsule(self, timeout : Optional[float] = None):
+        """
+        Start the capsule and block until all processes in the world are connected
+
+        Parameters:
+            timeout (float): maximum seconds to wait for the world size to match, None to wait forever
+
+        Note: when called from a coroutine, the capsule is started on a helper thread with its own
+              event loop, and the calling loop is blocked meanwhile; prefer awaiting async_start_capsule
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self.async_start_capsule(timeout=timeout))
+            return
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="gw_start_capsule") as executor:
+            executor.submit(asyncio.run, self.async_start_capsule(timeout=timeout)).result()
+
+
+    """
+    Async APIs
+    """
+    async def _run_in_executor(self, func : Callable, *args) -> Any:
+        """
+        Run a blocking call to the scheduler backend inside the executor
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), func, *args)
+
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_workers, thread_name_prefix="gw_scheduler"
+                )
+            return self._executor
+
+
+    def _call_backend(self, call_kind : str, func : Callable, *args) -> Any:
+        """
+        Call into the scheduler backend, serialized with calls of the same kind if it's not declared thread-safe
+        """
+        if self._backend_locks is None:
+            return func(*args)
+        with self._backend_locks[call_kind]:
+            return func(*args)
+
+
+    async def async_serve(self):
+        await self._run_in_executor(self.serve)
+
+
+    async def async_start_capsule(self, timeout : Optional[float] = None):
+        """
+        Start the capsule and wait until all processes in the world are connected
+
+        Parameters:
+            timeout (float): maximum seconds to wait for the world size to match, None to wait forever
+        """
+        await self._run_in_executor(self._call_backend, "control", self._gtest_scheduler.start_capsule, self._command)
+        await self.wait_world_size(timeout=timeout)
+
+
+    async def get_capsule_world_size(self) -> int:
+        return await self._run_in_executor(self._call_backend, "control", self._gtest_scheduler.get_capsule_world_size)
+
+
+    async def wait_world_size(
+        self,
+        timeout : Optional[float] = None,
+        min_poll_interval : float = 0.001,
+        max_poll_interval : float = 0.1
+    ):
+        """
+        Rendezvous barrier, wait until the number of connected capsules reaches the world size
+
+        Parameters:
+            timeout (float): maximum seconds to wait, None to wait forever
+            min_poll_interval (float): initial interval (seconds) between two polls
+            max_poll_interval (float): upper bound of the interval after exponential backoff
+        """
+        # last polled world size, reported on timeout without polling the (possibly stuck) backend again
+        world_size : int = 0
+
+        async def _barrier():
+            nonlocal world_size
+            poll_interval = min_poll_interval
+            while True:
+                world_size = await self.get_capsule_world_size()
+                if world_size >= self._world_size:
+                    return
+                # backoff so that we don't burn cpu while waiting for slow ranks
+                await asyncio.sleep(poll_interval)
+                poll_interval = min(poll_interval * 2, max_poll_interval)
+
+        try:
+            await asyncio.wait_for(_barrier(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(
+                f"rendezvous timeout after {timeout}s: {world_size}/{self._world_size} capsules connected"
+            )
+        logger.info(f"all {self._world_size} capsules connected")
+
+
+    async def run(
+        self,
+        rendezvous_timeout : Optional[float] = None,
+        watchscript_poll_interval : Optional[float] = 1.0
+    ):
+        """
+        Main loop of the scheduler: serve, start the capsule, wait for rendezvous,
+        and then sleep until shutdown is requested (by signal or by calling shutdown)
+
+        Parameters:
+            rendezvous_timeout (float): maximum seconds to wait for the world size to match
+            watchscript_poll_interval (float): interval (seconds) to check the WatchScript for changes, None to disable hot-reload
+        """
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        self._shutdown_event = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.shutdown)
+            except (NotImplementedError, RuntimeError):
+                # not supported on current platform / not in main thread
+                pass
+
+        watch_task : asyncio.Task = None
+        if watchscript_poll_interval is not None:
+            watch_task = asyncio.create_task(self._watch_watchscript(watchscript_poll_interval))
+
+        rendezvous_task : asyncio.Task = None
+        shutdown_task : asyncio.Task = None
+        try:
+            await self.async_serve()
+
+            # race the rendezvous against shutdown, so that a signal still takes effect while ranks are missing
+            rendezvous_task = asyncio.create_task(self.async_start_capsule(timeout=rendezvous_timeout))
+            shutdown_task = asyncio.create_task(self._shutdown_event.wait())
+            done, _ = await asyncio.wait((rendezvous_task, shutdown_task), return_when=asyncio.FIRST_COMPLETED)
+            if rendezvous_task in done:
+                rendezvous_task.result()
+                await shutdown_task
+            else:
+                logger.info("shutdown requested before all capsules connected")
+            logger.info("scheduler shutting down")
+        finally:
+            for task in (watch_task, rendezvous_task, shutdown_task):
+                if task is not None and not task.done():
+                    task.cancel()
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        pass
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.remove_signal_handler(sig)
+                except (NotImplementedError, RuntimeError):
+                    pass
+            self._loop = None
+            with self._executor_lock:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = None
+            if self._event_store is not None:
+                with self._event_store_lock:
+                    self._event_store.flush()
+
+
+    async def _watch_watchscript(self, poll_interval : float):
+        while True:
+            await asyncio.sleep(poll_interval)
+            await self._run_in_executor(self.reload_watchscript)
+
+
+    def reload_watchscript(self) -> bool:
+        """
+        Recompile the WatchScript if its file was changed, and swap it in;
+        on failure the previous version is kept
+
+        Returns:
+            bool: whether the active WatchScript was swapped
+        """
+        swapped = self._watchscript_loader.reload()
+        if swapped:
+            self._watchscript = self._watchscript_loader.watchscript
+            logger.info(f"WatchScript reloaded from {self._watchscript_path}")
+        return swapped
+
+
+    def get_watchscript(self) -> Callable:
+        """
+        Obtain the WatchScript to be used for the next step, the reference should be
+        held for the whole step so that a reload never swaps it halfway
+        """
+        return self._watchscript
+
 
-        # block until world size is match!
-        while(self._gtest_scheduler.get_capsule_world_size() < self._world_size):
-            continue
+    def get_collection_plan(self) -> GWCollectionPlan:
+        """
+        Obtain the deduplicated metrics and traces the active WatchScript could request,
+        so that they can be collected within a single profile_range step
+        """
+        return self._watchscript_loader.collection_plan
+
+
+    def _get_collection_plan_steps(self, list_events : List[Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        plan = self.get_collection_plan()
+        if not plan.is_complete():
+            logger.warning(
+                f"collection plan is incomplete, metrics requested by {', '.join(plan.unresolved)} "
+                f"are collected when the WatchScript requests them"
+            )
+        return plan.steps(list_events)
+
+
+    def execute_collection_plan(self, list_events : List[Any]) -> List[Any]:
+        """
+        Collect everything the active WatchScript could request on the given events in one go,
+        see GWCollectionPlan.steps
+
+        Returns:
+            list: results of each planned step
+        """
+        return self.execute_steps(self._get_collection_plan_steps(list_events))
+
+
+    async def async_execute_collection_plan(self, list_events : List[Any]) -> List[Any]:
+        return await self.async_execute_steps(self._get_collection_plan_steps(list_events))
+
+
+    def shutdown(self):
+        """
+        Request the main loop to exit, could be called from any thread
+        """
+        if self._shutdown_event is None or self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._shutdown_event.set()
+        else:
+            # asyncio.Event isn't thread-safe, set it from within its loop
+            self._loop.call_soon_threadsafe(self._shutdown_event.set)
 
 
     def execute_step(self, step_name : Literal["profile_range", "record_range"], **kwargs) -> Any:
+        func, args = self._resolve_step(step_name, kwargs)
+        return func(*args)
+
+
+    def submit_step(self, step_name : Literal["profile_range", "record_range"], **kwargs) -> Future:
+        """
+        Submit a step to the executor without blocking, the arguments are validated eagerly
+
+        Returns:
+            Future: future of the step result
+        """
+        func, args = self._resolve_step(step_name, kwargs)
+        return self._get_executor().submit(func, *args)
+
+
+    def execute_steps(self, steps : List[Tuple[str, Dict[str, Any]]]) -> List[Any]:
+        """
+        Execute a batch of steps concurrently and block until all of them finish, see async_execute_steps
+
+        Parameters:
+            steps (list): list of (step_name, kwargs) pairs
+
+        Returns:
+            list: results of each step, in the same order as the given steps
+        """
+        # resolve all steps before dispatching, so that invalid batches fail as a whole
+        resolved : List[Tuple[Callable, Tuple]] = [
+            self._resolve_step(step_name, kwargs) for step_name, kwargs in steps
+        ]
+        executor = self._get_executor()
+        futures : List[Future] = [ executor.submit(func, *args) for func, args in resolved ]
+        return [future.result() for future in futures]
+
+
+    async def async_execute_step(self, step_name : Literal["profile_range", "record_range"], **kwargs) -> Any:
+        func, args = self._resolve_step(step_name, kwargs)
+        return await self._run_in_executor(func, *args)
+
+
+    async def async_execute_steps(self, steps : List[Tuple[str, Dict[str, Any]]]) -> List[Any]:
+        """
+        Fan out a batch of steps concurrently, so that e.g. trace collection and
+        counter collection can overlap with each other; unless the scheduler is created
+        with concurrent_backend, steps of the same kind are still executed one at a time
+
+        Parameters:
+            steps (list): list of (step_name, kwargs) pairs
+
+        Returns:
+            list: results of each step, in the same order as the given steps
+        """
+        # resolve all steps before dispatching, so that invalid batches fail as a whole
+        resolved : List[Tuple[Callable, Tuple]] = [
+            self._resolve_step(step_name, kwargs) for step_name, kwargs in steps
+        ]
+        return await asyncio.gather(*[
+            self._run_in_executor(func, *args) for func, args in resolved
+        ])
+
+
+    def get_bad_kernels(
+        self,
+        list_events : List[Any],
+        metric_name : str,
+        extract_metric : Callable[[Any], float],
+        threshold : float,
+        top_k : int = 5,
+        comparator : Literal["<", "<=", ">", ">="] = "<=",
+        additive : bool = False
+    ) -> List[Tuple[Any, float]]:
+        """
+        Zoom into the kernels that cause the metric to cross the threshold,
+        with O(k log n) profile_range steps instead of one per kernel
+
+        Parameters:
+            list_events (list): kernel events to search within
+            metric_name (str): metric to be profiled
+            extract_metric (callable): reduce the result of a profile_range step to the aggregated metric value
+                                     (see set_pass_planner for its layout once a planner is set)
+            threshold (float): threshold of the metric
+            top_k (int): maximum number of bad kernels to isolate
+            comparator (str): a kernel is bad if comparator(metric, threshold) holds
+            additive (bool): whether the metric of a range is the sum of its sub-ranges
+
+        Returns:
+            list: (kernel event, metric) of each bad kernel, worst first
+        """
+        def _measure(begin : int, end : int) -> float:
+            return extract_metric(self.execute_step(
+                "profile_range", list_events=list_events[begin:end], list_metric_names=[metric_name]
+            ))
+
+        zoom_search = GWZoomSearch(
+            _measure, len(list_events), threshold, comparator=comparator, additive=additive
+        )
+        bad_kernels = zoom_search.get_bad_kernels(top_k)
+        logger.info(
+            f"zoom search isolated {len(bad_kernels)} bad kernels "
+            f"out of {len(list_events)} with {zoom_search.nb_replays} replays"
+        )
+        return [ (list_events[index], metric) for index, metric in bad_kernels ]
+
+
+    def set_pass_planner(self, pass_planner : Any):
+        """
+        Set the planner (GWPassPlanner) used to group metrics of profile_range steps into passes:
+        afterwards each profile_range step issues one backend call per planned pass (plus one for
+        the metrics unknown to the planner), and its result becomes a list of
+        (metric names of the pass, backend result) in the planned order
+        """
+        self._pass_planner = pass_planner
+
+
+    def predict_profile_passes(self, list_metric_names : List[str]) -> int:
+        """
+        Predict the number of replay passes a profile_range step with given metrics would take
+        """
+        if self._pass_planner is None:
+            raise RuntimeError("no pass planner is set")
+        return self._pass_planner.predict_num_passes(list_metric_names)
+
+
+    def attach_event_store(
+        self,
+        event_store : GWEventStore,
+        converter : Callable[[str, Any], Optional[Dict[str, Any]]],
+        flush_interval : Optional[float] = 10.0
+    ):
+        """
+        Persist results of all following steps into the event store
+
+        Parameters:
+            event_store (GWEventStore): the store to append to
+            converter (callable): converter(step_name, result) returns the column batch to be
+                                  appended (see GWEventStore.append_batch), or None to skip
+            flush_interval (float): seconds after which an append also flushes the store to disk,
+                                    so that a crash loses at most this much; None to only flush at shutdown
+        """
+        self._event_store = event_store
+        self._event_converter = converter
+        self._event_store_flush_interval = flush_interval
+        self._event_store_flushed_at = time.monotonic()
+
+
+    def _resolve_step(self, step_name : str, kwargs : Dict[str, Any]) -> Tuple[Callable, Tuple]:
+        """
+        Map a step to the corresponding scheduler backend call and its arguments
+        """
+        func, args = self._resolve_backend_call(step_name, kwargs)
+        func, args = self._call_backend, (step_name, func, *args)
+        if self._event_store is not None:
+            return self._invoke_and_store, (step_name, func, args)
+        return func, args
+
+
+    def _invoke_and_store(self, step_name : str, func : Callable, args : Tuple) -> Any:
+        result = func(*args)
+        batch = self._event_converter(step_name, result)
+        if batch is not None:
+            with self._event_store_lock:
+                self._event_store.append_batch(batch)
+                if (
+                    self._event_store_flush_interval is not None
+                    and time.monotonic() - self._event_store_flushed_at >= self._event_store_flush_interval
+                ):
+                    self._event_store.flush()
+                    self._event_store_flushed_at = time.monotonic()
+        return result
+
+
+    def _record_counter_by_pass(self, list_events : List[Any], metric_groups : List[List[str]]) -> List[Tuple[List[str], Any]]:
+        """
+        Collect the metrics one planned pass at a time, so that each backend call fits within the passes planned
+        """
+        return [
+            (metric_names, self._gtest_scheduler.step_record_counter(list_events, metric_names))
+            for metric_names in metric_groups
+        ]
+
+
+    def _resolve_backend_call(self, step_name : str, kwargs : Dict[str, Any]) -> Tuple[Callable, Tuple]:
         if step_name == "record_range":
             if ("start_ms" in kwargs and "end_ms" in kwargs):
-                return self._gtest_scheduler.step_record_event_1(kwargs["start_ms"], kwargs["end_ms"])
+                return self._gtest_scheduler.step_record_event_1, (kwargs["start_ms"], kwargs["end_ms"])
             elif "max_num_events" in kwargs:
-                return self._gtest_scheduler.step_record_event_2(kwargs["max_num_events"])
+                return self._gtest_scheduler.step_record_event_2, (kwargs["max_num_events"],)
             else:
                 raise ValueError("Invalid arguments for record_range step")
-        
+
         elif step_name == "profile_range":
             if "list_events" in kwargs and "list_metric_names" in kwargs:
-                return self._gtest_scheduler.step_record_counter(
+                if self._pass_planner is not None:
+                    return self._record_counter_by_pass, (
+                        kwargs["list_events"], self._pass_planner.group(kwargs["list_metric_names"])
+                    )
+                return self._gtest_scheduler.step_record_counter, (
                     kwargs["list_events"], kwargs["list_metric_names"]
                 )
             else:
                 raise ValueError("Invalid arguments for profile_range step")
 
+        else:
+            raise ValueError(f"Unknown step: {step_name}")
+
 
 __all__ = [ "GWScheduler" ]
@@ -0,0 +1,118 @@
+import heapq
+import operator
+from typing import Callable, Dict, List, Literal, Optional, Tuple
+
+
+_COMPARATORS : Dict[str, Callable[[float, float], bool]] = {
+    "<":  operator.lt,
+    "<=": operator.le,
+    ">":  operator.gt,
+    ">=": operator.ge,
+}
+
+
+class GWZoomSearch:
+    """
+    Zoom Search (缩圈式搜寻): localize the kernels whose metric crosses the threshold by
+    adaptive group testing. Starting from a range-level metric over all kernels, ranges whose
+    aggregated metric crosses the threshold are recursively split in half, until the top-k
+    offending kernels are isolated. Every range is measured at most once.
+
+    Ranges are half-open kernel index intervals [begin, end).
+    """
+
+    def __init__(
+        self,
+        measure : Callable[[int, int], float],
+        num_kernels : int,
+        threshold : float,
+        comparator : Literal["<", "<=", ">", ">="] = "<=",
+        additive : bool = False
+    ):
+        """
+        Parameters:
+            measure (callable): measure(begin, end) replays kernels within [begin, end) and returns the aggregated metric
+            num_kernels (int): total number of kernels
+            threshold (float): threshold of the metric
+            comparator (str): a kernel is bad if comparator(metric, threshold) holds
+            additive (bool): whether the metric of a range is the sum of its sub-ranges, in which case
+                             the metric of a sibling range is derived instead of measured
+        """
+        if comparator not in _COMPARATORS:
+            raise ValueError(f"invalid comparator '{comparator}', should be one of {list(_COMPARATORS.keys())}")
+
+        self._measure : Callable[[int, int], float] = measure
+        self._num_kernels : int = num_kernels
+        self._threshold : float = threshold
+        self._comparator : str = comparator
+        self._additive : bool = additive
+
+        # {(begin, end), metric}
+        self._measured : Dict[Tuple[int, int], float] = {}
+        self._nb_replays : int = 0
+
+
+    @property
+    def nb_replays(self) -> int:
+        """
+        Number of replays conducted so far
+        """
+        return self._nb_replays
+
+
+    def get_metric(self, begin : int, end : int) -> float:
+        """
+        Obtain the aggregated metric of [begin, end), reuse the measured value if exists
+        """
+        key = (begin, end)
+        if key not in self._measured:
+            self._measured[key] = self._measure(begin, end)
+            self._nb_replays += 1
+        return self._measured[key]
+
+
+    def get_bad_kernels(self, top_k : int) -> List[Tuple[int, float]]:
+        """
+        Isolate up to top_k bad kernels, worst first
+
+        Returns:
+            list: (kernel index, metric) of each bad kernel
+        """
+        bad_kernels : List[Tuple[int, float]] = []
+        if self._num_kernels <= 0 or top_k <= 0:
+            return bad_kernels
+
+        # best-first search: always zoom into the worst range, so that the
+        # first leaves we reach are the top offenders
+        heap : List[Tuple[float, int, int, float]] = []
+        self._push(heap, 0, self._num_kernels, self.get_metric(0, self._num_kernels))
+
+        while heap and len(bad_kernels) < top_k:
+            _, begin, end, metric = heapq.heappop(heap)
+
+            if end - begin == 1:
+                bad_kernels.append((begin, metric))
+                continue
+
+            mid = (begin + end) // 2
+            left_metric = self.get_metric(begin, mid)
+            if self._additive and (mid, end) not in self._measured:
+                self._measured[(mid, end)] = metric - left_metric
+            right_metric = self.get_metric(mid, end)
+
+            self._push(heap, begin, mid, left_metric)
+            self._push(heap, mid, end, right_metric)
+
+        return bad_kernels
+
+
+    def _push(self, heap : List, begin : int, end : int, metric : float):
+        # only zoom into ranges that cross the threshold
+        if not _COMPARATORS[self._comparator](metric, self._threshold):
+            return
+        # smaller metric is worse for '<'/'<=', larger metric is worse for '>'/'>='
+        priority = metric if self._comparator in ("<", "<=") else -metric
+        heapq.heappush(heap, (priority, begin, end, metric))
+
+
+__all__ = [ "GWZoomSearch" ]
@@ -19,9 +19,17 @@ try:
 except OSError as e:
     raise RuntimeError(f"failed to load '{lib_path}': {e}")
 
+from gtest.toolbox.inline_profiler.metric_catalog import *
 from gtest.toolbox.inline_profiler.context import *
+from gtest.common.event_timer import *
+from gtest.toolbox.inline_profiler.pm_stream import *
+from gtest.toolbox.inline_profiler.derived_metrics import *
 from gtest.toolbox.inline_profiler.profiler import *
 from gtest.toolbox.inline_profiler.device import *
+from gtest.toolbox.inline_profiler.pass_planner import *
+from gtest.toolbox.inline_profiler.replay_cost_model import *
+from gtest.toolbox.inline_profiler.result_cache import *
+from gtest.toolbox.inline_profiler.profiler_group import *
 
 
 # import torch adaptor
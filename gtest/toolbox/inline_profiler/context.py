@@ -1,8 +1,9 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 import gtest.libgtest_toolbox as _C_toolbox
 from gtest.toolbox.inline_profiler.profiler import *
 from gtest.toolbox.inline_profiler.device import *
+from gtest.toolbox.inline_profiler.metric_catalog import *
 
 
 
@@ -22,9 +23,27 @@ class GWContext:
                 kwargs["lazy_init_device"] = True
 
             self._si_gtest = _C_toolbox.GWContext_CUDA(kwargs["lazy_init_device"])
+
+            # {device_id, metric catalog}, None for all devices without a dedicated catalog
+            self._metric_catalogs : Dict[Optional[int], GWMetricCatalog] = {}
         return self._instance
 
 
+    def set_metric_catalog(self, metric_catalog : GWMetricCatalog, device_id : Optional[int] = None):
+        """
+        Set the catalog to validate metric names against before creating profilers
+
+        Parameters:
+            metric_catalog (GWMetricCatalog): catalog of the GPU model, see GWMetricCatalog.load
+            device_id (int): the device the catalog belongs to, default to be all devices
+        """
+        self._metric_catalogs[device_id] = metric_catalog
+
+
+    def get_metric_catalog(self, device_id : int) -> Optional[GWMetricCatalog]:
+        return self._metric_catalogs.get(device_id, self._metric_catalogs.get(None, None))
+
+
     def create_profiler(self, deviceId : int, metricNames : List[str], profiler_mode : str = "") -> GWProfiler:
         """
         Creates a new profiling session for the specified NVIDIA GPU device.
@@ -32,9 +51,14 @@ class GWContext:
         Parameters:
             deviceId (int): The ID of the NVIDIA GPU device to profile.
             metricNames (list[str]): A list of metric names to collect during profiling.
+
+        Note: metric names are validated against the metric catalog (if set) before reaching the device
         """
+        metric_catalog = self.get_metric_catalog(deviceId)
+        if metric_catalog is not None:
+            metric_catalog.validate(metricNames)
         _gw_profiler = self._si_gtest.create_profiler(deviceId, metricNames, profiler_mode)
-        return GWProfiler(_gw_profiler, profiler_mode)
+        return GWProfiler(_gw_profiler, profiler_mode, device_id=deviceId, metric_names=metricNames)
 
 
     def destory_profiler(self, profiler : GWProfiler):
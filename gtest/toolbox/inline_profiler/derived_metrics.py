@@ -0,0 +1,197 @@
+import ast
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# raw counter of the duration (in ns) of a range, used by per_second
+GW_DURATION_METRIC = "gpu__time_duration.sum"
+
+# functions allowed within expressions, evaluated element-wise
+_FUNCTIONS = {
+    "min": np.minimum,
+    "max": np.maximum,
+    "abs": np.abs,
+    "sqrt": np.sqrt,
+    "where": np.where,
+}
+
+
+def _dotted_name(node : ast.AST) -> Optional[str]:
+    """
+    Metric names like "sm__warps_active.avg.pct_of_peak_sustained_active" parse as attribute
+    chains, recover the full name
+    """
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        prefix = _dotted_name(node.value)
+        return f"{prefix}.{node.attr}" if prefix is not None else None
+    return None
+
+
+class _GWMetricReferenceRewriter(ast.NodeTransformer):
+    """
+    Replace metric references with lookups into the column table, and expand per_second
+    """
+
+    def __init__(self, definitions : Dict[str, str], expanding : Tuple[str, ...]):
+        self._definitions : Dict[str, str] = definitions
+        self._expanding : Tuple[str, ...] = expanding
+        self.raw_metrics : List[str] = []
+
+
+    def __reference(self, metric_name : str) -> ast.AST:
+        # derived metrics are inlined, so that all expressions only depend on raw counters
+        if metric_name in self._definitions:
+            if metric_name in self._expanding:
+                raise ValueError(f"cyclic derived metric definition: {' -> '.join(self._expanding + (metric_name,))}")
+            rewriter = _GWMetricReferenceRewriter(self._definitions, self._expanding + (metric_name,))
+            tree = rewriter.visit(ast.parse(self._definitions[metric_name], mode="eval")).body
+            self.raw_metrics += rewriter.raw_metrics
+            return tree
+        self.raw_metrics.append(metric_name)
+        return ast.Subscript(
+            value=ast.Name(id="_columns", ctx=ast.Load()),
+            slice=ast.Constant(value=metric_name),
+            ctx=ast.Load()
+        )
+
+
+    def visit_Name(self, node : ast.Name) -> ast.AST:
+        return self.__reference(node.id)
+
+
+    def visit_Attribute(self, node : ast.Attribute) -> ast.AST:
+        metric_name = _dotted_name(node)
+        if metric_name is None:
+            raise ValueError(f"unsupported expression: {ast.unparse(node)}")
+        return self.__reference(metric_name)
+
+
+    def visit_Call(self, node : ast.Call) -> ast.AST:
+        function_name = node.func.id if isinstance(node.func, ast.Name) else None
+        if function_name == "per_second":
+            if len(node.args) != 1:
+                raise ValueError("per_second takes exactly one argument")
+            return ast.BinOp(
+                left=self.visit(node.args[0]),
+                op=ast.Div(),
+                right=ast.BinOp(left=self.__reference(GW_DURATION_METRIC), op=ast.Mult(), right=ast.Constant(value=1e-9))
+            )
+        if function_name not in _FUNCTIONS or len(node.keywords) > 0:
+            raise ValueError(f"unsupported function in expression: {ast.unparse(node.func)}")
+        return ast.Call(
+            func=ast.Name(id=function_name, ctx=ast.Load()),
+            args=[ self.visit(arg) for arg in node.args ],
+            keywords=[]
+        )
+
+
+    def generic_visit(self, node : ast.AST) -> ast.AST:
+        if not isinstance(node, (
+            ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Constant, ast.Load,
+            ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd,
+            ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq
+        )):
+            raise ValueError(f"unsupported syntax in expression: {type(node).__name__}")
+        return super().generic_visit(node)
+
+
+class GWDerivedMetricEngine:
+    """
+    Derived metrics declared as expressions over raw counters (and other derived metrics), e.g.,
+        "achieved_occupancy": "sm__warps_active.avg.pct_of_peak_sustained_active / 100"
+        "dram_bandwidth": "per_second(dram__bytes_read.sum + dram__bytes_write.sum)"
+
+    Expressions support + - * / **, comparisons, min / max / abs / sqrt / where, and per_second(x),
+    which divides by the range duration. All expressions are compiled once, and evaluated with
+    numpy over all ranges (or samples) at once.
+    """
+
+    def __init__(self, definitions : Dict[str, str]):
+        """
+        Parameters:
+            definitions (dict): {derived metric name, expression}
+        """
+        self._definitions : Dict[str, str] = dict(definitions)
+
+        # {derived metric name, (compiled expression, raw counters it depends on)}
+        self._compiled : Dict[str, Tuple[Any, List[str]]] = {}
+        for metric_name in self._definitions.keys():
+            rewriter = _GWMetricReferenceRewriter(self._definitions, (metric_name,))
+            try:
+                tree = rewriter.visit(ast.parse(self._definitions[metric_name], mode="eval"))
+            except SyntaxError as e:
+                raise ValueError(f"invalid expression of derived metric {metric_name}: {e}")
+            code = compile(ast.fix_missing_locations(tree), f"<derived metric {metric_name}>", "eval")
+            self._compiled[metric_name] = (code, list(dict.fromkeys(rewriter.raw_metrics)))
+
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._definitions.keys())
+
+
+    def get_raw_metrics(self, metric_names : Optional[List[str]] = None) -> List[str]:
+        """
+        Raw counters needed by the given derived metrics (default to be all), deduplicated,
+        to be passed to GWContext.create_profiler
+        """
+        metric_names = metric_names if metric_names is not None else self.names
+        raw_metrics : Dict[str, None] = {}
+        for metric_name in metric_names:
+            for raw_metric in self._compiled[metric_name][1]:
+                raw_metrics[raw_metric] = None
+        return sorted(raw_metrics.keys())
+
+
+    def evaluate(
+        self,
+        columns : Dict[str, Any],
+        metric_names : Optional[List[str]] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Evaluate derived metrics over columns of raw counters
+
+        Parameters:
+            columns (dict): {raw counter name, values of all ranges / samples}
+            metric_names (list[str]): derived metrics to evaluate, default to be all
+
+        Returns:
+            dict: {derived metric name, values}, division by zero yields inf / NaN
+        """
+        metric_names = metric_names if metric_names is not None else self.names
+        arrays = { name: np.asarray(values, dtype=np.float64) for name, values in columns.items() }
+        missing = [ raw_metric for raw_metric in self.get_raw_metrics(metric_names) if raw_metric not in arrays ]
+        if len(missing) > 0:
+            raise KeyError(f"raw counters not collected: {', '.join(missing)}")
+        namespace = { "__builtins__": {}, "_columns": arrays, **_FUNCTIONS }
+        results : Dict[str, np.ndarray] = {}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for metric_name in metric_names:
+                results[metric_name] = np.asarray(eval(self._compiled[metric_name][0], namespace), dtype=np.float64)
+        return results
+
+
+    def evaluate_ranges(
+        self,
+        range_metrics : Dict[str, Dict[str, float]],
+        metric_names : Optional[List[str]] = None
+    ) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        """
+        Evaluate derived metrics over per-range counters, as {range_name: {raw counter name: value}}
+        (counters missing in a range are NaN)
+
+        Returns:
+            tuple: range names, {derived metric name, values aligned with range names}
+        """
+        range_names = list(range_metrics.keys())
+        metric_names = metric_names if metric_names is not None else self.names
+        columns = {
+            raw_metric: [ range_metrics[range_name].get(raw_metric, np.nan) for range_name in range_names ]
+            for raw_metric in self.get_raw_metrics(metric_names)
+        }
+        return range_names, self.evaluate(columns, metric_names)
+
+
+__all__ = [ "GWDerivedMetricEngine", "GW_DURATION_METRIC" ]
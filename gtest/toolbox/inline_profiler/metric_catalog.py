@@ -0,0 +1,268 @@
+import os
+import re
+import json
+import bisect
+import difflib
+import functools
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from gtest.toolbox.inline_profiler.pass_planner import *
+from gtest.toolbox.inline_profiler.pass_planner import _parse_metric_properties
+
+
+# file exposing the version of the loaded kernel driver on Linux
+_DRIVER_VERSION_PATH : str = "/proc/driver/nvidia/version"
+
+
+def _query_driver_version() -> str:
+    try:
+        with open(_DRIVER_VERSION_PATH, "r") as f:
+            driver_version = re.search(r"Kernel Module\s+([0-9.]+)", f.read())
+        if driver_version is not None:
+            return driver_version.group(1)
+    except OSError:
+        pass
+    try:
+        import pynvml
+        pynvml.nvmlInit()
+        try:
+            driver_version = pynvml.nvmlSystemGetDriverVersion()
+        finally:
+            pynvml.nvmlShutdown()
+        return driver_version.decode() if isinstance(driver_version, bytes) else str(driver_version)
+    except Exception:
+        logger.warning("failed to query the driver version, cached metric catalogs are keyed by 'unknown'")
+        return "unknown"
+
+
+@functools.lru_cache(maxsize=None)
+def query_device_versions(device_id : int) -> Tuple[str, str, str]:
+    """
+    Query the GPU model, driver version and CUDA runtime version of a device, which are the keys
+    of the cached catalogs; the device is queried through the CUDA runtime loaded by torch, so
+    device_id is the CUDA ordinal (i.e., subject to CUDA_VISIBLE_DEVICES)
+
+    Returns:
+        tuple: (gpu_model, driver_version, cuda_version)
+    """
+    try:
+        import torch
+    except ImportError:
+        raise RuntimeError("querying versions of a device requires torch, pass them to GWMetricCatalog.load instead")
+    if not torch.cuda.is_available() or not 0 <= device_id < torch.cuda.device_count():
+        raise RuntimeError(f"no CUDA device {device_id} to query versions of")
+    gpu_model = torch.cuda.get_device_properties(device_id).name
+    cuda_version = torch.version.cuda if torch.version.cuda is not None else "unknown"
+    return gpu_model, _query_driver_version(), cuda_version
+
+
+class GWMetricCatalog:
+    """
+    Indexed catalog of the metrics available on a GPU model, loaded from the metric properties
+    dumped by GWDevice.export_metric_properties, so that metric names could be looked up,
+    listed by prefix and validated without initializing any device.
+
+    Catalogs are cached on disk under <cache_dir>/<gpu_model>/<driver_version>-<cuda_version>.json,
+    a dump only needs to be imported once per GPU model and driver / CUDA version.
+    """
+
+    # bumped whenever the layout of the cached catalog changes
+    FORMAT_VERSION = 1
+
+    def __init__(
+        self,
+        gpu_model : str,
+        metric_properties : Dict[str, Dict[str, Any]],
+        counters_per_unit : Optional[Dict[str, int]] = None
+    ):
+        """
+        Parameters:
+            gpu_model (str): name of the GPU model
+            metric_properties (dict): {metric_name, properties}
+            counters_per_unit (dict): {hw_unit, number of counters available within one pass}
+        """
+        self._gpu_model : str = gpu_model
+        self._metric_properties : Dict[str, Dict[str, Any]] = metric_properties
+        self._counters_per_unit : Dict[str, int] = counters_per_unit if counters_per_unit is not None else {}
+
+        # sorted names for prefix queries, and names grouped by their first component
+        # (e.g., "sm" of "sm__warps_active.avg") to narrow down fuzzy matching
+        self._sorted_names : List[str] = sorted(metric_properties.keys())
+        self._names_by_unit : Dict[str, List[str]] = {}
+        for metric_name in self._sorted_names:
+            self._names_by_unit.setdefault(metric_name.split("__")[0], []).append(metric_name)
+
+
+    @property
+    def gpu_model(self) -> str:
+        return self._gpu_model
+
+
+    @property
+    def names(self) -> List[str]:
+        return self._sorted_names
+
+
+    def __contains__(self, metric_name : str) -> bool:
+        return metric_name in self._metric_properties
+
+
+    def __len__(self) -> int:
+        return len(self._sorted_names)
+
+
+    def get(self, metric_name : str) -> Dict[str, Any]:
+        """
+        Returns the properties of the metric
+        """
+        self.validate([ metric_name ])
+        return self._metric_properties[metric_name]
+
+
+    def with_prefix(self, prefix : str) -> List[str]:
+        """
+        Returns all metric names starting with prefix, in sorted order
+        """
+        begin = bisect.bisect_left(self._sorted_names, prefix)
+        end = begin
+        while end < len(self._sorted_names) and self._sorted_names[end].startswith(prefix):
+            end += 1
+        return self._sorted_names[begin:end]
+
+
+    def suggest(self, metric_name : str, n : int = 3) -> List[str]:
+        """
+        Returns up to n known metric names close to the given one
+        """
+        candidates = self._names_by_unit.get(metric_name.split("__")[0], None)
+        suggestions = difflib.get_close_matches(metric_name, candidates, n=n, cutoff=0.6) if candidates else []
+        if len(suggestions) == 0:
+            suggestions = difflib.get_close_matches(metric_name, self._sorted_names, n=n, cutoff=0.6)
+        return suggestions
+
+
+    def validate(self, metric_names : List[str]):
+        """
+        Raise KeyError listing the unknown metrics together with suggestions
+        """
+        messages : List[str] = []
+        for metric_name in metric_names:
+            if metric_name in self._metric_properties:
+                continue
+            suggestions = self.suggest(metric_name)
+            if len(suggestions) > 0:
+                messages.append(f"'{metric_name}' (did you mean {', '.join(suggestions)}?)")
+            else:
+                messages.append(f"'{metric_name}'")
+        if len(messages) > 0:
+            raise KeyError(f"unknown metrics on {self._gpu_model}: {'; '.join(messages)}")
+
+
+    def create_pass_planner(self) -> GWPassPlanner:
+        return GWPassPlanner(self._gpu_model, self._metric_properties, self._counters_per_unit)
+
+
+    @staticmethod
+    def get_cache_path(cache_dir : str, gpu_model : str, driver_version : str, cuda_version : str) -> str:
+        sanitize = lambda s: re.sub(r"[^A-Za-z0-9._-]+", "_", str(s))
+        return os.path.join(cache_dir, sanitize(gpu_model), f"{sanitize(driver_version)}-{sanitize(cuda_version)}.json")
+
+
+    @classmethod
+    def from_dump(cls, gpu_model : str, metric_properties_path : str) -> 'GWMetricCatalog':
+        """
+        Create the catalog from the metric properties exported by GWDevice.export_metric_properties,
+        either a file or the directory exported into (all json files within are merged), see
+        _parse_metric_properties for the accepted layouts
+        """
+        if os.path.isdir(metric_properties_path):
+            paths = [
+                os.path.join(metric_properties_path, file_name)
+                for file_name in sorted(os.listdir(metric_properties_path)) if file_name.endswith(".json")
+            ]
+            if len(paths) == 0:
+                raise FileNotFoundError(f"no dumped metric properties under {metric_properties_path}")
+        else:
+            paths = [ metric_properties_path ]
+
+        metric_properties : Dict[str, Dict[str, Any]] = {}
+        counters_per_unit : Dict[str, int] = {}
+        for path in paths:
+            with open(path, "r") as f:
+                try:
+                    parsed_metric_properties, parsed_counters_per_unit = _parse_metric_properties(json.load(f))
+                except ValueError as e:
+                    raise ValueError(f"failed to parse dumped metric properties {path}: {e}")
+            metric_properties.update(parsed_metric_properties)
+            counters_per_unit.update(parsed_counters_per_unit)
+        return cls(gpu_model, metric_properties, counters_per_unit)
+
+
+    @classmethod
+    def load(
+        cls,
+        cache_dir : str,
+        gpu_model : str,
+        driver_version : str,
+        cuda_version : str,
+        metric_properties_path : Optional[str] = None
+    ) -> 'GWMetricCatalog':
+        """
+        Load the catalog from the cache, or import it from the dumped metric properties file
+        (and cache it) if the cache misses or is outdated
+
+        Parameters:
+            cache_dir (str): root directory of the cached catalogs
+            gpu_model (str): name of the GPU model
+            driver_version (str): version of the driver
+            cuda_version (str): version of CUDA
+            metric_properties_path (str): dumped metric properties file, required on cache miss
+        """
+        cache_path = GWMetricCatalog.get_cache_path(cache_dir, gpu_model, driver_version, cuda_version)
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r") as f:
+                    cached = json.load(f)
+                if cached.get("format_version", None) == cls.FORMAT_VERSION:
+                    return cls(gpu_model, cached["metrics"], cached.get("counters_per_unit", None))
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"failed to load cached metric catalog {cache_path}: {e}")
+
+        if metric_properties_path is None:
+            raise FileNotFoundError(
+                f"no cached metric catalog for {gpu_model} (driver {driver_version}, CUDA {cuda_version}), "
+                f"dump the metric properties with gtest/utils/dump_metric.py and pass metric_properties_path"
+            )
+        catalog = cls.from_dump(gpu_model, metric_properties_path)
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path + ".tmp", "w") as f:
+            json.dump({
+                "format_version": cls.FORMAT_VERSION,
+                "gpu_model": gpu_model,
+                "driver_version": driver_version,
+                "cuda_version": cuda_version,
+                "metrics": catalog._metric_properties,
+                "counters_per_unit": catalog._counters_per_unit,
+            }, f)
+        os.replace(cache_path + ".tmp", cache_path)
+        return catalog
+
+
+    @classmethod
+    def load_for_device(
+        cls,
+        cache_dir : str,
+        device_id : int,
+        metric_properties_path : Optional[str] = None
+    ) -> 'GWMetricCatalog':
+        """
+        Same as load, with the GPU model, driver and CUDA versions queried from the device, see query_device_versions
+        """
+        gpu_model, driver_version, cuda_version = query_device_versions(device_id)
+        return cls.load(cache_dir, gpu_model, driver_version, cuda_version, metric_properties_path)
+
+
+__all__ = [ "GWMetricCatalog", "query_device_versions" ]
@@ -0,0 +1,180 @@
+import json
+from typing import Dict, List, Any, Optional, Set, Tuple, FrozenSet
+
+from loguru import logger
+
+
+def _parse_metric_properties(dumped : Any) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, int]]:
+    """
+    Parse dumped metric properties into ({metric_name, properties}, {hw_unit, capacity}), accepting
+    the cached catalog layout {"metrics": ..., "counters_per_unit": ...}, a flat {metric_name: properties}
+    mapping, or a list of properties each carrying its "name" / "metric_name"
+    """
+    if isinstance(dumped, dict) and isinstance(dumped.get("metrics", None), (dict, list)):
+        metric_properties, _ = _parse_metric_properties(dumped["metrics"])
+        return metric_properties, dict(dumped.get("counters_per_unit", None) or {})
+    if isinstance(dumped, dict) and all(isinstance(properties, dict) for properties in dumped.values()):
+        return dict(dumped), {}
+    if isinstance(dumped, list):
+        metric_properties : Dict[str, Dict[str, Any]] = {}
+        for properties in dumped:
+            name = properties.get("name", properties.get("metric_name", None)) if isinstance(properties, dict) else None
+            if name is None:
+                raise ValueError(f"metric properties without name: {properties}")
+            metric_properties[name] = properties
+        return metric_properties, {}
+    raise ValueError("unrecognized layout of dumped metric properties")
+
+
+class GWPassPlanner:
+    """
+    Group requested metrics into the minimum number of compatible replay passes,
+    based on the metric properties of the device (as exported by GWDevice.export_metric_properties).
+
+    Each metric property is expected to contain:
+        hw_unit (str): the hardware unit whose counters the metric consumes
+        num_counters (int): number of counters the metric occupies on that unit
+        num_passes (int): number of passes the metric needs when collected alone (default 1)
+
+    Metrics that need more than one pass on their own are never co-scheduled, since the
+    backend splits them across passes anyway; neither are metrics of units missing from
+    counters_per_unit, whose capacity is unknown.
+    """
+
+    def __init__(
+        self,
+        device_name : str,
+        metric_properties : Dict[str, Dict[str, Any]],
+        counters_per_unit : Dict[str, int]
+    ):
+        """
+        Parameters:
+            device_name (str): name of the device the properties belong to, used as part of the cache key
+            metric_properties (dict): {metric_name, properties}
+            counters_per_unit (dict): {hw_unit, number of counters available within one pass}
+        """
+        self._device_name : str = device_name
+        self._metric_properties : Dict[str, Dict[str, Any]] = metric_properties
+        self._counters_per_unit : Dict[str, int] = counters_per_unit
+
+        # {(device_name, metric set), planned passes}
+        self._plan_cache : Dict[Tuple[str, FrozenSet[str]], List[List[str]]] = {}
+
+        # units already warned about missing from counters_per_unit
+        self._unknown_units : Set[str] = set()
+
+
+    @classmethod
+    def from_file(cls, device_name : str, metric_properties_path : str) -> 'GWPassPlanner':
+        """
+        Create the planner from a dumped metric properties file, see _parse_metric_properties
+        for the accepted layouts (GWMetricCatalog.from_dump also accepts directories)
+        """
+        with open(metric_properties_path, "r") as f:
+            metric_properties, counters_per_unit = _parse_metric_properties(json.load(f))
+        return cls(device_name, metric_properties, counters_per_unit)
+
+
+    def plan(self, metric_names : List[str]) -> List[List[str]]:
+        """
+        Group the metrics into passes
+
+        Parameters:
+            metric_names (list[str]): metrics to be collected
+
+        Returns:
+            list[list[str]]: metric names of each pass
+        """
+        key = (self._device_name, frozenset(metric_names))
+        if key not in self._plan_cache:
+            self._plan_cache[key] = self._pack(sorted(key[1]))
+        return self._plan_cache[key]
+
+
+    def group(self, metric_names : List[str]) -> List[List[str]]:
+        """
+        Group the metrics into the planned passes, each listing its metrics in the caller's order,
+        followed by one group of the metrics unknown on the device (if any), left to the backend
+
+        Returns:
+            list[list[str]]: metric names of each group, each requested metric appears exactly once
+        """
+        metric_names = list(dict.fromkeys(metric_names))
+        known_metric_names = [ metric_name for metric_name in metric_names if metric_name in self._metric_properties ]
+        pass_indices : Dict[str, int] = {}
+        for pass_index, metric_names_in_pass in enumerate(self.plan(known_metric_names)):
+            for metric_name in metric_names_in_pass:
+                pass_indices[metric_name] = pass_index
+        groups : List[List[str]] = [ [] for _ in range(len(self.plan(known_metric_names))) ]
+        for metric_name in known_metric_names:
+            groups[pass_indices[metric_name]].append(metric_name)
+        unknown_metric_names = [ metric_name for metric_name in metric_names if metric_name not in pass_indices ]
+        if len(unknown_metric_names) > 0:
+            groups.append(unknown_metric_names)
+        return groups
+
+
+    def predict_num_passes(self, metric_names : List[str]) -> int:
+        """
+        Predict the number of replay passes to collect the given metrics, metrics unknown on the
+        device are counted as one extra pass, as they are collected by a call of their own
+        """
+        known_metric_names = [ metric_name for metric_name in metric_names if metric_name in self._metric_properties ]
+        nb_passes = 1 if len(known_metric_names) < len(metric_names) else 0
+        for metric_names_in_pass in self.plan(known_metric_names):
+            nb_passes += max(
+                self._get_property(metric_name).get("num_passes", 1)
+                for metric_name in metric_names_in_pass
+            )
+        return nb_passes
+
+
+    def _get_property(self, metric_name : str) -> Dict[str, Any]:
+        if metric_name not in self._metric_properties:
+            raise KeyError(f"metric '{metric_name}' is not available on device {self._device_name}")
+        return self._metric_properties[metric_name]
+
+
+    def _pack(self, metric_names : List[str]) -> List[List[str]]:
+        """
+        First-fit decreasing bin-packing, the capacity of each bin (pass) is the
+        number of counters of each hardware unit
+        """
+        passes : List[List[str]] = []
+        passes_usage : List[Dict[str, int]] = []
+        standalone_passes : List[List[str]] = []
+
+        # place largest metrics first, keep the order deterministic for ties
+        metric_names = sorted(
+            metric_names, key=lambda name: -self._get_property(name).get("num_counters", 1)
+        )
+
+        for metric_name in metric_names:
+            prop = self._get_property(metric_name)
+            hw_unit : str = prop.get("hw_unit", "")
+            num_counters : int = prop.get("num_counters", 1)
+            capacity : Optional[int] = self._counters_per_unit.get(hw_unit, None)
+            if capacity is None and hw_unit not in self._unknown_units:
+                self._unknown_units.add(hw_unit)
+                logger.warning(
+                    f"no counter capacity of unit '{hw_unit}' on device {self._device_name}, "
+                    f"its metrics are planned into passes of their own"
+                )
+
+            if prop.get("num_passes", 1) > 1 or capacity is None or num_counters > capacity:
+                standalone_passes.append([metric_name])
+                continue
+
+            for pass_, usage in zip(passes, passes_usage):
+                if usage.get(hw_unit, 0) + num_counters <= capacity:
+                    pass_.append(metric_name)
+                    usage[hw_unit] = usage.get(hw_unit, 0) + num_counters
+                    break
+            else:
+                passes.append([metric_name])
+                passes_usage.append({ hw_unit: num_counters })
+
+        return passes + standalone_passes
+
+
+__all__ = [ 'GWPassPlanner' ]
@@ -0,0 +1,214 @@
+import time
+import threading
+import numpy as np
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+
+class GWPmSampleChunk:
+    """
+    Preallocated chunk of PM samples, timestamps (ns) of shape [chunk_size] and values
+    of shape [chunk_size, nb_metrics], only the first nb_samples rows are valid
+    """
+
+    def __init__(self, chunk_size : int, metric_names : List[str]):
+        self.metric_names : List[str] = metric_names
+        self._timestamps : np.ndarray = np.zeros(chunk_size, dtype=np.int64)
+        self._values : np.ndarray = np.zeros((chunk_size, len(metric_names)), dtype=np.float64)
+        self.nb_samples : int = 0
+
+
+    @property
+    def capacity(self) -> int:
+        return self._timestamps.shape[0]
+
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps[:self.nb_samples]
+
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._values[:self.nb_samples]
+
+
+    def get_metric(self, metric_name : str) -> np.ndarray:
+        return self._values[:self.nb_samples, self.metric_names.index(metric_name)]
+
+
+def _decode_pm_samples(raw : Any, metric_names : List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decode the output of PmSampling_get_metrics, a mapping of metric name to per-sample values
+    with optional per-sample "timestamp", into (timestamps [n], values [n, nb_metrics]);
+    samples without device timestamps are stamped with the host time of the drain
+    """
+    if raw is None or len(raw) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, len(metric_names)), dtype=np.float64)
+    values = np.stack([ np.asarray(raw[metric_name], dtype=np.float64) for metric_name in metric_names ], axis=1)
+    if "timestamp" in raw:
+        timestamps = np.asarray(raw["timestamp"], dtype=np.int64)
+    else:
+        timestamps = np.full(values.shape[0], time.time_ns(), dtype=np.int64)
+    return timestamps, values
+
+
+class GWPmSamplingStream:
+    """
+    Continuously drain PM samples from a background thread into a small ring of preallocated
+    numpy chunks (double-buffered by default): the drain thread fills one chunk while the
+    consumer reads the completed ones. If the consumer falls behind, the oldest completed
+    chunk is overwritten and counted in nb_dropped_samples.
+    """
+
+    def __init__(
+        self,
+        pm_sampling : Any,
+        metric_names : List[str],
+        chunk_size : int = 4096,
+        nb_chunks : int = 2,
+        drain_interval : float = 0.05,
+        decode : Callable[[Any, List[str]], Tuple[np.ndarray, np.ndarray]] = _decode_pm_samples
+    ):
+        """
+        Parameters:
+            pm_sampling: the PM sampling APIs of a GWProfiler
+            metric_names (list[str]): sampled metrics, in the column order of the chunks
+            chunk_size (int): number of samples per chunk
+            nb_chunks (int): number of chunks in the ring, at least 2
+            drain_interval (float): seconds between two drains of the sampling buffer
+            decode (callable): convert the output of get_metrics into (timestamps, values)
+        """
+        assert(len(metric_names) > 0 and chunk_size > 0 and nb_chunks >= 2 and drain_interval > 0)
+        self._pm_sampling : Any = pm_sampling
+        self._metric_names : List[str] = list(metric_names)
+        self._drain_interval : float = drain_interval
+        self._decode : Callable[[Any, List[str]], Tuple[np.ndarray, np.ndarray]] = decode
+
+        # ring of chunks: the one being filled, completed ones, and free ones
+        self._free_chunks : List[GWPmSampleChunk] = [ GWPmSampleChunk(chunk_size, self._metric_names) for _ in range(nb_chunks) ]
+        self._filling_chunk : GWPmSampleChunk = self._free_chunks.pop()
+        self._ready_chunks : Deque[GWPmSampleChunk] = deque()
+        self._condition : threading.Condition = threading.Condition()
+
+        self.nb_samples : int = 0
+        self.nb_dropped_samples : int = 0
+
+        self._drain_thread : Optional[threading.Thread] = None
+        self._stop_event : threading.Event = threading.Event()
+        self._stopped : bool = True
+
+
+    def start(self):
+        """
+        Start sampling and the drain thread
+        """
+        if self._drain_thread is not None:
+            return
+        self._stopped = False
+        self._stop_event.clear()
+        self._pm_sampling.start_profiling()
+        self._drain_thread = threading.Thread(target=self.__drain_loop, name="gw-pm-drain", daemon=True)
+        self._drain_thread.start()
+
+
+    def stop(self):
+        """
+        Stop sampling, samples remaining in the sampling buffer are drained and the
+        partially filled chunk is handed over to the consumer
+        """
+        if self._drain_thread is None:
+            return
+        self._stop_event.set()
+        self._drain_thread.join()
+        self._drain_thread = None
+        self._pm_sampling.stop_profiling()
+        self.drain()
+        with self._condition:
+            if self._filling_chunk.nb_samples > 0:
+                self.__complete_filling_chunk()
+            self._stopped = True
+            self._condition.notify_all()
+
+
+    def __enter__(self) -> 'GWPmSamplingStream':
+        self.start()
+        return self
+
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+    def __drain_loop(self):
+        while not self._stop_event.wait(self._drain_interval):
+            self.drain()
+
+
+    def drain(self):
+        """
+        Move decoded samples from the sampling buffer into the chunks
+        """
+        timestamps, values = self._decode(self._pm_sampling.get_metrics(), self._metric_names)
+        nb_new_samples = timestamps.shape[0]
+        offset = 0
+        with self._condition:
+            while offset < nb_new_samples:
+                chunk = self._filling_chunk
+                nb_copied = min(chunk.capacity - chunk.nb_samples, nb_new_samples - offset)
+                chunk._timestamps[chunk.nb_samples : chunk.nb_samples + nb_copied] = timestamps[offset : offset + nb_copied]
+                chunk._values[chunk.nb_samples : chunk.nb_samples + nb_copied] = values[offset : offset + nb_copied]
+                chunk.nb_samples += nb_copied
+                offset += nb_copied
+                if chunk.nb_samples == chunk.capacity:
+                    self.__complete_filling_chunk()
+            self.nb_samples += nb_new_samples
+
+
+    def __complete_filling_chunk(self):
+        # called with the condition held
+        self._ready_chunks.append(self._filling_chunk)
+        if len(self._free_chunks) > 0:
+            self._filling_chunk = self._free_chunks.pop()
+        else:
+            # consumer falls behind, overwrite the oldest completed chunk
+            self._filling_chunk = self._ready_chunks.popleft()
+            self.nb_dropped_samples += self._filling_chunk.nb_samples
+        self._filling_chunk.nb_samples = 0
+        self._condition.notify_all()
+
+
+    def get_chunk(self, timeout : Optional[float] = None) -> Optional[GWPmSampleChunk]:
+        """
+        Obtain the oldest completed chunk, returns None on timeout or once stopped and
+        fully consumed; the chunk must be handed back by release_chunk after used
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._ready_chunks) > 0 or self._stopped, timeout)
+            if len(self._ready_chunks) == 0:
+                return None
+            return self._ready_chunks.popleft()
+
+
+    def release_chunk(self, chunk : GWPmSampleChunk):
+        with self._condition:
+            chunk.nb_samples = 0
+            self._free_chunks.append(chunk)
+
+
+    def __iter__(self) -> Iterator[GWPmSampleChunk]:
+        """
+        Iterate completed chunks until the stream is stopped and fully consumed, each chunk
+        is only valid until the next iteration
+        """
+        while True:
+            chunk = self.get_chunk()
+            if chunk is None:
+                return
+            try:
+                yield chunk
+            finally:
+                self.release_chunk(chunk)
+
+
+__all__ = [ "GWPmSampleChunk", "GWPmSamplingStream" ]
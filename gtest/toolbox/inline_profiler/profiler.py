@@ -1,7 +1,12 @@
+import threading
 import numpy as np
-from typing import Literal, Dict, List
+from typing import Any, Literal, Dict, List, Optional, Tuple
 
 import gtest.libgtest_toolbox as _C_toolbox
+from gtest.common.stats import GWStreamingStats, streaming_stats_to_numpy
+from gtest.common.event_timer import *
+from gtest.toolbox.inline_profiler.pm_stream import *
+from gtest.toolbox.inline_profiler.derived_metrics import *
 
 
 GW_CUPTI_REPLAY_MODE_AUTO = 0
@@ -11,9 +16,17 @@ GW_CUPTI_RANGE_MODE_USER = 1
 
 
 class GWProfiler:
-    def __init__(self, gw_profiler : _C_toolbox.GWProfiler_CUDA, profiler_mode : Literal['range', 'pm']) -> None:
+    def __init__(
+        self,
+        gw_profiler : _C_toolbox.GWProfiler_CUDA,
+        profiler_mode : Literal['range', 'pm'],
+        device_id : int = -1,
+        metric_names : List[str] = []
+    ) -> None:
         self._gw_profiler = gw_profiler
         self._profiler_mode = profiler_mode
+        self.device_id : int = device_id
+        self.metric_names : List[str] = list(metric_names)
         self.range_profile : 'GWProfiler'._range_profile = None
         self.pm_sampling : 'GWProfiler'._pm_sampling = None
 
@@ -40,12 +53,25 @@ class GWProfiler:
             self._gw_profiler = gw_profiler
 
             # range info
-            self._dict_range_latencies : Dict[str, List] = {}   # {range_name, [latency]}
+            self._dict_range_latencies : Dict[str, GWStreamingStats] = {}   # {range_name, latency statistics}
+
+            # event pairs measuring range latencies, resolved lazily (possibly by a poller thread),
+            # the lock guards the statistics; latencies of ranges begun before the last reset are
+            # dropped by their generation
+            self._latency_timer : Optional[GWDeferredEventTimer] = None
+            self._latency_lock : threading.Lock = threading.Lock()
+            self._latency_generation : int = 0
 
             # profile aux info
             self._nb_passes : int = 0
             self._list_ckpt_latencies : List[float] = []
             self._list_restore_latencies : List[float] = []
+            self._replay_strategy : str = "restore"
+
+            # metrics served from the profiling result cache instead of the device, see set_cached_metrics,
+            # and whether the function whose counters are cached is executing (its ranges aren't pushed)
+            self._cached_metrics : Optional[Any] = None
+            self._executing_cached : bool = False
 
 
         def start_session(
@@ -160,35 +186,194 @@ class GWProfiler:
 
         def flush_data(self):
             """
-            Flushes the counter data to image        
+            Flushes the counter data to image, and resolves pending range latencies
             """
+            if self._latency_timer is not None:
+                self._latency_timer.resolve_all()
             self._gw_profiler.RangeProfile_flush_data()
 
 
-        def flush_data(self):
+        def set_profile_aux_info(
+            self,
+            nb_passes : int = 1,
+            ckpt_latencies : List[float] = [],
+            restore_latencies : List[float] = [],
+            replay_strategy : str = "restore"
+        ):
+            self._nb_passes = nb_passes
+            self._list_ckpt_latencies = list(ckpt_latencies)
+            self._list_restore_latencies = list(restore_latencies)
+            self._replay_strategy = replay_strategy
+
+
+        def set_range_latency(self, range_name : str, latency : float, generation : Optional[int] = None):
+            with self._latency_lock:
+                if generation is not None and generation != self._latency_generation:
+                    return
+                stats = self._dict_range_latencies.get(range_name, None)
+                if stats is None:
+                    stats = self._dict_range_latencies[range_name] = GWStreamingStats()
+                stats.add(latency)
+
+
+        def set_latency_timer(self, latency_timer : Optional[GWDeferredEventTimer]):
             """
-            Flushes the counter data to image        
+            Set the timer measuring range latencies, e.g., GWDeferredEventTimer(event_factory=GWFakeEvent)
+            for CPU-only testing; pending latencies of the previous timer are resolved
             """
-            self._gw_profiler.RangeProfile_flush_data()
+            if self._latency_timer is not None:
+                self._latency_timer.stop_poller()
+                self._latency_timer.resolve_all()
+            self._latency_timer = latency_timer
 
 
-        def set_profile_aux_info(self, nb_passes : int = 1, ckpt_latencies : List[float] = [], restore_latencies : List[float] = []):
-            self._nb_passes = nb_passes
-            self._ckpt_latencies = ckpt_latencies
-            self._restore_latencies = restore_latencies
+        def get_latency_timer(self) -> GWDeferredEventTimer:
+            """
+            Returns the timer measuring range latencies, a CUDA-event based one is created if not set
+            """
+            if self._latency_timer is None:
+                self._latency_timer = GWDeferredEventTimer()
+            return self._latency_timer
 
 
-        def set_range_latency(self, range_name : str, latency : float):
-            if range_name not in self._dict_range_latencies.keys():
-                self._dict_range_latencies[range_name] = [latency]
-            else:
-                self._dict_range_latencies[range_name].append(latency)
+        def begin_range_latency(self) -> Tuple[int, Tuple[Any, Any]]:
+            """
+            Record the start event of a range, returns the handle to be passed to end_range_latency,
+            or to cancel_range_latency if the range doesn't complete
+            """
+            return (self._latency_generation, self.get_latency_timer().start())
+
+
+        def end_range_latency(self, range_name : str, handle : Tuple[int, Tuple[Any, Any]]):
+            """
+            Record the end event of a range, the latency is resolved later without synchronizing the stream
+            """
+            generation, event_pair = handle
+            self.get_latency_timer().stop(
+                event_pair, lambda latency: self.set_range_latency(range_name, latency, generation)
+            )
+
+
+        def cancel_range_latency(self, handle : Tuple[int, Tuple[Any, Any]]):
+            """
+            Discard a range begun by begin_range_latency without recording its latency
+            """
+            self.get_latency_timer().cancel(handle[1])
+
+
+        def resolve_range_latencies(self):
+            """
+            Resolve all pending range latencies, blocks until their events complete
+            """
+            if self._latency_timer is not None:
+                self._latency_timer.resolve_all()
+
+
+        def get_range_latency(self, range_name : str) -> Optional[GWStreamingStats]:
+            """
+            Returns the latency statistics (count, mean, std, min, max, quantiles) of the range
+            """
+            self.resolve_range_latencies()
+            with self._latency_lock:
+                stats = self._dict_range_latencies.get(range_name, None)
+                return GWStreamingStats.from_state(stats.to_state()) if stats is not None else None
+
+
+        def export_range_latencies(self) -> np.ndarray:
+            """
+            Export the latency statistics of all ranges as a structured array,
+            with fields name, count, mean, std, min, max, p50, p95, p99
+            """
+            self.resolve_range_latencies()
+            with self._latency_lock:
+                return streaming_stats_to_numpy(self._dict_range_latencies)
+
+
+        def export_range_latency_states(self) -> Dict[str, Dict[str, Any]]:
+            """
+            Export the picklable latency statistics of all ranges, to be gathered from other ranks
+            and combined by merge_range_latency_states
+            """
+            self.resolve_range_latencies()
+            with self._latency_lock:
+                return { range_name: stats.to_state() for range_name, stats in self._dict_range_latencies.items() }
+
+
+        def merge_range_latency_states(self, states : Dict[str, Dict[str, Any]]):
+            """
+            Merge latency statistics exported by export_range_latency_states (e.g., of another rank)
+            """
+            with self._latency_lock:
+                for range_name, state in states.items():
+                    stats = self._dict_range_latencies.get(range_name, None)
+                    if stats is None:
+                        self._dict_range_latencies[range_name] = GWStreamingStats.from_state(state)
+                    else:
+                        stats.merge(GWStreamingStats.from_state(state))
+
+
+        def reset_aux_info(self):
+            self._nb_passes = 0
+
+            # pending latencies belong to the previous measurement, and so do the ranges still open;
+            # the timer lock is never taken with the latency lock held, as callbacks take them the other way round
+            if self._latency_timer is not None:
+                self._latency_timer.discard_pending()
+            with self._latency_lock:
+                self._latency_generation += 1
+                self._dict_range_latencies.clear()
+            self._list_ckpt_latencies.clear()
+            self._list_restore_latencies.clear()
+
+
+        def set_cached_metrics(self, cached_metrics : Optional[Any]):
+            """
+            Serve the next get_metrics from cached counters (the replay was skipped), or from the device if None
+            """
+            self._cached_metrics = cached_metrics
+
+
+        def is_served_from_cache(self) -> bool:
+            """
+            Returns whether the next get_metrics is served from cached counters
+            """
+            return self._cached_metrics is not None
+
+
+        def set_executing_cached(self, executing_cached : bool):
+            self._executing_cached = executing_cached
+
+
+        def is_executing_cached(self) -> bool:
+            return self._executing_cached
 
 
         def get_metrics(self):
+            """
+            Returns the collected metrics; cached counters are only served once, later calls
+            read the device again
+            """
+            if self._cached_metrics is not None:
+                cached_metrics, self._cached_metrics = self._cached_metrics, None
+                return cached_metrics
             return self._gw_profiler.RangeProfile_get_metrics()
 
 
+        def get_derived_metrics(
+            self,
+            engine : GWDerivedMetricEngine,
+            metric_names : Optional[List[str]] = None
+        ) -> Tuple[List[str], Dict[str, np.ndarray]]:
+            """
+            Evaluate derived metrics over all ranges at once, see GWDerivedMetricEngine.evaluate_ranges;
+            the profiler should be created with engine.get_raw_metrics()
+
+            Returns:
+                tuple: range names, {derived metric name, values aligned with range names}
+            """
+            return engine.evaluate_ranges(self.get_metrics(), metric_names)
+
+
     """
     PM Sampling APIs
     """
@@ -225,6 +410,21 @@ class GWProfiler:
             return self._gw_profiler.PmSampling_get_metrics()
 
 
+        def open_stream(
+            self,
+            metric_names : List[str],
+            chunk_size : int = 4096,
+            nb_chunks : int = 2,
+            drain_interval : float = 0.05
+        ) -> GWPmSamplingStream:
+            """
+            Create a stream which continuously drains samples into a ring of preallocated numpy chunks,
+            so that sampling could run for the whole job with a small sampling buffer; start it (or use
+            it as a context manager) instead of start_profiling / stop_profiling
+            """
+            return GWPmSamplingStream(self, metric_names, chunk_size, nb_chunks, drain_interval)
+
+
     """
     Common APIs
     """
@@ -254,11 +454,8 @@ class GWProfiler:
         Reset the counter data
         """
         self._gw_profiler.reset_counter_data()
-
-        self._nb_passes = 0
-        self._dict_range_latencies.clear()
-        self._list_ckpt_latencies.clear()
-        self._list_restore_latencies.clear()
+        if self.range_profile is not None:
+            self.range_profile.reset_aux_info()
 
 
 __all__ = [
@@ -0,0 +1,195 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Dict, List, Literal, Optional
+
+from gtest.toolbox.inline_profiler.context import *
+from gtest.toolbox.inline_profiler.profiler import *
+
+
+class GWProfilerGroup:
+    """
+    Profilers of a set of devices driven together: each call is fanned out to all devices
+    concurrently and returns once every device finishes, results are indexed by device id.
+    Each device is driven by its own worker thread, so that the device context made current
+    by the native side stays on the same thread across calls.
+    """
+
+    def __init__(
+        self,
+        context : GWContext,
+        device_ids : List[int],
+        metric_names : List[str],
+        profiler_mode : Literal['range', 'pm'] = "range"
+    ):
+        """
+        Parameters:
+            context (GWContext): the context to create profilers from
+            device_ids (list[int]): devices to be profiled
+            metric_names (list[str]): metrics to collect on every device
+            profiler_mode (str): mode of all profilers
+        """
+        assert(len(device_ids) > 0 and len(set(device_ids)) == len(device_ids))
+        self._context : GWContext = context
+        self._device_ids : List[int] = list(device_ids)
+        self._executors : Dict[int, ThreadPoolExecutor] = {
+            device_id: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"gw-profiler-{device_id}")
+            for device_id in self._device_ids
+        }
+        self.profilers : Dict[int, GWProfiler] = {}
+
+        # {device_id, whether all passes of the session have been completed on the device}
+        self._pass_completed : Dict[int, bool] = { device_id: False for device_id in self._device_ids }
+
+        futures : Dict[int, Future] = {
+            device_id: self._executors[device_id].submit(context.create_profiler, device_id, metric_names, profiler_mode)
+            for device_id in self._device_ids
+        }
+        first_exception : BaseException = None
+        for device_id, future in futures.items():
+            exception = future.exception()
+            if exception is None:
+                self.profilers[device_id] = future.result()
+            elif first_exception is None:
+                first_exception = exception
+        if first_exception is not None:
+            # don't leak the profilers of devices which succeeded
+            for device_id, profiler in self.profilers.items():
+                self._executors[device_id].submit(context.destory_profiler, profiler).exception()
+            self.profilers = {}
+            for executor in self._executors.values():
+                executor.shutdown(wait=True)
+            raise first_exception
+
+
+    @property
+    def device_ids(self) -> List[int]:
+        return self._device_ids
+
+
+    def run(
+        self,
+        func : Callable[[int, GWProfiler], Any],
+        with_profiler : bool = True,
+        device_ids : Optional[List[int]] = None
+    ) -> Dict[int, Any]:
+        """
+        Call func(device_id, profiler) on every device (or the given ones) concurrently
+
+        Returns:
+            dict: {device_id, return value of func}; if any device raises, the first exception
+                  is re-raised after all devices finish
+        """
+        futures : Dict[int, Future] = {
+            device_id: self._executors[device_id].submit(
+                func, device_id, self.profilers[device_id] if with_profiler else None
+            )
+            for device_id in (device_ids if device_ids is not None else self._device_ids)
+        }
+        results : Dict[int, Any] = {}
+        first_exception : BaseException = None
+        for device_id, future in futures.items():
+            exception = future.exception()
+            if exception is not None:
+                if first_exception is None:
+                    first_exception = exception
+                continue
+            results[device_id] = future.result()
+        if first_exception is not None:
+            raise first_exception
+        return results
+
+
+    def start_session(self, **kwargs):
+        """
+        Start a range profiling session on every device, see GWProfiler._range_profile.start_session
+        """
+        self.run(lambda _, profiler: profiler.range_profile.start_session(**kwargs))
+        self._pass_completed = { device_id: False for device_id in self._device_ids }
+
+
+    def destory_session(self):
+        self.run(lambda _, profiler: profiler.range_profile.destory_session())
+
+
+    @property
+    def pending_device_ids(self) -> List[int]:
+        """
+        Devices which still need passes in the current session
+        """
+        return [ device_id for device_id in self._device_ids if not self._pass_completed[device_id] ]
+
+
+    def begin_pass(self):
+        """
+        Begins a new pass on every device which still needs passes, devices may need different numbers of passes
+        """
+        self.run(lambda _, profiler: profiler.range_profile.begin_pass(), device_ids=self.pending_device_ids)
+
+
+    def end_pass(self) -> bool:
+        """
+        Ends the current pass on every device which still needs passes, returns True if all passes
+        have been completed on all devices
+        """
+        completed = self.run(lambda _, profiler: profiler.range_profile.end_pass(), device_ids=self.pending_device_ids)
+        for device_id, pass_completed in completed.items():
+            self._pass_completed[device_id] = bool(pass_completed)
+        return len(self.pending_device_ids) == 0
+
+
+    def enable_profiling(self):
+        self.run(lambda _, profiler: profiler.range_profile.enable_profiling(), device_ids=self.pending_device_ids)
+
+
+    def disable_profiling(self):
+        self.run(lambda _, profiler: profiler.range_profile.disable_profiling(), device_ids=self.pending_device_ids)
+
+
+    def flush_data(self):
+        self.run(lambda _, profiler: profiler.range_profile.flush_data())
+
+
+    def get_metrics(self) -> Dict[int, Any]:
+        """
+        Returns {device_id, metrics of the device}
+        """
+        return self.run(lambda _, profiler: profiler.range_profile.get_metrics())
+
+
+    def get_metrics_table(self) -> List[Dict[str, Any]]:
+        """
+        Merge metrics of all devices into one table, one row per (device, range); metrics given
+        as {range_name: {metric_name: value}} yield one row per range, flat {metric_name: value}
+        yield one row per device
+        """
+        rows : List[Dict[str, Any]] = []
+        for device_id, metrics in self.get_metrics().items():
+            if isinstance(metrics, dict) and len(metrics) > 0 and all(isinstance(v, dict) for v in metrics.values()):
+                for range_name, range_metrics in metrics.items():
+                    rows.append({ "device": device_id, "range": range_name, **range_metrics })
+            elif isinstance(metrics, dict):
+                rows.append({ "device": device_id, **metrics })
+            else:
+                rows.append({ "device": device_id, "metrics": metrics })
+        return rows
+
+
+    def close(self):
+        """
+        Destroy the profilers and stop the worker threads
+        """
+        if len(self.profilers) > 0:
+            self.run(lambda _, profiler: self._context.destory_profiler(profiler))
+            self.profilers = {}
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+
+
+    def __enter__(self) -> 'GWProfilerGroup':
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+__all__ = [ "GWProfilerGroup" ]
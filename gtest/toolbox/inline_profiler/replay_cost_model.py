@@ -0,0 +1,105 @@
+import math
+from typing import Dict, Literal, Optional
+
+
+GW_REPLAY_STRATEGY_RESTORE = "restore"
+GW_REPLAY_STRATEGY_RERUN = "rerun"
+
+
+class GWReplayCostModel:
+    """
+    Learn the cost of replaying a profiled function across passes, and pick the cheaper strategy:
+        restore: checkpoint device memory before the first pass, restore it before each further pass
+        rerun: re-execute directly (after an optional reset), only valid for idempotent functions
+
+    Costs are kept as exponential moving averages of the measured latencies (in seconds).
+    """
+
+    def __init__(self, smoothing : float = 0.2):
+        assert(0 < smoothing <= 1)
+        self._smoothing : float = smoothing
+
+        # {cost name, moving average}, names are checkpoint, restore, free, reset, execution and passes
+        self._costs : Dict[str, float] = {}
+
+
+    def observe(self, name : str, value : float):
+        previous = self._costs.get(name, None)
+        if previous is None:
+            self._costs[name] = value
+        else:
+            self._costs[name] = previous + self._smoothing * (value - previous)
+
+
+    def get_cost(self, name : str) -> Optional[float]:
+        return self._costs.get(name, None)
+
+
+    def predict_num_passes(self) -> int:
+        nb_passes = self._costs.get("passes", None)
+        return max(1, math.ceil(nb_passes - 1e-6)) if nb_passes is not None else 1
+
+
+    def predict_cost(
+        self,
+        strategy : Literal['restore', 'rerun'],
+        nb_passes : Optional[int] = None
+    ) -> Optional[float]:
+        """
+        Predict the replay overhead (on top of executing the function once per pass) of the strategy,
+        returns None if its costs haven't been measured yet
+        """
+        nb_passes = nb_passes if nb_passes is not None else self.predict_num_passes()
+        nb_replays = nb_passes - 1
+        if strategy == GW_REPLAY_STRATEGY_RESTORE:
+            checkpoint, restore = self._costs.get("checkpoint", None), self._costs.get("restore", None)
+            if checkpoint is None or (restore is None and nb_replays > 0):
+                return None
+            return checkpoint + self._costs.get("free", 0.0) + nb_replays * (restore if restore is not None else 0.0)
+        elif strategy == GW_REPLAY_STRATEGY_RERUN:
+            # without a reset function, its cost is measured as zero
+            reset = self._costs.get("reset", None)
+            if reset is None and nb_replays > 0:
+                return None
+            return nb_replays * (reset if reset is not None else 0.0)
+        raise ValueError(f"unknown replay strategy {strategy}")
+
+
+    def predict_total_cost(
+        self,
+        strategy : Literal['restore', 'rerun'],
+        nb_passes : Optional[int] = None
+    ) -> Optional[float]:
+        """
+        Predict the total cost of profiling with the strategy, including executing the function in each pass
+        """
+        nb_passes = nb_passes if nb_passes is not None else self.predict_num_passes()
+        overhead = self.predict_cost(strategy, nb_passes)
+        execution = self._costs.get("execution", None)
+        if overhead is None or execution is None:
+            return None
+        return overhead + nb_passes * execution
+
+
+    def choose(self, idempotent : bool) -> str:
+        """
+        Pick the strategy with lower predicted cost, a strategy whose cost is unknown is tried
+        first so that both get measured
+        """
+        if not idempotent:
+            return GW_REPLAY_STRATEGY_RESTORE
+        restore_cost = self.predict_cost(GW_REPLAY_STRATEGY_RESTORE)
+        rerun_cost = self.predict_cost(GW_REPLAY_STRATEGY_RERUN)
+        if rerun_cost is None:
+            return GW_REPLAY_STRATEGY_RERUN
+        if restore_cost is None:
+            # only worth measuring if a replay could cost more than a checkpoint could save
+            return GW_REPLAY_STRATEGY_RERUN if rerun_cost == 0 else GW_REPLAY_STRATEGY_RESTORE
+        return GW_REPLAY_STRATEGY_RERUN if rerun_cost <= restore_cost else GW_REPLAY_STRATEGY_RESTORE
+
+
+__all__ = [
+    "GWReplayCostModel",
+    "GW_REPLAY_STRATEGY_RESTORE",
+    "GW_REPLAY_STRATEGY_RERUN"
+]
@@ -0,0 +1,282 @@
+import os
+import json
+import atexit
+import time
+import weakref
+import hashlib
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+
+def _to_builtin(value : Any) -> Any:
+    """
+    Convert counters returned by the native side (numpy scalars / arrays, bound maps and
+    vectors) into plain python values, so that they can be averaged and serialized
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, Mapping) or hasattr(value, "items"):
+        return { str(k): _to_builtin(v) for k, v in value.items() }
+    if isinstance(value, (list, tuple)) or hasattr(value, "__iter__"):
+        return [ _to_builtin(v) for v in value ]
+    return float(value)
+
+
+# caches whose index is persisted at exit, registered once instead of per cache
+_open_caches : 'weakref.WeakSet[GWProfileResultCache]' = weakref.WeakSet()
+
+
+def _flush_open_caches():
+    for cache in list(_open_caches):
+        try:
+            cache.flush()
+        except OSError as e:
+            logger.warning(f"failed to persist profiling result cache {cache._dir_path}: {e}")
+
+atexit.register(_flush_open_caches)
+
+
+def _accumulate_mean(mean : Any, sample : Any, count : int) -> Any:
+    """
+    Fold a new sample into the running mean of the previous count samples, numbers are
+    averaged and nested dicts / lists are averaged element-wise, other values are kept as latest
+    """
+    if isinstance(sample, bool) or mean is None:
+        return sample
+    if isinstance(sample, (int, float)) and isinstance(mean, (int, float)):
+        return mean + (sample - mean) / (count + 1)
+    if isinstance(sample, dict) and isinstance(mean, dict):
+        return { k: _accumulate_mean(mean.get(k, None), v, count) for k, v in sample.items() }
+    if isinstance(sample, (list, tuple)) and isinstance(mean, (list, tuple)) and len(sample) == len(mean):
+        return [ _accumulate_mean(m, v, count) for m, v in zip(mean, sample) ]
+    return sample
+
+
+class GWProfileResultCache:
+    """
+    Persistent cache of profiling results keyed by (device, kernel signature, launch config, metric set).
+    Each signature is measured until it reaches its sample budget, afterwards the averaged counters are
+    served without replay. Entries expire after max_age seconds or when the version (e.g., driver / CUDA
+    version) changes, and the least recently used ones are evicted beyond max_entries / max_bytes.
+
+    On disk, index.json keeps the bookkeeping of all entries and <key>.json keeps the counters of each entry.
+    """
+
+    INDEX_FILE_NAME = "index.json"
+
+    def __init__(
+        self,
+        dir_path : str,
+        sample_budget : int = 3,
+        max_entries : int = 65536,
+        max_bytes : int = 256 * 1024 * 1024,
+        max_age : Optional[float] = None,
+        version : str = ""
+    ):
+        """
+        Parameters:
+            dir_path (str): directory of the cache
+            sample_budget (int): number of measurements of a signature before serving it from the cache
+            max_entries (int): maximum number of cached signatures
+            max_bytes (int): maximum total size of the cached counters on disk
+            max_age (float): seconds after which a cached entry is re-measured, default to be never
+            version (str): entries recorded under a different version are dropped
+        """
+        assert(sample_budget > 0 and max_entries > 0 and max_bytes > 0)
+        self._dir_path : str = dir_path
+        self._sample_budget : int = sample_budget
+        self._max_entries : int = max_entries
+        self._max_bytes : int = max_bytes
+        self._max_age : Optional[float] = max_age
+        self._version : str = version
+
+        # {key, bookkeeping of the entry}, in LRU order (most recent last)
+        self._entries : OrderedDict = OrderedDict()
+        self._nb_bytes : int = 0
+
+        # counters of loaded entries, {key, averaged counters}
+        self._counters : Dict[str, Any] = {}
+
+        self.nb_hits : int = 0
+        self.nb_misses : int = 0
+
+        self._lock : threading.RLock = threading.RLock()
+
+        os.makedirs(dir_path, exist_ok=True)
+        self.__load_index()
+
+        # make sure the index is persisted even if flush / close is never called
+        _open_caches.add(self)
+
+
+    @staticmethod
+    def make_key(device : Any, kernel_signature : Any, launch_config : Any, metric_names : List[str]) -> str:
+        """
+        Make the cache key of a kernel, all parts must be json-serializable
+        """
+        canonical = json.dumps(
+            [ device, kernel_signature, launch_config, sorted(metric_names) ],
+            sort_keys=True, separators=(",", ":"), default=str
+        )
+        return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+    def __entry_path(self, key : str) -> str:
+        return os.path.join(self._dir_path, f"{key}.json")
+
+
+    def __load_index(self):
+        index_path = os.path.join(self._dir_path, self.INDEX_FILE_NAME)
+        if not os.path.exists(index_path):
+            return
+        try:
+            with open(index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"failed to load profiling result cache index {index_path}, start empty: {e}")
+            return
+        if index.get("version", "") != self._version:
+            for key in index.get("entries", {}).keys():
+                self.__remove_entry_file(key)
+            return
+        entries = sorted(index.get("entries", {}).items(), key=lambda item: item[1]["last_access"])
+        for key, entry in entries:
+            self._entries[key] = entry
+            self._nb_bytes += entry["nbytes"]
+
+
+    def __remove_entry_file(self, key : str):
+        try:
+            os.remove(self.__entry_path(key))
+        except OSError:
+            pass
+
+
+    def __drop(self, key : str):
+        entry = self._entries.pop(key)
+        self._nb_bytes -= entry["nbytes"]
+        self._counters.pop(key, None)
+        self.__remove_entry_file(key)
+
+
+    def __is_stale(self, entry : Dict[str, Any]) -> bool:
+        return self._max_age is not None and time.time() - entry["created"] > self._max_age
+
+
+    def needs_profiling(self, key : str) -> bool:
+        """
+        Whether the signature still needs to be measured (unknown, stale or within its sample budget)
+        """
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return True
+            if self.__is_stale(entry):
+                self.__drop(key)
+                return True
+            return entry["nb_samples"] < self._sample_budget
+
+
+    def lookup(self, key : str) -> Optional[Any]:
+        """
+        Returns the averaged counters of the signature if its sample budget is reached, otherwise None
+        """
+        with self._lock:
+            if self.needs_profiling(key):
+                self.nb_misses += 1
+                return None
+            counters = self._counters.get(key, None)
+            if counters is None:
+                try:
+                    with open(self.__entry_path(key), "r") as f:
+                        counters = self._counters[key] = json.load(f)
+                except (OSError, ValueError):
+                    self.__drop(key)
+                    self.nb_misses += 1
+                    return None
+            entry = self._entries[key]
+            entry["last_access"] = time.time()
+            self._entries.move_to_end(key)
+            self.nb_hits += 1
+            return counters
+
+
+    def add_sample(self, key : str, counters : Any):
+        """
+        Record a measurement of the signature, counters are converted into plain python values
+        """
+        counters = _to_builtin(counters)
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and self.__is_stale(entry):
+                self.__drop(key)
+                entry = None
+            now = time.time()
+            if entry is None:
+                entry = self._entries[key] = { "created": now, "last_access": now, "nb_samples": 0, "nbytes": 0 }
+                previous = None
+            else:
+                previous = self._counters.get(key, None)
+                if previous is None and os.path.exists(self.__entry_path(key)):
+                    with open(self.__entry_path(key), "r") as f:
+                        previous = json.load(f)
+
+            counters = _accumulate_mean(previous, counters, entry["nb_samples"])
+            serialized = json.dumps(counters)
+            tmp_path = self.__entry_path(key) + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(serialized)
+            os.replace(tmp_path, self.__entry_path(key))
+
+            self._counters[key] = counters
+            self._nb_bytes += len(serialized) - entry["nbytes"]
+            entry["nbytes"] = len(serialized)
+            entry["nb_samples"] += 1
+            entry["last_access"] = now
+            self._entries.move_to_end(key)
+
+            # evict least recently used entries
+            while len(self._entries) > self._max_entries or self._nb_bytes > self._max_bytes:
+                self.__drop(next(iter(self._entries)))
+
+
+    def flush(self):
+        """
+        Persist the index of the cache
+        """
+        with self._lock:
+            index_path = os.path.join(self._dir_path, self.INDEX_FILE_NAME)
+            with open(index_path + ".tmp", "w") as f:
+                json.dump({ "version": self._version, "entries": self._entries }, f)
+            os.replace(index_path + ".tmp", index_path)
+
+
+    def close(self):
+        """
+        Persist the index, the cache is no longer flushed at exit
+        """
+        self.flush()
+        _open_caches.discard(self)
+
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries.keys()):
+                self.__drop(key)
+            self.flush()
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+__all__ = [ "GWProfileResultCache" ]
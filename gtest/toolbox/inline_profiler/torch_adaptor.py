@@ -1,21 +1,78 @@
 import torch
 import time
 import inspect
-from typing import Callable, List, Any
+from typing import Callable, List, Any, Literal, Optional
 from contextlib import contextmanager
 
 from gtest.toolbox.inline_profiler.profiler import *
+from gtest.toolbox.inline_profiler.replay_cost_model import *
+from gtest.toolbox.inline_profiler.result_cache import *
+
+
+def _default_kernel_signature(func : Callable, args : tuple, kwargs : dict) -> Any:
+    """
+    Signature of a profiled function: its qualified name and the shapes / dtypes / devices
+    of tensor arguments (other arguments by their type)
+    """
+    def _signature(elem):
+        if isinstance(elem, torch.Tensor):
+            return [ list(elem.shape), str(elem.dtype), str(elem.device) ]
+        elif isinstance(elem, (list, tuple)):
+            return [ _signature(e) for e in elem ]
+        elif isinstance(elem, dict):
+            return { str(k): _signature(v) for k, v in elem.items() }
+        elif isinstance(elem, (int, float, bool, str)) or elem is None:
+            return elem
+        return type(elem).__name__
+    return [ func.__qualname__, _signature(args), _signature(kwargs) ]
+
+
+def _device_signature(device_id : int) -> Any:
+    """
+    Identify a device by its GPU model rather than its index, so that cached counters are
+    shared by identical GPUs and never served to a different model at the same index
+    """
+    if device_id < 0 or not torch.cuda.is_available():
+        return device_id
+    properties = torch.cuda.get_device_properties(device_id)
+    return [ properties.name, properties.major, properties.minor, properties.multi_processor_count ]
 
 class torch_adapt:
     @staticmethod
-    def profile(gw_profiler : GWProfiler = None, allow_multipass : bool = False):
+    def profile(
+        gw_profiler : GWProfiler = None,
+        allow_multipass : bool = False,
+        replay_strategy : Literal['auto', 'restore', 'rerun'] = 'auto',
+        idempotent : bool = False,
+        reset_fn : Optional[Callable] = None,
+        result_cache : Optional[GWProfileResultCache] = None,
+        signature_fn : Optional[Callable] = None,
+        launch_config_fn : Optional[Callable] = None
+    ):
         """
         [Decorator] Declare a computation graph to be profiled
 
         Parameters:
             gw_profiler: the GWProfiler instance to conduct profiling on the device
+            allow_multipass: whether to replay the computation graph when multiple passes are needed
+            replay_strategy: how to replay between passes, either checkpoint / restore device memory ('restore'),
+                             re-execute directly ('rerun', requires idempotent), or pick the cheaper one as
+                             learnt from measured costs ('auto')
+            idempotent: whether re-executing the computation graph (after reset_fn) yields the same state
+            reset_fn: called with the same arguments before each re-execution under the 'rerun' strategy
+            result_cache: if given, serve counters of already measured signatures from the cache without replay
+            signature_fn: called with the same arguments to obtain the kernel signature for result_cache,
+                          default to be the function name and the shapes / dtypes of tensor arguments
+            launch_config_fn: called with the same arguments to obtain the launch config for result_cache
         """
+        assert(replay_strategy in ('auto', GW_REPLAY_STRATEGY_RESTORE, GW_REPLAY_STRATEGY_RERUN))
+        if replay_strategy == GW_REPLAY_STRATEGY_RERUN and not idempotent:
+            raise ValueError("rerun replay strategy requires the function to be declared idempotent")
+
         def decorator_wrapper(func : Callable):
+            # costs are learnt per decorated function
+            cost_model = GWReplayCostModel()
+
             def wrapper(*args, **kwargs):
                 first_pass : bool = True
                 last_pass : bool = False
@@ -37,22 +94,56 @@ class torch_adapt:
                 if gw_profiler_instance != None and gw_profiler_instance.range_profile.is_session_created():
                     assert(gw_profiler_instance.is_range_profiling())
 
-                    if allow_multipass:
-                        ckpt_start = time.time()
+                    # serve already measured signatures from the cache
+                    cache_key = None
+                    gw_profiler_instance.range_profile.set_cached_metrics(None)
+                    if result_cache is not None:
+                        cache_key = GWProfileResultCache.make_key(
+                            _device_signature(gw_profiler_instance.device_id),
+                            signature_fn(*args, **kwargs) if signature_fn is not None else _default_kernel_signature(func, args, kwargs),
+                            launch_config_fn(*args, **kwargs) if launch_config_fn is not None else None,
+                            gw_profiler_instance.metric_names
+                        )
+                        cached_metrics = result_cache.lookup(cache_key)
+                        if cached_metrics is not None:
+                            # ranges declared within aren't pushed, nothing is collected on the device
+                            gw_profiler_instance.range_profile.set_cached_metrics(cached_metrics)
+                            gw_profiler_instance.range_profile.set_executing_cached(True)
+                            try:
+                                return func(*args, **kwargs)
+                            finally:
+                                gw_profiler_instance.range_profile.set_executing_cached(False)
+
+                    strategy = replay_strategy
+                    if strategy == 'auto':
+                        strategy = cost_model.choose(idempotent)
+                    do_restore = allow_multipass and strategy == GW_REPLAY_STRATEGY_RESTORE
+
+                    if do_restore:
+                        ckpt_start = time.perf_counter()
                         gw_profiler_instance.checkpoint()
-                        ckpt_latencies.append(time.time() - ckpt_start)
+                        ckpt_latencies.append(time.perf_counter() - ckpt_start)
+                        cost_model.observe("checkpoint", ckpt_latencies[-1])
                     while not last_pass:
                         # we use first_pass to avoid unnecessary
-                        # memory restore at the first pass
-                        if not first_pass and allow_multipass:
-                            restore_start = time.time()
+                        # memory restore / reset at the first pass
+                        if not first_pass and do_restore:
+                            restore_start = time.perf_counter()
                             gw_profiler_instance.restore()
-                            restore_latencies.append(time.time() - restore_start)
+                            restore_latencies.append(time.perf_counter() - restore_start)
+                            cost_model.observe("restore", restore_latencies[-1])
+                        elif not first_pass and allow_multipass:
+                            reset_start = time.perf_counter()
+                            if reset_fn is not None:
+                                reset_fn(*args, **kwargs)
+                            cost_model.observe("reset", time.perf_counter() - reset_start)
                         else:
                             first_pass = False
                         gw_profiler_instance.range_profile.begin_pass()
                         gw_profiler_instance.range_profile.enable_profiling()
+                        execution_start = time.perf_counter()
                         ret = func(*args, **kwargs)
+                        cost_model.observe("execution", time.perf_counter() - execution_start)
                         gw_profiler_instance.range_profile.disable_profiling()
                         last_pass = gw_profiler_instance.range_profile.end_pass()
                         nb_pass += 1
@@ -60,14 +151,23 @@ class torch_adapt:
                             if not last_pass:
                                 print(f"warn: multipass profiling when multipass is not allowed")
                             break
-                    if allow_multipass:
+                    if do_restore:
+                        free_start = time.perf_counter()
                         gw_profiler_instance.free_checkpoint()
+                        cost_model.observe("free", time.perf_counter() - free_start)
+                    cost_model.observe("passes", nb_pass)
                     gw_profiler_instance.range_profile.flush_data()
-                    gw_profiler_instance.range_profile.set_profile_aux_info(nb_passes=nb_pass, ckpt_latencies=ckpt_latencies, restore_latencies=restore_latencies)
+                    gw_profiler_instance.range_profile.set_profile_aux_info(
+                        nb_passes=nb_pass, ckpt_latencies=ckpt_latencies, restore_latencies=restore_latencies,
+                        replay_strategy=strategy
+                    )
+                    if cache_key is not None:
+                        result_cache.add_sample(cache_key, gw_profiler_instance.range_profile.get_metrics())
                 else:
                     ret = func(*args, **kwargs)
                 return ret
 
+            wrapper.gw_replay_cost_model = cost_model
             return wrapper
         
         return decorator_wrapper
@@ -85,37 +185,36 @@ class torch_adapt:
         # step 1: check GWContext profiler and range_name
         if hasattr(class_instance, 'gw_profiler'):
             gw_profiler_instance = getattr(class_instance, 'gw_profiler')
-        if not gw_profiler_instance or range_name == "" or not gw_profiler_instance.range_profile.is_session_created():
+        if (
+            not gw_profiler_instance or range_name == ""
+            or not gw_profiler_instance.range_profile.is_session_created()
+            or gw_profiler_instance.range_profile.is_executing_cached()
+        ):
             yield
             return
 
         assert(gw_profiler_instance.is_range_profiling())
 
-        try:
-            # NOTE(zhuobin):
-            # we don't support warmup here,
-            # since we can't yield multiple times
-
-            # create cuda event if measuring latency
-            if do_measure_latency:
-                start_event = torch.cuda.Event(enable_timing=True)
-                end_event = torch.cuda.Event(enable_timing=True)
+        # NOTE(zhuobin):
+        # we don't support warmup here,
+        # since we can't yield multiple times
 
-            # step 2: execute and profile
-            gw_profiler_instance.range_profile.push_range(range_name)
+        # step 2: execute and profile, latency is resolved lazily
+        # (at flush_data) to avoid synchronizing the stream after each range
+        gw_profiler_instance.range_profile.push_range(range_name)
+        latency_handle = None
+        try:
             if do_measure_latency:
-                start_event.record()
+                latency_handle = gw_profiler_instance.range_profile.begin_range_latency()
             yield
-            if do_measure_latency:
-                end_event.record()
-            gw_profiler_instance.range_profile.pop_range()
-            if do_measure_latency:
-                end_event.synchronize()
-                total_time = start_event.elapsed_time(end_event)
-                gw_profiler_instance.range_profile.set_range_latency(range_name, total_time)
-
+            if latency_handle is not None:
+                gw_profiler_instance.range_profile.end_range_latency(range_name, latency_handle)
+                latency_handle = None
         finally:
-            pass
+            # the range raised, its partial latency is not recorded
+            if latency_handle is not None:
+                gw_profiler_instance.range_profile.cancel_range_latency(latency_handle)
+            gw_profiler_instance.range_profile.pop_range()
 
 
     @staticmethod
@@ -163,45 +262,42 @@ class torch_adapt:
                 # check whether to execute profiling
                 do_insert_range : bool = (
                     gw_profiler_instance != None and current_range_name != "" and gw_profiler_instance.range_profile.is_session_created()
+                    and not gw_profiler_instance.range_profile.is_executing_cached()
                 )
 
                 # check the mode of the profiler
                 if do_insert_range:
                     assert(gw_profiler_instance.is_range_profiling())
 
-                # create cuda event if measuring latency
-                if do_insert_range and do_measure_latency:
-                    start_event = torch.cuda.Event(enable_timing=True)
-                    end_event = torch.cuda.Event(enable_timing=True)
-
                 # step 3: warm-up
                 if do_insert_range and do_warpup:
                     gw_profiler_instance.checkpoint()
                     func(*i_args, **i_kwargs)
                     gw_profiler_instance.restore(do_pop=True)
 
-                # step 4: pre-execute
-                if do_insert_range:
-                    # push range
-                    gw_profiler_instance.range_profile.push_range(current_range_name)
-                    if do_measure_latency:
-                        start_event.record()
-
-                # step 5: execute
-                list_func_ret = func(*i_args, **i_kwargs)
+                if not do_insert_range:
+                    return func(*i_args, **i_kwargs)
 
-                # step 6: post-execute
-                if do_insert_range:
+                # step 4: pre-execute
+                gw_profiler_instance.range_profile.push_range(current_range_name)
+                latency_handle = None
+                try:
                     if do_measure_latency:
-                        end_event.record()
-
+                        latency_handle = gw_profiler_instance.range_profile.begin_range_latency()
+
+                    # step 5: execute
+                    list_func_ret = func(*i_args, **i_kwargs)
+
+                    # step 6: post-execute, latency is resolved lazily (at flush_data) to avoid synchronizing the stream
+                    if latency_handle is not None:
+                        gw_profiler_instance.range_profile.end_range_latency(current_range_name, latency_handle)
+                        latency_handle = None
+                finally:
+                    # the function raised, its partial latency is not recorded
+                    if latency_handle is not None:
+                        gw_profiler_instance.range_profile.cancel_range_latency(latency_handle)
                     gw_profiler_instance.range_profile.pop_range()
 
-                    if do_measure_latency:
-                        end_event.synchronize()
-                        total_time = start_event.elapsed_time(end_event)
-                        gw_profiler_instance.range_profile.set_range_latency(current_range_name, total_time)
-
                 return list_func_ret
 
             return wrapper
@@ -0,0 +1,115 @@
+import os
+import sys
+import types
+import timeit
+import inspect
+import argparse
+import hashlib
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument(
+    '-n', '--number',
+    type=int,
+    default=100000,
+    help='number of metric open/close per measurement',
+    required=False
+)
+
+parser.add_argument(
+    '-r', '--repeat',
+    type=int,
+    default=5,
+    help='number of measurements, the best one is reported',
+    required=False
+)
+
+
+# native backend calls are replaced by no-ops, so that only the python-side cost is measured
+_noop = lambda *args, **kwargs: None
+_noop_capsule = types.ModuleType("gtest.libgtest_capsule")
+_noop_capsule.start_app_metric_trace_capture = _noop
+_noop_capsule.stop_app_metric_trace_capture = _noop
+_noop_capsule.report_event_trace_and_wait_instruction = _noop
+
+
+def _import_metric() -> types.ModuleType:
+    """
+    Import gtest.capsule.metric; on hosts without the native libraries (e.g., without GPU), the gtest
+    packages are bound to their directories without running their __init__ (which loads the libraries),
+    and the capsule library is the no-op stand-in
+    """
+    try:
+        import gtest.capsule.metric as metric
+        return metric
+    except (ImportError, RuntimeError):
+        pass
+    gtest_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for name in [ name for name in sys.modules if name == "gtest" or name.startswith("gtest.") ]:
+        del sys.modules[name]
+    for name, path in (("gtest", gtest_dir), ("gtest.capsule", os.path.join(gtest_dir, "capsule"))):
+        package = types.ModuleType(name)
+        package.__path__ = [ path ]
+        sys.modules[name] = package
+    sys.modules["gtest.libgtest_capsule"] = _noop_capsule
+    import gtest.capsule.metric as metric
+    return metric
+
+
+# run as a script (python gtest/utils/bench_app_metric.py), gtest has to be importable from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+metric = _import_metric()
+GWAppMetric, GWAppMetricSite = metric.GWAppMetric, metric.GWAppMetricSite
+
+
+class _LegacyAppMetric:
+    """
+    per-call site resolution as GWAppMetric used to do: walk frame, format position, sha256
+    """
+    def __init__(self, name : str):
+        frame = inspect.currentframe().f_back
+        position = f"{frame.f_code.co_filename}:{frame.f_lineno}"
+        self._begin_hash = int.from_bytes(hashlib.sha256(position.encode()).digest()[:8], byteorder='big')
+
+    def eclipse(self):
+        frame = inspect.currentframe().f_back
+        position = f"{frame.f_code.co_filename}:{frame.f_lineno}"
+        self._end_hash = int.from_bytes(hashlib.sha256(position.encode()).digest()[:8], byteorder='big')
+
+
+def _bench_legacy():
+    m = _LegacyAppMetric("bench")
+    m.eclipse()
+
+
+def _bench_app_metric():
+    m = GWAppMetric("bench")
+    m.eclipse()
+
+
+_site = GWAppMetricSite("bench")
+def _bench_app_metric_site():
+    with _site:
+        pass
+
+
+def _measure(func, number : int, repeat : int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e9
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    metric._C_capsule = _noop_capsule
+
+    results = {}
+    results["legacy (per-call hash)"] = _measure(_bench_legacy, args.number, args.repeat)
+    results["GWAppMetric"] = _measure(_bench_app_metric, args.number, args.repeat)
+    results["GWAppMetricSite"] = _measure(_bench_app_metric_site, args.number, args.repeat)
+    GWAppMetric.disable()
+    results["GWAppMetric (disabled)"] = _measure(_bench_app_metric, args.number, args.repeat)
+    results["GWAppMetricSite (disabled)"] = _measure(_bench_app_metric_site, args.number, args.repeat)
+    GWAppMetric.enable()
+
+    for name, ns_per_call in results.items():
+        print(f"{name:<30} {ns_per_call:>10.1f} ns/call")
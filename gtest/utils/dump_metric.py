@@ -23,6 +23,14 @@ parser.add_argument(
     required=False
 )
 
+parser.add_argument(
+    '-c', '--catalog_dir',
+    type=str,
+    default=None,
+    help='if given, dump each device under <path>/device_<index> and import it into the cached metric catalogs under this directory',
+    required=False
+)
+
 if __name__ == "__main__":
     args = parser.parse_args()
 
@@ -37,6 +45,16 @@ if __name__ == "__main__":
                 tmp_map_gw_device[device_id] = gw_device
         map_gw_device = tmp_map_gw_device
 
-    os.chdir(args.path)
-    for gw_device in map_gw_device.values():
-        gw_device.export_metric_properties(args.path)
+    if args.catalog_dir is None:
+        os.chdir(args.path)
+        for gw_device in map_gw_device.values():
+            gw_device.export_metric_properties(args.path)
+    else:
+        # each device is dumped into its own directory, so that its files could be imported as a whole
+        for device_id, gw_device in map_gw_device.items():
+            device_path = os.path.join(os.path.abspath(args.path), f"device_{device_id}")
+            os.makedirs(device_path, exist_ok=True)
+            os.chdir(device_path)
+            gw_device.export_metric_properties(device_path)
+            catalog = GWMetricCatalog.load_for_device(args.catalog_dir, device_id, metric_properties_path=device_path)
+            print(f"imported {len(catalog)} metrics of device {device_id} ({catalog.gpu_model})")
@@ -1 +1,3 @@
 from .default import *
+from .analyzer import *
+from .loader import *
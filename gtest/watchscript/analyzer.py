@@ -0,0 +1,262 @@
+import ast
+from typing import Dict, List, Optional, Set, Tuple, Any
+from loguru import logger
+
+
+# calls within WatchScript that request metrics / traces, {callee attribute, keyword of the request list}
+_METRIC_CALLS : Dict[str, Tuple[str, ...]] = {
+    "watch": ("metrics", "metric"),
+}
+_TRACE_CALLS : Dict[str, Tuple[str, ...]] = {
+    "trace": ("target", "targets"),
+}
+
+# modules whose calls are considered as profiler / tracer requests
+_PROFILER_MODULES : Set[str] = { "profiler", "inline_profiler" }
+_TRACER_MODULES : Set[str] = { "tracer" }
+
+# shortcut trace calls, e.g., tracer.watch_block_schedule()
+_TRACE_SHORTCUT_PREFIX : str = "watch_"
+
+# roots of symbolic metric / trace names, e.g., METRIC.pipe.fma.throughput.avg
+_METRIC_ROOT : str = "METRIC"
+_TRACE_ROOT : str = "TRACE"
+
+# {symbolic metric name (without root), CUPTI metric name}
+GW_SYMBOLIC_METRICS : Dict[str, str] = {
+    "pipe.fma.throughput.avg": "sm__pipe_fma_cycles_active.avg.pct_of_peak_sustained_active",
+    "pipe.alu.throughput.avg": "sm__pipe_alu_cycles_active.avg.pct_of_peak_sustained_active",
+    "pipe.fp64.throughput.avg": "sm__pipe_fp64_cycles_active.avg.pct_of_peak_sustained_active",
+    "pipe.tc.throughput.avg": "sm__pipe_tensor_cycles_active.avg.pct_of_peak_sustained_active",
+    "pipe.lsu.throughput.avg": "sm__pipe_lsu_cycles_active.avg.pct_of_peak_sustained_active",
+    "occupancy.avg": "sm__warps_active.avg.pct_of_peak_sustained_active",
+    "dram.throughput.avg": "dram__throughput.avg.pct_of_peak_sustained_elapsed",
+}
+
+
+class GWCollectionPlan:
+    """
+    Deduplicated set of metrics and traces a WatchScript could request, over all of its branches.
+    The plan is per script: which kernels a request applies to is only known at runtime, so the
+    planned metrics are collected on every kernel within a single replay (a superset of what
+    the script ends up reading). Requests that can't be resolved statically (e.g., names held
+    in variables) are listed in unresolved, the plan is incomplete then.
+    """
+
+    def __init__(
+        self,
+        metric_names : Optional[List[str]] = None,
+        trace_targets : Optional[List[str]] = None,
+        unresolved : Optional[List[str]] = None
+    ):
+        # keep the first-seen order, so that the plan is stable across analyses
+        self.metric_names : List[str] = list(dict.fromkeys(metric_names or []))
+        self.trace_targets : List[str] = list(dict.fromkeys(trace_targets or []))
+        self.unresolved : List[str] = list(dict.fromkeys(unresolved or []))
+
+
+    def merge(self, other : 'GWCollectionPlan') -> 'GWCollectionPlan':
+        return GWCollectionPlan(
+            metric_names = self.metric_names + other.metric_names,
+            trace_targets = self.trace_targets + other.trace_targets,
+            unresolved = self.unresolved + other.unresolved
+        )
+
+
+    def is_empty(self) -> bool:
+        return len(self.metric_names) == 0 and len(self.trace_targets) == 0
+
+
+    def is_complete(self) -> bool:
+        """
+        Whether every request of the WatchScript was resolved statically
+        """
+        return len(self.unresolved) == 0
+
+
+    def profile_step(self, list_events : List[Any]) -> Tuple[str, Dict[str, Any]]:
+        """
+        Build the single profile_range step collecting all planned metrics on the given events,
+        which could be passed to GWScheduler.execute_steps
+        """
+        return ("profile_range", { "list_events": list_events, "list_metric_names": self.metric_names })
+
+
+    def steps(self, list_events : List[Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Build the scheduler steps collecting the plan on the given events; no scheduler step
+        collects traces yet, planned trace targets are left to the WatchScript and reported
+        """
+        if len(self.trace_targets) > 0:
+            logger.warning(
+                f"no scheduler step collects traces, planned trace targets are left to the WatchScript: "
+                f"{', '.join(self.trace_targets)}"
+            )
+        return [ self.profile_step(list_events) ] if len(self.metric_names) > 0 else []
+
+
+    def __repr__(self) -> str:
+        return (
+            f"GWCollectionPlan(metric_names={self.metric_names}, trace_targets={self.trace_targets}, "
+            f"unresolved={self.unresolved})"
+        )
+
+
+class _GWWatchScriptVisitor(ast.NodeVisitor):
+    def __init__(self, symbolic_metrics : Dict[str, str]):
+        self._symbolic_metrics : Dict[str, str] = symbolic_metrics
+        self.metric_names : List[str] = []
+        self.trace_targets : List[str] = []
+        self.unresolved : List[str] = []
+
+        # names bound by imports, {local name, profiler / tracer module name},
+        # and {local name, (module name, function name)} of imported functions
+        self._module_aliases : Dict[str, str] = {}
+        self._function_aliases : Dict[str, Tuple[str, str]] = {}
+
+
+    def collect_imports(self, tree : ast.AST):
+        """
+        Record the aliases of profiler / tracer modules and functions imported anywhere in the script,
+        e.g., "import gtest.script.profiler as p" or "from gtest.script.profiler import watch"
+        """
+        module_names = _PROFILER_MODULES | _TRACER_MODULES
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    module_name = alias.name.split(".")[-1]
+                    if alias.asname is not None and module_name in module_names:
+                        self._module_aliases[alias.asname] = module_name
+            elif isinstance(node, ast.ImportFrom) and node.module is not None:
+                for alias in node.names:
+                    local_name = alias.asname if alias.asname is not None else alias.name
+                    if alias.name in module_names:
+                        self._module_aliases[local_name] = alias.name
+                    elif node.module.split(".")[-1] in module_names:
+                        self._function_aliases[local_name] = (node.module.split(".")[-1], alias.name)
+
+
+    def __resolve_callee(self, callee : List[str]) -> Optional[Tuple[str, str]]:
+        if len(callee) == 1:
+            return self._function_aliases.get(callee[0], None)
+        if len(callee) == 2 and callee[0] in self._module_aliases:
+            return self._module_aliases[callee[0]], callee[1]
+        return callee[-2], callee[-1]
+
+
+    def visit_Call(self, node : ast.Call):
+        callee = _attribute_chain(node.func)
+        resolved = self.__resolve_callee(callee) if callee is not None else None
+        if resolved is not None:
+            module_name, func_name = resolved
+
+            if module_name in _PROFILER_MODULES and func_name in _METRIC_CALLS:
+                for request in _requested_values(node, _METRIC_CALLS[func_name]):
+                    self.metric_names += _collect_names(request, _METRIC_ROOT, self.unresolved, self._symbolic_metrics)
+
+            elif module_name in _TRACER_MODULES and func_name in _TRACE_CALLS:
+                for request in _requested_values(node, _TRACE_CALLS[func_name]):
+                    self.trace_targets += _collect_names(request, _TRACE_ROOT, self.unresolved)
+
+            elif module_name in _TRACER_MODULES and func_name.startswith(_TRACE_SHORTCUT_PREFIX):
+                self.trace_targets.append(func_name[len(_TRACE_SHORTCUT_PREFIX):])
+
+            elif func_name in _METRIC_CALLS or func_name in _TRACE_CALLS:
+                # a request through a callee not known to be the profiler / tracer
+                self.unresolved.append(ast.unparse(node))
+
+        elif callee is not None and (callee[-1] in _METRIC_CALLS or callee[-1] in _TRACE_CALLS):
+            # e.g., a bare watch() not imported from the profiler
+            self.unresolved.append(ast.unparse(node))
+
+        self.generic_visit(node)
+
+
+def _attribute_chain(node : ast.AST) -> Optional[List[str]]:
+    """
+    Flatten a.b.c into ['a', 'b', 'c'], return None if the expression isn't a pure attribute chain
+    """
+    chain : List[str] = []
+    while isinstance(node, ast.Attribute):
+        chain.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    chain.append(node.id)
+    return chain[::-1]
+
+
+def _requested_values(node : ast.Call, keywords : Tuple[str, ...]) -> List[ast.AST]:
+    values : List[ast.AST] = [ kw.value for kw in node.keywords if kw.arg in keywords ]
+    if len(values) == 0 and len(node.args) > 0:
+        values.append(node.args[0])
+    return values
+
+
+def _collect_names(
+    node : ast.AST,
+    root : str,
+    unresolved : List[str],
+    symbolic_names : Optional[Dict[str, str]] = None
+) -> List[str]:
+    """
+    Collect metric / trace names from the requested value, which could be a string,
+    a symbolic name (e.g., METRIC.pipe.fma.throughput.avg), or containers of them;
+    string constants that are paired with a symbolic name are treated as labels.
+    Symbolic names are translated by symbolic_names if given, requests which can't
+    be resolved are appended to unresolved as source text
+    """
+    chain = _attribute_chain(node)
+    if chain is not None and chain[0] == root and len(chain) > 1:
+        name = ".".join(chain[1:])
+        if symbolic_names is None:
+            return [ name ]
+        if name in symbolic_names:
+            return [ symbolic_names[name] ]
+        unresolved.append(ast.unparse(node))
+        return []
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [ node.value ]
+
+    if isinstance(node, ast.Dict):
+        elts = [ v for v in node.values if v is not None ]
+    elif isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        elts = node.elts
+    else:
+        unresolved.append(ast.unparse(node))
+        return []
+
+    names : List[str] = []
+    has_symbolic = any(
+        (c := _attribute_chain(e)) is not None and c[0] == root for e in elts
+    )
+    for elt in elts:
+        if has_symbolic and isinstance(elt, ast.Constant):
+            continue
+        names += _collect_names(elt, root, unresolved, symbolic_names)
+    return names
+
+
+def analyse_watchscript(
+    source : str,
+    filename : str = "<watchscript>",
+    symbolic_metrics : Optional[Dict[str, str]] = None
+) -> GWCollectionPlan:
+    """
+    Statically walk the WatchScript and collect every metric and trace target it could request,
+    regardless of which branch would be taken at runtime
+
+    Parameters:
+        source (str): source code of the WatchScript
+        filename (str): file name used in syntax error messages
+        symbolic_metrics (dict): {symbolic metric name, CUPTI metric name}, default to be GW_SYMBOLIC_METRICS
+    """
+    visitor = _GWWatchScriptVisitor(symbolic_metrics if symbolic_metrics is not None else GW_SYMBOLIC_METRICS)
+    tree = ast.parse(source, filename=filename)
+    visitor.collect_imports(tree)
+    visitor.visit(tree)
+    return GWCollectionPlan(visitor.metric_names, visitor.trace_targets, visitor.unresolved)
+
+
+__all__ = [ "GWCollectionPlan", "GW_SYMBOLIC_METRICS", "analyse_watchscript" ]
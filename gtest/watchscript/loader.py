@@ -0,0 +1,151 @@
+import os
+import sys
+import types
+import hashlib
+import threading
+from typing import Callable, Dict, Optional
+from loguru import logger
+
+from .default import *
+from .analyzer import *
+
+
+class GWWatchScriptLoader:
+    """
+    Load the WatchScript from file, and hot-reload it once the file is changed.
+    Compiled code objects are cached by the content hash of the script, so that
+    touching the file (or reverting to a previous version) doesn't trigger recompilation.
+    """
+
+    def __init__(self, watchscript_path : str, module_name : str = "watchscript_module"):
+        self._watchscript_path : str = os.path.abspath(watchscript_path)
+        self._module_name : str = module_name
+        self._watchscript : Callable = WatchScriptDefault
+        self._collection_plan : GWCollectionPlan = GWCollectionPlan()
+        self._lock : threading.Lock = threading.Lock()
+
+        # state of the loaded file
+        self._mtime_ns : Optional[int] = None
+        self._content_hash : Optional[str] = None
+
+        # {content_hash, compiled code object}
+        self._code_cache : Dict[str, types.CodeType] = {}
+
+        # {content_hash, collection plan obtained from static analysis}
+        self._plan_cache : Dict[str, GWCollectionPlan] = {}
+
+        if os.path.exists(self._watchscript_path):
+            self.reload()
+        else:
+            logger.warning(
+                f"no WatchScript given, using default watchscript"
+            )
+
+
+    @property
+    def watchscript(self) -> Callable:
+        """
+        The currently active WatchScript callable
+        """
+        return self._watchscript
+
+
+    @property
+    def collection_plan(self) -> GWCollectionPlan:
+        """
+        Metrics and traces the active WatchScript could request, obtained from static analysis
+        """
+        return self._collection_plan
+
+
+    def reload(self) -> bool:
+        """
+        Reload the WatchScript if the file has been changed since last load
+
+        Returns:
+            bool: whether the active WatchScript was swapped
+        """
+        with self._lock:
+            try:
+                mtime_ns = os.stat(self._watchscript_path).st_mtime_ns
+            except OSError:
+                # file removed after loaded, keep using the current version
+                return False
+            if mtime_ns == self._mtime_ns:
+                return False
+
+            try:
+                with open(self._watchscript_path, "rb") as f:
+                    source = f.read()
+            except OSError as e:
+                logger.error(f"failed to read WatchScript {self._watchscript_path}: {e}")
+                return False
+            self._mtime_ns = mtime_ns
+
+            content_hash = hashlib.sha256(source).hexdigest()
+            if content_hash == self._content_hash:
+                return False
+
+            try:
+                watchscript = self._load(source, content_hash)
+            except Exception as e:
+                logger.error(
+                    f"failed to load WatchScript from {self._watchscript_path}, "
+                    f"keep using previous version: {e}"
+                )
+                return False
+
+            self._content_hash = content_hash
+            self._watchscript = watchscript
+            self._collection_plan = self._analyse(source, content_hash)
+            return True
+
+
+    def _analyse(self, source : bytes, content_hash : str) -> GWCollectionPlan:
+        plan = self._plan_cache.get(content_hash, None)
+        if plan is None:
+            try:
+                plan = analyse_watchscript(source, filename=self._watchscript_path)
+            except Exception as e:
+                # analysis is only an optimization, the WatchScript is still usable without it
+                logger.warning(f"failed to analyse WatchScript {self._watchscript_path}: {e}")
+                plan = GWCollectionPlan()
+            self._plan_cache[content_hash] = plan
+            logger.info(
+                f"WatchScript requests {len(plan.metric_names)} metrics and "
+                f"{len(plan.trace_targets)} traces"
+            )
+            if not plan.is_complete():
+                logger.warning(
+                    f"requests of WatchScript {self._watchscript_path} can't be resolved statically, "
+                    f"the collection plan is incomplete: {', '.join(plan.unresolved)}"
+                )
+        return plan
+
+
+    def _load(self, source : bytes, content_hash : str) -> Callable:
+        code = self._code_cache.get(content_hash, None)
+        if code is None:
+            code = compile(source, self._watchscript_path, "exec")
+            self._code_cache[content_hash] = code
+
+        # execute inside a fresh module, only publish it if the execution succeeds
+        module = types.ModuleType(self._module_name)
+        module.__file__ = self._watchscript_path
+        exec(code, module.__dict__)
+        sys.modules[self._module_name] = module
+
+        if hasattr(module, "WatchScript"):
+            logger.info(
+                f"WatchScript found in {self._watchscript_path}"
+            )
+            return module.WatchScript
+        else:
+            logger.warning(
+                f"Callable 'WatchScript' not defined in {self._watchscript_path}, "
+                f"using default watchscript"
+            )
+            return WatchScriptDefault
+
+
+__all__ = [ "GWWatchScriptLoader" ]
@@ -0,0 +1,149 @@
+import os
+import time
+import threading
+import importlib.util
+
+import pytest
+
+
+# gtest loads the native libraries on import, the timer itself is pure python
+def _load_event_timer():
+    path = os.path.join(os.path.dirname(__file__), "..", "..", "gtest", "common", "event_timer.py")
+    spec = importlib.util.spec_from_file_location("_gw_event_timer", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+event_timer = _load_event_timer()
+
+
+def _fake_timer(**kwargs):
+    return event_timer.GWDeferredEventTimer(event_factory=event_timer.GWFakeEvent, **kwargs)
+
+
+def test_resolve_all_invokes_callbacks():
+    timer = _fake_timer()
+    latencies = []
+    for _ in range(3):
+        pair = timer.start()
+        timer.stop(pair, latencies.append)
+    assert timer.nb_pending == 3
+    timer.resolve_all()
+    assert timer.nb_pending == 0
+    assert len(latencies) == 3 and all(latency >= 0 for latency in latencies)
+
+
+def test_max_pending_resolves_oldest():
+    timer = _fake_timer(max_pending=2)
+    latencies = []
+    for _ in range(5):
+        timer.stop(timer.start(), latencies.append)
+    assert timer.nb_pending <= 2
+    timer.resolve_all()
+    assert len(latencies) == 5
+
+
+def test_pairs_are_reused():
+    timer = _fake_timer()
+    pair = timer.start()
+    timer.stop(pair, lambda _: None)
+    timer.resolve_all()
+    assert timer.start() is pair
+
+
+def test_discard_pending_drops_callbacks():
+    timer = _fake_timer()
+    latencies = []
+    timer.stop(timer.start(), latencies.append)
+    assert timer.discard_pending() == 1
+    timer.resolve_all()
+    assert latencies == []
+
+
+def test_cancel_returns_pair():
+    timer = _fake_timer()
+    pair = timer.start()
+    timer.cancel(pair)
+    assert timer.nb_pending == 0 and timer.start() is pair
+
+
+def test_poller_never_calls_back_after_discard():
+    timer = _fake_timer()
+    discarded = threading.Event()
+    late_callbacks = []
+
+    def callback(latency):
+        if discarded.is_set():
+            late_callbacks.append(latency)
+
+    timer.start_poller(poll_interval=0.001)
+    try:
+        for _ in range(200):
+            timer.stop(timer.start(), callback)
+        timer.discard_pending()
+        discarded.set()
+        time.sleep(0.01)
+    finally:
+        timer.stop_poller()
+    assert late_callbacks == []
+
+
+class _FakeRangeProfiler:
+    """
+    Stand-in of the native profiler, only records the range stack
+    """
+
+    def __init__(self):
+        self.ranges = []
+        self.nb_pops = 0
+
+    def RangeProfile_is_session_created(self):
+        return True
+
+    def RangeProfile_push_range(self, range_name):
+        self.ranges.append(range_name)
+
+    def RangeProfile_pop_range(self):
+        self.nb_pops += 1
+
+    def RangeProfile_flush_data(self):
+        pass
+
+
+@pytest.fixture
+def range_profile():
+    try:
+        from gtest.toolbox.inline_profiler.profiler import GWProfiler
+    except (ImportError, RuntimeError) as e:
+        pytest.skip(f"native toolbox unavailable: {e}")
+    profile = GWProfiler._range_profile(_FakeRangeProfiler())
+    profile.set_latency_timer(_fake_timer())
+    return profile
+
+
+def test_reset_drops_pending_and_open_ranges(range_profile):
+    handle = range_profile.begin_range_latency()
+    range_profile.end_range_latency("pending", handle)
+    open_handle = range_profile.begin_range_latency()
+    range_profile.reset_aux_info()
+    range_profile.end_range_latency("open", open_handle)
+    range_profile.end_range_latency("fresh", range_profile.begin_range_latency())
+    assert len(range_profile.export_range_latency_states()) == 1
+    assert range_profile.get_range_latency("fresh").count == 1
+
+
+def test_inline_range_pops_on_exception(range_profile):
+    torch_adaptor = pytest.importorskip("gtest.toolbox.inline_profiler.torch_adaptor")
+
+    class _Owner:
+        gw_profiler = type("_Profiler", (), {
+            "range_profile": range_profile,
+            "is_range_profiling": lambda self: True,
+        })()
+
+    with pytest.raises(ValueError):
+        with torch_adaptor.torch_adapt.declare_profile_range_inline(_Owner(), "raising", do_measure_latency=True):
+            raise ValueError()
+    range_profile.flush_data()
+    assert range_profile._gw_profiler.nb_pops == 1
+    assert range_profile.get_range_latency("raising") is None